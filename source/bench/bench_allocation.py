@@ -0,0 +1,39 @@
+"""
+Softmax heuristic vs. water-filling optimizer.
+
+    python -m source.bench.bench_allocation
+
+Reports the time to compute the split alone, the full calculate_budget_allocation call
+per strategy, and the expected conversions each split achieves under the saturating curves.
+"""
+import timeit
+
+import numpy as np
+
+from source.models.channels import get_registry
+from source.routes.optimization import calculate_budget_allocation, conversions_from_spend, water_filling_allocation
+from source.fixtures import PRIORS, ASSUMPTIONS
+
+
+def best_of(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number
+
+
+def main(budget=10000):
+    channels = list(PRIORS)
+    max_conv, K = get_registry().curve_params(channels)
+    assumptions = {ch: frac / 4 for ch, frac in ASSUMPTIONS.items()}
+    min_budgets = np.array([assumptions[ch] * budget for ch in channels])
+
+    solve = best_of(lambda: water_filling_allocation(max_conv, K, min_budgets, budget), 2000)
+    print(f"water_filling split alone: {solve * 1e6:8.1f} us")
+
+    for strategy in ('softmax', 'water_filling'):
+        call = best_of(lambda: calculate_budget_allocation(PRIORS, budget, assumptions, seed=0, strategy=strategy), 20)
+        _, allocation = calculate_budget_allocation(PRIORS, budget, assumptions, seed=0, strategy=strategy)
+        expected = conversions_from_spend(np.array([allocation[ch] for ch in channels]), max_conv, K).sum()
+        print(f"{strategy:>14}: {call * 1e3:8.2f} ms per call, expected conversions {expected:8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Scaling in the number of channels.
+
+    python -m source.bench.bench_channels [n_simulations]
+
+Builds synthetic registries of 4, 32 and 256 channels (random curve parameters and
+default priors) and times the registry lookup (channel_model) and a full
+calculate_budget_allocation per strategy. The last column is the time per channel,
+which stays roughly flat when the cost is linear in the channel count.
+"""
+import sys
+import timeit
+
+import numpy as np
+
+from source.models.channels import ChannelRegistry, set_registry
+from source.routes.optimization import calculate_budget_allocation, channel_model
+
+
+CHANNEL_COUNTS = (4, 32, 256)
+
+
+def synthetic_registry(n_channels, seed=0):
+    rng = np.random.default_rng(seed)
+    entries = []
+    for i in range(n_channels):
+        cpm, ctr, cvr = rng.uniform(4, 40), rng.uniform(0.004, 0.05), rng.uniform(0.005, 0.1)
+        entries.append({
+            'name': f'channel_{i}',
+            'max_conv': float(rng.uniform(50, 600)),
+            'K': float(rng.uniform(300, 3000)),
+            'priors': {
+                metric: {'lower': 0.7 * mean, 'mean': mean, 'upper': 1.3 * mean}
+                for metric, mean in (('CPM', cpm), ('CTR', ctr), ('CVR', cvr))
+            },
+        })
+    return ChannelRegistry(entries)
+
+def best_of(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number
+
+
+def main(n_simulations=5000):
+    old = set_registry(None)
+    try:
+        print(f"{'channels':>8} {'case':>14} {'ms/call':>9} {'us/channel':>11}")
+        for n_channels in CHANNEL_COUNTS:
+            set_registry(synthetic_registry(n_channels))
+            # Only names: metrics come from the registry defaults
+            priors = {f'channel_{i}': {} for i in range(n_channels)}
+            budget = 1000.0 * n_channels
+            cases = {'channel_model': lambda: channel_model(priors)}
+            for strategy in ('softmax', 'water_filling'):
+                cases[strategy] = lambda strategy=strategy: calculate_budget_allocation(
+                    priors, budget, n_simulations=n_simulations, seed=0, strategy=strategy
+                )
+            for name, fn in cases.items():
+                elapsed = best_of(fn, 3)
+                print(f"{n_channels:>8} {name:>14} {elapsed * 1e3:9.2f} {elapsed * 1e6 / n_channels:11.1f}")
+    finally:
+        set_registry(old)
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:]))
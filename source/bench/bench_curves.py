@@ -0,0 +1,82 @@
+"""
+Historical spend ingestion and curve fitting.
+
+    python -m source.bench.bench_curves [rows ...]
+
+Writes a synthetic daily-spend CSV per size (default 1M and 10M rows; 4 channels of
+known curves, 8 companies, 20% noise) to the temp directory, then ingests and fits each
+in a fresh interpreter so peak RSS is per run. Flat memory shows as about the same
+peak RSS for every size. Also prints how far the fitted curves are from the true ones.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+TRUE_CURVES = {'google': (20, 70), 'meta': (5, 25), 'tiktok': (3, 15), 'linkedin': (7, 35)}
+COMPANIES = [f'company {i}' for i in range(8)]
+WRITE_CHUNK = 1_000_000
+
+
+def synthetic_csv(rows, path, seed=0):
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    channels = list(TRUE_CURVES)
+    max_conv = np.array([TRUE_CURVES[ch][0] for ch in channels])
+    K = np.array([TRUE_CURVES[ch][1] for ch in channels])
+    with open(path, 'w') as f:
+        f.write('company,channel,spend,conversions\n')
+        for start in range(0, rows, WRITE_CHUNK):
+            n = min(WRITE_CHUNK, rows - start)
+            ch = rng.integers(len(channels), size=n)
+            spend = rng.uniform(5, 300, n)
+            conversions = np.maximum(max_conv[ch] * spend / (spend + K[ch]) * (1 + 0.2 * rng.standard_normal(n)), 0)
+            pd.DataFrame({
+                'company': np.array(COMPANIES)[rng.integers(len(COMPANIES), size=n)],
+                'channel': np.array(channels)[ch],
+                'spend': spend.round(2),
+                'conversions': conversions.round(3),
+            }).to_csv(f, header=False, index=False)
+
+def run(path):
+    """Ingest and fit path in this process; prints elapsed seconds, peak RSS and fit error"""
+    import resource
+    from source.curve_fitting import fit_curves, ingest
+
+    start = time.perf_counter()
+    aggregator = ingest(path)
+    fits = fit_curves(aggregator, period_days=1)
+    elapsed = time.perf_counter() - start
+    errors = [
+        max(abs(fit['max_conv'] / TRUE_CURVES[fit['channel']][0] - 1), abs(fit['K'] / TRUE_CURVES[fit['channel']][1] - 1))
+        for fit in fits
+    ]
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{aggregator.n_rows} {elapsed:.2f} {peak_mb:.0f} {max(errors):.4f}")
+
+
+def main(*sizes):
+    sizes = sizes or (1_000_000, 10_000_000)
+    print(f"{'rows':>11} {'seconds':>8} {'rows/s':>11} {'peak RSS':>9} {'max rel. error':>15}")
+    for rows in sizes:
+        path = os.path.join(tempfile.gettempdir(), f'bench_curves_{rows}.csv')
+        if not os.path.exists(path):
+            synthetic_csv(rows, path)
+        out = subprocess.run(
+            [sys.executable, '-m', 'source.bench.bench_curves', '--run', path],
+            capture_output=True, text=True, check=True,
+        ).stdout.split()
+        n_rows, elapsed, peak_mb, error = int(out[0]), float(out[1]), out[2], float(out[3])
+        print(f"{n_rows:>11} {elapsed:8.2f} {n_rows / elapsed:11.0f} {peak_mb:>6} MB {error:15.4f}")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        run(sys.argv[2])
+    else:
+        main(*(int(a) for a in sys.argv[1:]))
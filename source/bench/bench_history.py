@@ -0,0 +1,61 @@
+"""
+Allocation history writes: background batches against a commit per run.
+
+    python -m source.bench.bench_history [n_runs]
+
+Records n_runs (default 20,000) runs shaped like a 4-channel /allocate result into a
+fresh database in the temp directory. For the batched writer, the caller-side cost
+(record() per run) and the time until everything is committed (flush()). The
+baseline writes the same rows from the caller with one committed INSERT each.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from source.models.allocation_history import AllocationHistory
+
+
+CHANNELS = ('google', 'meta', 'tiktok', 'linkedin')
+
+
+def synthetic_run(i):
+    budget = 1000.0 + i
+    return {
+        'company': f'company {i % 500}', 'goal': ('leads', 'sales')[i % 2], 'budget': budget,
+        'inputs': {'company': f'company {i % 500}', 'budget': budget, 'options': {'seed': i, 'n_simulations': 5000}},
+        'priors_hash': f'{i % 97:064x}',
+        'allocation': {ch: budget / len(CHANNELS) for ch in CHANNELS},
+        'summary': {
+            'index': list(CHANNELS) + ['total'], 'attrs': {},
+            'P10': [1.0] * 5, 'mean': [2.0] * 5, 'P90': [3.0] * 5,
+        },
+        'priors_ms': 0.1, 'simulation_ms': 25.0,
+    }
+
+
+def main(n_runs=20_000):
+    runs = [synthetic_run(i) for i in range(n_runs)]
+    with tempfile.TemporaryDirectory() as tmp:
+        history = AllocationHistory(os.path.join(tmp, 'batched.db'), max_pending=n_runs)
+        start = time.perf_counter()
+        for run in runs:
+            history.record(run)
+        recorded = time.perf_counter() - start
+        history.flush()
+        committed = time.perf_counter() - start
+        history.close()
+
+        baseline = AllocationHistory(os.path.join(tmp, 'per_row.db'))
+        start = time.perf_counter()
+        for run in runs:
+            baseline._write([baseline._row(run)])
+        per_row = time.perf_counter() - start
+
+    print(f"{'writer':>18} {'caller us/run':>14} {'runs/s committed':>17}")
+    print(f"{'background batch':>18} {recorded / n_runs * 1e6:14.1f} {n_runs / committed:17.0f}")
+    print(f"{'commit per run':>18} {per_row / n_runs * 1e6:14.1f} {n_runs / per_row:17.0f}")
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:]))
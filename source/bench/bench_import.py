@@ -0,0 +1,80 @@
+"""
+Cold start: import time of the app and of create_app(), each in a fresh interpreter.
+
+    python -m source.bench.bench_import [budget_ms]
+
+Runs every case under `python -X importtime`, reports the wall time and the slowest
+top-level imports by cumulative time, and lists which of the heavy optional modules
+were loaded. With budget_ms it exits non-zero when create_app() exceeds it, so it can
+gate CI.
+"""
+import os
+import re
+import subprocess
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CASES = {
+    'import source.main': 'import source.main',
+    "create_app('testing')": "import source.main; source.main.create_app('testing')",
+}
+
+# Needed only on some paths; none of these should load at startup
+HEAVY_MODULES = ('pandas', 'matplotlib', 'json5', 'google.genai')
+
+IMPORTTIME = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def run_case(code, runs=5):
+    """Best wall time in ms over runs, the -X importtime lines of the last run, heavy modules loaded"""
+    probe = f"{code}; import sys; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', probe],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        )
+        best = min(best, (time.perf_counter() - start) * 1000)
+    imports = [
+        (int(cumulative), len(indent), module)
+        for _, cumulative, indent, module in IMPORTTIME.findall(result.stderr)
+    ]
+    loaded = [m for m in result.stdout.strip().split(',') if m]
+    return best, imports, loaded
+
+def interpreter_ms(runs=5):
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        best = min(best, (time.perf_counter() - start) * 1000)
+    return best
+
+
+def main(budget_ms=None, top=10):
+    bare = interpreter_ms()
+    print(f"bare interpreter: {bare:.0f} ms")
+    elapsed = {}
+    for name, code in CASES.items():
+        wall, imports, loaded = run_case(code)
+        elapsed[name] = wall
+        print(f"\n{name}: {wall:.0f} ms wall, {wall - bare:.0f} ms over the bare interpreter")
+        print(f"  heavy modules loaded: {', '.join(loaded) or 'none'}")
+        # Top-level entries only (one space of indent): nested imports are counted in them
+        roots = sorted((imp for imp in imports if imp[1] == 1), reverse=True)[:top]
+        for cumulative, _, module in roots:
+            print(f"  {cumulative / 1000:8.1f} ms  {module}")
+
+    if budget_ms is not None:
+        worst = elapsed["create_app('testing')"]
+        if worst > budget_ms:
+            print(f"\ncreate_app took {worst:.0f} ms, over the {budget_ms:.0f} ms budget")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(*(float(a) for a in sys.argv[1:2]))
@@ -0,0 +1,34 @@
+"""
+Scaling benchmark for the process-pool simulation backend.
+
+    python -m source.bench.bench_parallel [n_simulations]
+
+Prints scenarios/second for 1..cpu_count workers.
+"""
+import os
+import sys
+import time
+
+from source.routes.optimization import calculate_budget_allocation
+from source.routes.parallel import shutdown_pool
+from source.fixtures import PRIORS, ASSUMPTIONS
+
+
+def main(n_simulations=4_000_000):
+    counts = sorted({1, 2, 4, 8, 16, 32, os.cpu_count() or 1})
+    counts = [c for c in counts if c <= (os.cpu_count() or 1)]
+    baseline = None
+    print(f"{'workers':>8} {'seconds':>9} {'scenarios/s':>14} {'speedup':>8}")
+    for n_workers in counts:
+        # Warm the pool so worker start-up is not part of the measurement
+        calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, n_simulations=n_workers * 1000, seed=0, n_workers=n_workers)
+        start = time.perf_counter()
+        calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, n_simulations=n_simulations, seed=0, n_workers=n_workers)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{n_workers:>8} {elapsed:>9.3f} {n_simulations / elapsed:>14,.0f} {baseline / elapsed:>8.2f}")
+    shutdown_pool()
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:]))
@@ -0,0 +1,71 @@
+"""
+LLM output parsing: the old regex + json5 path vs. the single-pass parser.
+
+    python -m source.bench.bench_parser
+
+Runs over llm_corpus.jsonl, a set of real-world shaped answers (fenced and bare JSON,
+json5-isms, braces in prose or Sources, a truncated final brace, ...). Reports how many
+cases each path parses and the time per document, one-shot and fed in 64-char chunks.
+"""
+import json
+import os
+import re
+import timeit
+
+import json5
+
+from source.routes.parsing import LLMOutputParser, parse_llm_output
+
+
+CORPUS = os.path.join(os.path.dirname(__file__), 'llm_corpus.jsonl')
+
+
+def load_corpus(path=CORPUS):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def legacy_parse(text):
+    """What llm.py did before: greedy block + json5, then one regex scan per extra field"""
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    priors = json5.loads(match.group(0)) if match else None
+    urls = re.findall(r'https?://\S+', text)
+    citations = [int(m) for m in re.findall(r"\[([^\]]+)\]", text) if m.isdigit()]
+    return priors, urls, citations
+
+
+def streamed_parse(text, chunk=64):
+    parser = LLMOutputParser()
+    for start in range(0, len(text), chunk):
+        parser.feed(text[start:start + chunk])
+    return parser.close()
+
+
+def succeeds(fn, text):
+    try:
+        return fn(text)[0] is not None
+    except ValueError:
+        return False
+
+
+def best_of(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number
+
+
+def main():
+    corpus = load_corpus()
+    texts = [case['text'] for case in corpus]
+    print(f"{len(corpus)} documents, {sum(map(len, texts)) / len(texts):.0f} chars on average")
+
+    for name, fn in (('legacy', legacy_parse), ('single-pass', parse_llm_output), ('streamed', streamed_parse)):
+        parsed = [succeeds(fn, text) for text in texts]
+        failed = [case['name'] for case, ok in zip(corpus, parsed) if not ok]
+        # Time only the documents this path can parse, so failures do not skew it
+        timed = [text for text, ok in zip(texts, parsed) if ok]
+        per_doc = best_of(lambda: [fn(text) for text in timed], 20) / len(timed)
+        print(f"{name:>12}: {sum(parsed):2d}/{len(texts)} parsed, {per_doc * 1e6:8.1f} us per document"
+              + (f"  (failed: {', '.join(failed)})" if failed else ''))
+
+
+if __name__ == '__main__':
+    main()
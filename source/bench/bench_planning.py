@@ -0,0 +1,61 @@
+"""
+Multi-month planning with adstock at a few horizon and channel counts.
+
+    python -m source.bench.bench_planning [n_simulations]
+
+Uses synthetic registries (see bench_channels) with random adstock decays in [0, 0.7)
+and minimums of 2% per channel (at most half the budget in all). Times the solver alone and the full
+plan_budget_allocation (solver plus the Monte Carlo bands), with monthly budgets fixed
+and flexible, and reports the solver's iterations and the lift in expected
+conversions over planning each month on its own.
+"""
+import sys
+import timeit
+
+import numpy as np
+
+from source.bench.bench_channels import synthetic_registry
+from source.models.channels import set_registry
+from source.routes.optimization import channel_model, scale_minimums
+from source.routes.planning import plan_budget_allocation, solve_plan
+
+
+CASES = ((12, 4), (12, 20), (36, 20), (12, 100))
+
+
+def best_of(fn, number=3):
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number
+
+
+def main(n_simulations=2000):
+    print(f"{'months':>7} {'channels':>9} {'mode':>9} {'iterations':>11} {'solver ms':>10} {'plan ms':>9} {'lift':>7}")
+    for n_months, n_channels in CASES:
+        old = set_registry(synthetic_registry(n_channels))
+        try:
+            rng = np.random.default_rng(n_channels)
+            priors = {f'channel_{i}': {} for i in range(n_channels)}
+            decay = dict(zip(priors, rng.uniform(0, 0.7, n_channels)))
+            fraction = min(0.02, 0.5 / n_channels)
+            assumptions = dict.fromkeys(priors, fraction)
+            budgets = np.full(n_months, 2000.0 * n_channels)
+
+            _, _, _, max_conv, K = channel_model(priors)
+            decay_array = np.array(list(decay.values()))
+            min_budgets = scale_minimums(budgets[:, None] * np.full(n_channels, fraction), budgets)
+            for flexible in (False, True):
+                solver = best_of(lambda: solve_plan(max_conv, K, decay_array, min_budgets, budgets, flexible=flexible))
+                plan = plan_budget_allocation(priors, budgets, assumptions, adstock_decay=decay, flexible=flexible,
+                                              n_simulations=n_simulations, seed=0)
+                elapsed = best_of(lambda: plan_budget_allocation(
+                    priors, budgets, assumptions, adstock_decay=decay, flexible=flexible,
+                    n_simulations=n_simulations, seed=0,
+                ))
+                lift = plan['expected_conversions'] / plan['myopic_conversions'] - 1
+                print(f"{n_months:>7} {n_channels:>9} {'flexible' if flexible else 'monthly':>9} "
+                      f"{plan['solver']['iterations']:>11} {solver * 1e3:10.1f} {elapsed * 1e3:9.1f} {lift:7.2%}")
+        finally:
+            set_registry(old)
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:]))
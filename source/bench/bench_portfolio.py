@@ -0,0 +1,59 @@
+"""
+Portfolio mode against a per-account loop.
+
+    python -m source.bench.bench_portfolio [n_accounts ...]
+
+Builds portfolios (default 1,000 and 10,000 accounts; a mix of the full registry and
+two-channel accounts, random floors, a 20% google minimum) and times
+portfolio_allocation end to end. For scale, the last column times
+calculate_budget_allocation per account (water filling, each account given its
+portfolio spend) on a sample of LOOP_SAMPLE accounts, extrapolated to the portfolio.
+"""
+import sys
+import time
+
+import numpy as np
+
+from source.routes.optimization import calculate_budget_allocation
+from source.routes.portfolio import PORTFOLIO_SIMULATIONS, portfolio_allocation
+
+
+LOOP_SAMPLE = 200
+BUDGET_PER_ACCOUNT = 4000.0
+
+
+def synthetic_portfolio(n_accounts, seed=0):
+    rng = np.random.default_rng(seed)
+    channels_list = [None if i % 3 else ['google', 'meta'] for i in range(n_accounts)]
+    floors = rng.uniform(0, 1.5 * BUDGET_PER_ACCOUNT, n_accounts)
+    assumptions_list = [{'google': 0.2}] * n_accounts
+    return channels_list, floors, assumptions_list
+
+def main(*sizes):
+    sizes = sizes or (1_000, 10_000)
+    from source.fixtures import PRIORS
+
+    print(f"{'accounts':>8} {'seconds':>8} {'floors bound':>12} {'loop (est.)':>12}")
+    for n_accounts in sizes:
+        channels_list, floors, assumptions_list = synthetic_portfolio(n_accounts)
+        total_budget = BUDGET_PER_ACCOUNT * n_accounts
+        start = time.perf_counter()
+        result = portfolio_allocation(
+            channels_list, total_budget, floors, assumptions_list, n_simulations=PORTFOLIO_SIMULATIONS, seed=0
+        )
+        elapsed = time.perf_counter() - start
+
+        sample = range(min(LOOP_SAMPLE, n_accounts))
+        start = time.perf_counter()
+        for i in sample:
+            channels = channels_list[i] or list(PRIORS)
+            calculate_budget_allocation(
+                {ch: PRIORS[ch] for ch in channels}, result['account_spend'][i], assumptions_list[i],
+                n_simulations=PORTFOLIO_SIMULATIONS, seed=0, strategy='water_filling',
+            )
+        loop = (time.perf_counter() - start) / len(sample) * n_accounts
+        print(f"{n_accounts:>8} {elapsed:8.3f} {int(result['floor_bound'].sum()):>12} {loop:11.2f}s")
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:]))
@@ -0,0 +1,41 @@
+"""
+Cost of a sensitivity analysis against a plain allocation.
+
+    python -m source.bench.bench_sensitivity [n_simulations]
+
+Times calculate_budget_allocation, the one-at-a-time (tornado) analysis alone and
+with Sobol indices at a few sample sizes, on the test priors. The last column is the
+cost in plain allocations; a rerun per perturbed scenario would cost one per scenario.
+"""
+import sys
+import timeit
+
+from source.routes.optimization import calculate_budget_allocation
+from source.routes.sensitivity import sensitivity_analysis
+from source.fixtures import PRIORS, ASSUMPTIONS
+
+
+BUDGET = 100
+SOBOL_SAMPLES = (0, 64, 256)
+
+
+def best_of(fn, number=3):
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number
+
+
+def main(n_simulations=5000):
+    n_parameters = len(PRIORS) * 9
+    allocation = best_of(lambda: calculate_budget_allocation(PRIORS, BUDGET, ASSUMPTIONS, n_simulations, seed=0))
+    print(f"{'case':>22} {'scenarios':>10} {'ms':>9} {'allocations':>12}")
+    print(f"{'allocation':>22} {1:>10} {allocation * 1e3:9.2f} {1:12.1f}")
+    for samples in SOBOL_SAMPLES:
+        elapsed = best_of(lambda: sensitivity_analysis(
+            PRIORS, BUDGET, ASSUMPTIONS, n_simulations, seed=0, sobol_samples=samples
+        ))
+        scenarios = 1 + 2 * n_parameters + samples * (n_parameters + 2)
+        name = 'tornado' if not samples else f'tornado + sobol {samples}'
+        print(f"{name:>22} {scenarios:>10} {elapsed * 1e3:9.2f} {elapsed / allocation:12.1f}")
+
+
+if __name__ == '__main__':
+    main(*(int(a) for a in sys.argv[1:]))
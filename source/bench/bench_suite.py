@@ -0,0 +1,179 @@
+"""
+Benchmark suite: micro-benchmarks of the allocation pipeline plus a short load run.
+
+    python -m source.bench.bench_suite [--out PATH] [--compare BASELINE.json] [--tolerance 0.5]
+        [--no-load] [--load-requests 200]
+
+Micro-benchmarks (best of 5 repeats, time per call):
+  sample_param                 one scalar draw
+  conversions_from_spend       a (5000, 4) spend matrix
+  allocation_{n}               calculate_budget_allocation on the test priors, n simulations
+  extract_json_loose           per document of llm_corpus.jsonl
+  static_index / static_asset  GET / and GET /favicon.ico (gzip accepted) on create_app('testing')
+  health                       GET /api/health
+
+The load run is load_allocate against an in-process server with the stub LLM.
+
+Results are written as JSON (default source/bench/results/<UTC time>.json) with the
+git revision, Python and NumPy versions and the CPU count. With --compare, every
+micro-benchmark and the load latencies are checked against a previous results file;
+the exit status is 1 when any is more than --tolerance slower. Shared or throttled
+machines can vary by a third between runs, hence the generous default.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+
+import numpy as np
+
+from source.bench.bench_parser import load_corpus
+from source.bench.load_allocate import local_server, print_load, run_load
+from source.routes.llm import extract_json_loose
+from source.routes.optimization import calculate_budget_allocation, conversions_from_spend, sample_param
+from source.fixtures import PRIORS, ASSUMPTIONS
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+SIMULATION_SIZES = (1_000, 10_000, 100_000)
+# Load latencies checked by --compare; a percentile regresses when it grows
+LOAD_METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+
+
+def time_per_call(fn, repeat=5):
+    """Best-of-repeat seconds per call, with enough calls per repeat to take at least 0.2 s"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def micro_benchmarks():
+    """(name, zero-argument callable, calls per invocation) of every micro-benchmark"""
+    from source.main import create_app
+
+    rng = np.random.default_rng(0)
+    spend = rng.uniform(0, 5000, size=(5000, 4))
+    max_conv, K = np.array([300.0, 150.0, 90.0, 200.0]), np.array([1000.0, 600.0, 400.0, 1500.0])
+    param = PRIORS['google']['CPM']
+    # Only the documents that parse, so failures do not skew the time
+    documents = [case['text'] for case in load_corpus() if _parses(case['text'])]
+    client = create_app('testing').test_client()
+
+    cases = [
+        ('sample_param', lambda: sample_param(param), 1),
+        ('conversions_from_spend', lambda: conversions_from_spend(spend, max_conv, K), 1),
+    ]
+    for n in SIMULATION_SIZES:
+        cases.append((
+            f'allocation_{n}',
+            lambda n=n: calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, n_simulations=n, seed=0),
+            1,
+        ))
+    cases += [
+        ('extract_json_loose', lambda: [extract_json_loose(text) for text in documents], len(documents)),
+        ('static_index', lambda: client.get('/', headers={'Accept-Encoding': 'gzip'}).close(), 1),
+        ('static_asset', lambda: client.get('/favicon.ico', headers={'Accept-Encoding': 'gzip'}).close(), 1),
+        ('health', lambda: client.get('/api/health').close(), 1),
+    ]
+    return cases
+
+
+def _parses(text):
+    try:
+        extract_json_loose(text)
+        return True
+    except ValueError:
+        return False
+
+
+def run_micro():
+    results = {}
+    for name, fn, calls in micro_benchmarks():
+        fn()  # warm-up: imports, caches, first-request setup
+        results[name] = {'us': time_per_call(fn) / calls * 1e6}
+        print(f"{name:>24} {results[name]['us']:12.2f} us")
+    return results
+
+
+def environment():
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(__file__), check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'git_revision': revision,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Printed per-metric ratios to baseline; the names slower by more than tolerance"""
+    pairs = [
+        (name, entry['us'], baseline.get('micro', {}).get(name, {}).get('us'))
+        for name, entry in results['micro'].items()
+    ]
+    if results.get('load') and baseline.get('load'):
+        pairs += [
+            (f'load_{metric}', results['load']['latency'].get(metric), baseline['load']['latency'].get(metric))
+            for metric in LOAD_METRICS
+        ]
+    print(f"\n{'compared to':>24} {baseline['environment'].get('git_revision')} ({baseline['environment']['created_at']})")
+    regressions = []
+    for name, value, old in pairs:
+        if value is None or not old:
+            print(f"{name:>24} {'':>12} (no baseline)")
+            continue
+        ratio = value / old
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:>24} {ratio:11.2f}x{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the benchmark suite and store the results as JSON.')
+    parser.add_argument('--out', help='results file (default: source/bench/results/<UTC time>.json)')
+    parser.add_argument('--compare', help='previous results file to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed slowdown, e.g. 0.5 = 50%%')
+    parser.add_argument('--no-load', action='store_true', help='skip the end-to-end load run')
+    parser.add_argument('--load-requests', type=int, default=200)
+    parser.add_argument('--load-concurrency', type=int, default=8)
+    args = parser.parse_args(argv)
+
+    results = {'environment': environment(), 'micro': run_micro()}
+    if not args.no_load:
+        with local_server() as url:
+            results['load'] = run_load(url, n_requests=args.load_requests, concurrency=args.load_concurrency)
+        print_load(results['load'])
+
+    out = args.out or os.path.join(
+        RESULTS_DIR, results['environment']['created_at'].replace(':', '').replace('+0000', 'Z') + '.json'
+    )
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nresults written to {out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+End-to-end load generator for /api/allocate with a stub LLM.
+
+    python -m source.bench.load_allocate [--requests 200] [--concurrency 8] [--companies 20]
+        [--llm-latency 0.05] [--n-simulations 5000] [--url URL] [--out results.json]
+
+Without --url the app is started in this process on a free port (werkzeug, threaded),
+with LLM_BACKEND=replay answering every prompt with one recorded document from
+llm_corpus.jsonl after --llm-latency seconds, and the priors cache, curve store and
+allocation history in a temp directory. With --url a running server is targeted
+instead; start it with LLM_BACKEND=replay (see providers.backend_from_env).
+
+Requests cycle over --companies company names, so the first request of each misses
+the priors cache and the rest hit it. Reports requests per second and p50 / p95 / p99
+latency of the successful requests, and the count of every status.
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from source.bench.bench_parser import load_corpus
+from source.routes.providers import prompt_key
+
+
+STUB_DOCUMENT = 'clean_fenced'
+CONSTRAINTS = {'google_min': 25, 'meta_min': 20, 'tiktok_min': 10, 'linkedin_min': 20}
+
+
+def write_stub_replay(path, name=STUB_DOCUMENT):
+    """A one-entry replay file; the non-strict ReplayBackend serves it for any prompt"""
+    text = next(case['text'] for case in load_corpus() if case['name'] == name)
+    with open(path, 'w') as f:
+        f.write(json.dumps({'key': prompt_key(name), 'text': text, 'citations': []}) + '\n')
+
+
+@contextlib.contextmanager
+def local_server(llm_latency=0.05):
+    """Base URL of the app served from a background thread, with the stub LLM and temp stores"""
+    from werkzeug.serving import make_server
+
+    with tempfile.TemporaryDirectory() as tmp:
+        replay_path = os.path.join(tmp, 'llm_replay.jsonl')
+        write_stub_replay(replay_path)
+        env = {
+            'LLM_BACKEND': 'replay',
+            'LLM_REPLAY_PATH': replay_path,
+            'LLM_REPLAY_LATENCY': str(llm_latency),
+            'PRIORS_CACHE_PATH': os.path.join(tmp, 'priors_cache.db'),
+            'CURVE_STORE_PATH': os.path.join(tmp, 'curves.db'),
+            'ALLOCATION_HISTORY_PATH': os.path.join(tmp, 'allocations.db'),
+        }
+        saved = {name: os.environ.get(name) for name in env}
+        os.environ.update(env)
+
+        from source.main import create_app
+        from source.routes import budget, providers
+
+        # The stores and the provider are created from the environment on first use
+        budget._reset_after_fork()
+        providers.set_provider(None)
+        # One access log line per request would dominate the client's output
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        server = make_server('127.0.0.1', 0, create_app('testing'), threaded=True)
+        thread = threading.Thread(target=server.serve_forever, name='load-server', daemon=True)
+        thread.start()
+        try:
+            yield f'http://127.0.0.1:{server.server_port}'
+        finally:
+            server.shutdown()
+            thread.join()
+            if budget._allocation_history is not None:
+                budget._allocation_history.close()
+            budget._reset_after_fork()
+            providers.set_provider(None)
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+
+def allocate_payload(i, companies, n_simulations):
+    return {
+        'company_name': f'Load Test Co {i % companies}',
+        'monthly_budget': 10000,
+        'primary_goal': 'generate_leads',
+        'constraints': CONSTRAINTS,
+        'n_simulations': n_simulations,
+        'seed': i,
+    }
+
+
+def post_json(url, payload, timeout=120):
+    """(status, seconds) of one POST on a fresh connection; status 0 on a connection error"""
+    parts = urlsplit(url)
+    body = json.dumps(payload)
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+    try:
+        conn.request('POST', parts.path, body, {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        status = response.status
+    except OSError:
+        status = 0
+    finally:
+        conn.close()
+    return status, time.perf_counter() - start
+
+
+def latency_stats(seconds):
+    """Count, mean, p50 / p95 / p99 and max of latencies, in milliseconds"""
+    if not len(seconds):
+        return {'count': 0}
+    ms = np.asarray(seconds) * 1e3
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        'count': int(ms.size), 'mean_ms': float(ms.mean()),
+        'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99), 'max_ms': float(ms.max()),
+    }
+
+
+def run_load(base_url, n_requests=200, concurrency=8, companies=20, n_simulations=5000):
+    """
+    Send n_requests /api/allocate requests with up to concurrency in flight; returns
+    the settings, wall time, requests per second, status counts and latency_stats of
+    the 200s
+    """
+    url = base_url.rstrip('/') + '/api/allocate'
+    # Imports and first-use setup on the server are not part of the measurement
+    post_json(url, allocate_payload(0, 1, 1000) | {'company_name': 'Warm-up Co'})
+
+    def one(i):
+        return post_json(url, allocate_payload(i, companies, n_simulations))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(n_requests)))
+    elapsed = time.perf_counter() - start
+
+    statuses = Counter(status for status, _ in results)
+    return {
+        'requests': n_requests, 'concurrency': concurrency, 'companies': companies,
+        'n_simulations': n_simulations,
+        'seconds': elapsed,
+        'requests_per_second': n_requests / elapsed,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'latency': latency_stats([seconds for status, seconds in results if status == 200]),
+    }
+
+
+def print_load(result):
+    latency = result['latency']
+    print(f"{result['requests']} requests, concurrency {result['concurrency']}, "
+          f"{result['companies']} companies, {result['n_simulations']} simulations")
+    print(f"  {result['requests_per_second']:.1f} requests/s; statuses {result['statuses']}")
+    if latency['count']:
+        print(f"  latency ms: p50 {latency['p50_ms']:.1f}  p95 {latency['p95_ms']:.1f}  "
+              f"p99 {latency['p99_ms']:.1f}  max {latency['max_ms']:.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test /api/allocate with a stub LLM.')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--companies', type=int, default=20, help='distinct company names (priors cache misses)')
+    parser.add_argument('--n-simulations', type=int, default=5000)
+    parser.add_argument('--llm-latency', type=float, default=0.05, help='stub LLM delay in seconds')
+    parser.add_argument('--url', help='base URL of a running server instead of the in-process one')
+    parser.add_argument('--out', help='write the result as JSON to this file')
+    args = parser.parse_args(argv)
+
+    settings = dict(
+        n_requests=args.requests, concurrency=args.concurrency, companies=args.companies,
+        n_simulations=args.n_simulations,
+    )
+    if args.url:
+        result = run_load(args.url, **settings)
+    else:
+        with local_server(args.llm_latency) as url:
+            result = run_load(url, **settings)
+        result['llm_latency'] = args.llm_latency
+    print_load(result)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+import os
+
+
+BASE_DIR = os.path.dirname(__file__)
+
+
+def default_static_folder():
+    """The React build output, or the source folder itself when it has not been built"""
+    dist = os.path.join(BASE_DIR, 'dist')
+    return dist if os.path.exists(dist) else BASE_DIR
+
+
+class Config:
+    SECRET_KEY = os.getenv('SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
+    SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(BASE_DIR, 'database', 'app.db')}"
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Run db.create_all() when the app is created
+    CREATE_TABLES = True
+    STATIC_FOLDER = default_static_folder()
+    # Rebuild changed static files in the background
+    STATIC_WATCH = os.getenv('STATIC_WATCH') == '1'
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+    STATIC_WATCH = os.getenv('STATIC_WATCH', '1') == '1'
+
+
+class ProductionConfig(Config):
+    pass
+
+
+class TestingConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'testing': TestingConfig,
+}
+
+
+def get_config(name=None):
+    """Config class by name (default: APP_ENV, else production); classes pass through"""
+    if isinstance(name, type):
+        return name
+    name = name or os.getenv('APP_ENV', 'production')
+    if name not in CONFIGS:
+        raise ValueError(f"Unknown config '{name}', expected one of {sorted(CONFIGS)}")
+    return CONFIGS[name]
@@ -0,0 +1,307 @@
+"""
+Fit per-channel saturation curves from historical spend and store them for the allocator.
+
+    python -m source.curve_fitting spend.csv [--company Acme] [--period-days 30] [--dry-run]
+
+Rows are streamed in chunks into per-(company, channel) spend bins, each group's
+max_conv and K are fitted from the bins, and the fits are saved to the curve store
+(CURVE_STORE_PATH) that /api/allocate reads through budget.get_curves.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from source.models.channels import get_registry
+from source.models.curve_store import from_env as curve_store_from_env
+from source.models.storage import fold_name
+
+
+# Input columns; company is optional when the whole file is one company
+COMPANY, CHANNEL, SPEND, CONVERSIONS = 'company', 'channel', 'spend', 'conversions'
+
+DEFAULT_CHUNK_ROWS = 1_000_000
+
+# Log-spaced spend bins of SpendAggregator: adjacent edges are about 7.5% apart
+N_BINS = 256
+SPEND_RANGE = (0.1, 1e7)
+
+# Candidate K per group, relative to its mean spend, for the grid search that seeds
+# Gauss-Newton; a best K on either end of the grid means the data show no saturation
+K_GRID = np.geomspace(1e-3, 1e3, 121)
+GAUSS_NEWTON_STEPS = 25
+# Upper bound on (groups x K candidates x bins) values evaluated at once
+FIT_BLOCK_ELEMENTS = 4_000_000
+
+
+class SpendAggregator:
+    """
+    Streaming per-(company, channel) sufficient statistics of spend rows.
+
+    Each row is assigned to one of n_bins log-spaced spend bins, and every group keeps
+    per-bin row counts and sums of spend, conversions and squared conversions, so
+    memory is O(groups x n_bins) however many rows are fed. Channel names are resolved
+    through the channel registry where possible; rows with missing, non-positive
+    spend or negative conversions are counted in n_skipped.
+    """
+
+    def __init__(self, n_bins=N_BINS, spend_range=SPEND_RANGE, registry=None):
+        self.n_bins = n_bins
+        # Inner edges: bin 0 holds spend below the range, bin n_bins - 1 spend above it
+        self.edges = np.geomspace(*spend_range, n_bins - 1)
+        self.registry = registry or get_registry()
+        self.groups = {}
+        # (group, bin, [count, sum spend, sum conversions, sum squared conversions])
+        self.stats = np.zeros((0, n_bins, 4))
+        self.spend_min = np.zeros(0)
+        self.spend_max = np.zeros(0)
+        self.n_rows = 0
+        self.n_skipped = 0
+
+    def _group_id(self, company, channel):
+        channel = str(channel)
+        i = self.registry.index(channel, None)
+        key = (fold_name(company), self.registry.names[i] if i is not None else fold_name(channel))
+        gid = self.groups.get(key)
+        if gid is None:
+            gid = self.groups[key] = len(self.groups)
+        return gid
+
+    def _grow(self):
+        n_groups = len(self.groups)
+        extra = n_groups - len(self.stats)
+        if extra > 0:
+            self.stats = np.concatenate([self.stats, np.zeros((extra, self.n_bins, 4))])
+            self.spend_min = np.concatenate([self.spend_min, np.full(extra, np.inf)])
+            self.spend_max = np.concatenate([self.spend_max, np.zeros(extra)])
+
+    def update(self, company, channel, spend, conversions):
+        """
+        Add one chunk of rows. company is a single name for the whole chunk or an array
+        of names; channel an array of names; spend and conversions numeric arrays.
+        """
+        import pandas as pd
+
+        spend = np.asarray(spend, dtype=float)
+        conversions = np.asarray(conversions, dtype=float)
+        valid = np.isfinite(spend) & np.isfinite(conversions) & (spend > 0) & (conversions >= 0)
+        self.n_rows += int(valid.sum())
+        self.n_skipped += int(len(valid) - valid.sum())
+        spend, conversions = spend[valid], conversions[valid]
+        if not len(spend):
+            return
+
+        # Factorize the name columns (categorical columns keep their codes) and map
+        # the few distinct (company, channel) pairs of the chunk to group ids
+        channel_codes, channels = pd.factorize(np.asarray(channel)[valid])
+        if isinstance(company, str) or company is None:
+            company_codes, companies = np.zeros(len(spend), dtype=np.intp), [company]
+        else:
+            company_codes, companies = pd.factorize(np.asarray(company)[valid])
+        pairs, inverse = np.unique(company_codes * len(channels) + channel_codes, return_inverse=True)
+        gids = np.array([
+            self._group_id(companies[pair // len(channels)], channels[pair % len(channels)]) for pair in pairs
+        ])
+        self._grow()
+        gid = gids[inverse.ravel()]
+
+        flat = gid * self.n_bins + np.searchsorted(self.edges, spend, side='right')
+        size = len(self.groups) * self.n_bins
+        stats = self.stats.reshape(size, 4)
+        for k, weights in enumerate((None, spend, conversions, conversions * conversions)):
+            stats[:, k] += np.bincount(flat, weights=weights, minlength=size)
+        np.minimum.at(self.spend_min, gid, spend)
+        np.maximum.at(self.spend_max, gid, spend)
+
+
+def read_chunks(path, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    DataFrames of at most chunk_rows rows with the channel, spend, conversions and (if
+    present) company columns of a CSV or Parquet file. Parquet (needs pyarrow) is read
+    through a memory map, one row group's columns at a time. CSV is parsed in chunks
+    by the C reader: a memory map of the whole file would keep every page read so
+    far resident, so memory would grow with the file instead of staying flat.
+    """
+    import pandas as pd
+
+    if path.endswith(('.parquet', '.pq')):
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(path, memory_map=True)
+        names = parquet.schema_arrow.names
+        columns = [c for c in (COMPANY, CHANNEL, SPEND, CONVERSIONS) if c in names]
+        for batch in parquet.iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+        return
+
+    header = pd.read_csv(path, nrows=0).columns
+    columns = [c for c in (COMPANY, CHANNEL, SPEND, CONVERSIONS) if c in header]
+    dtype = {COMPANY: 'category', CHANNEL: 'category', SPEND: 'float64', CONVERSIONS: 'float64'}
+    yield from pd.read_csv(
+        path, usecols=columns, dtype={c: dtype[c] for c in columns},
+        chunksize=chunk_rows, engine='c',
+    )
+
+def ingest(path, company=None, chunk_rows=DEFAULT_CHUNK_ROWS, aggregator=None):
+    """
+    Stream a spend file into a SpendAggregator. Without a company column every row
+    belongs to company, which is then required.
+    """
+    aggregator = aggregator or SpendAggregator()
+    for frame in read_chunks(path, chunk_rows):
+        missing = {CHANNEL, SPEND, CONVERSIONS} - set(frame.columns)
+        if missing:
+            raise ValueError(f"{path} is missing the column(s) {sorted(missing)}")
+        if COMPANY in frame.columns:
+            companies = frame[COMPANY]
+        elif company is not None:
+            companies = company
+        else:
+            raise ValueError(f"{path} has no '{COMPANY}' column; pass the company name")
+        aggregator.update(companies, frame[CHANNEL], frame[SPEND], frame[CONVERSIONS])
+    return aggregator
+
+
+def _sse(a, log_k, x, n, y, y2):
+    """Row-level sum of squared residuals, every row of a bin taken at the bin's mean spend"""
+    f = a[:, None] * x / (x + np.exp(log_k)[:, None])
+    return (y2 - 2 * f * y + n * f * f).sum(axis=1)
+
+def _jacobian(a, log_k, x):
+    """d f / d (max_conv, log K) per bin, shape (groups, bins, 2)"""
+    K = np.exp(log_k)[:, None]
+    d = x + K
+    return np.stack([x / d, -a[:, None] * x * K / (d * d)], axis=-1)
+
+def fit_saturation(stats, k_grid=K_GRID, steps=GAUSS_NEWTON_STEPS):
+    """
+    Weighted least-squares fit of conversions = max_conv * spend / (spend + K) for
+    every group of SpendAggregator stats (groups, bins, 4) at once.
+
+    For fixed K the best max_conv has a closed form, so a grid over K (relative to each
+    group's mean spend) is evaluated as one broadcast; the best grid point then seeds
+    damped Gauss-Newton steps on (max_conv, log K), solved as a stack of 2x2 systems.
+    Standard errors come from sigma^2 (J'WJ)^-1 (K's by the delta method). Returns a
+    dict of arrays of shape (groups,): max_conv, K, max_conv_se, K_se, r2 and
+    identified, False when there are fewer than 3 occupied bins or the data show no
+    curvature (the best K is on the edge of the grid).
+    """
+    n, s, y, y2 = np.moveaxis(stats, -1, 0)
+    occupied = n > 0
+    x = np.where(occupied, s / np.where(occupied, n, 1), 0.0)
+    n_rows = n.sum(axis=1)
+    scale = s.sum(axis=1) / np.maximum(n_rows, 1)
+    n_groups, n_bins = n.shape
+
+    # Grid search over K, in blocks of groups
+    best = np.zeros(n_groups, dtype=np.intp)
+    a = np.zeros(n_groups)
+    block = max(1, FIT_BLOCK_ELEMENTS // (len(k_grid) * n_bins))
+    for start in range(0, n_groups, block):
+        sl = slice(start, start + block)
+        K = scale[sl, None] * k_grid
+        g = x[sl, None, :] / (x[sl, None, :] + K[..., None])
+        yg = (y[sl, None, :] * g).sum(axis=-1)
+        gg = (n[sl, None, :] * g * g).sum(axis=-1)
+        a_grid = yg / np.maximum(gg, np.finfo(float).tiny)
+        sse = y2[sl].sum(axis=1)[:, None] - a_grid * yg
+        best[sl] = np.argmin(sse, axis=1)
+        a[sl] = a_grid[np.arange(len(K)), best[sl]]
+    log_k = np.log(scale * k_grid[best])
+    at_edge = (best == 0) | (best == len(k_grid) - 1)
+
+    # Gauss-Newton from the grid optimum; a step is kept only where it lowers the SSE
+    sse = _sse(a, log_k, x, n, y, y2)
+    damping = np.full(n_groups, 1e-9)
+    for _ in range(steps):
+        J = _jacobian(a, log_k, x)
+        residual = y - n * (a[:, None] * J[..., 0])
+        JtJ = np.einsum('gb,gbi,gbj->gij', n, J, J)
+        Jtr = np.einsum('gbi,gb->gi', J, residual)
+        JtJ_damped = JtJ + damping[:, None, None] * np.eye(2) * np.trace(JtJ, axis1=1, axis2=2)[:, None, None]
+        step = np.linalg.solve(JtJ_damped, Jtr[..., None])[..., 0]
+        a_new, log_k_new = a + step[:, 0], log_k + step[:, 1]
+        sse_new = _sse(a_new, log_k_new, x, n, y, y2)
+        better = np.isfinite(sse_new) & (sse_new < sse)
+        a, log_k, sse = np.where(better, a_new, a), np.where(better, log_k_new, log_k), np.where(better, sse_new, sse)
+        damping = np.where(better, damping / 10, damping * 10)
+
+    K = np.exp(log_k)
+    J = _jacobian(a, log_k, x)
+    JtJ = np.einsum('gb,gbi,gbj->gij', n, J, J)
+    sigma2 = np.maximum(sse, 0) / np.maximum(n_rows - 2, 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = sigma2[:, None, None] * np.linalg.pinv(JtJ)
+        max_conv_se = np.sqrt(cov[:, 0, 0])
+        K_se = K * np.sqrt(cov[:, 1, 1])
+        sst = y2.sum(axis=1) - y.sum(axis=1) ** 2 / n_rows
+        r2 = 1 - sse / sst
+
+    identified = (
+        (occupied.sum(axis=1) >= 3) & ~at_edge & (a > 0)
+        & np.isfinite(max_conv_se) & np.isfinite(K_se) & (K < scale * k_grid[-1])
+    )
+    return {
+        'max_conv': a, 'K': K, 'max_conv_se': max_conv_se, 'K_se': K_se,
+        'r2': r2, 'identified': identified,
+    }
+
+def fit_curves(aggregator, period_days=30):
+    """
+    Fit every group of an aggregator of daily rows; returns one dict per (company,
+    channel) with the CurveStore fields. Daily max_conv and K are scaled by
+    period_days, so the curves apply to per-period (monthly by default) budgets.
+    """
+    fit = fit_saturation(aggregator.stats)
+    n_rows = aggregator.stats[..., 0].sum(axis=1)
+    fits = []
+    for (company, channel), gid in aggregator.groups.items():
+        fits.append({
+            'company': company,
+            'channel': channel,
+            'max_conv': float(fit['max_conv'][gid] * period_days),
+            'K': float(fit['K'][gid] * period_days),
+            'max_conv_se': float(fit['max_conv_se'][gid] * period_days),
+            'K_se': float(fit['K_se'][gid] * period_days),
+            'r2': float(fit['r2'][gid]),
+            'n_rows': int(n_rows[gid]),
+            'spend_min': float(aggregator.spend_min[gid]),
+            'spend_max': float(aggregator.spend_max[gid]),
+            'period_days': float(period_days),
+            'identified': bool(fit['identified'][gid]),
+        })
+    return fits
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Fit per-channel saturation curves from daily spend rows and store them for the allocator.'
+    )
+    parser.add_argument('path', help="CSV or Parquet file with channel, spend, conversions and optionally company")
+    parser.add_argument('--company', help="company of every row, when the file has no company column")
+    parser.add_argument('--period-days', type=float, default=30, help="days per budget period (default: 30)")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--dry-run', action='store_true', help="print the fits without storing them")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.path):
+        parser.error(f"{args.path} does not exist")
+    start = time.perf_counter()
+    aggregator = ingest(args.path, args.company, args.chunk_rows)
+    fits = fit_curves(aggregator, args.period_days)
+    elapsed = time.perf_counter() - start
+
+    print(f"{aggregator.n_rows} rows ({aggregator.n_skipped} skipped), {len(fits)} curves in {elapsed:.2f}s")
+    for fit in fits:
+        flag = '' if fit['identified'] else '  (not identified: no saturation in the data)'
+        print(
+            f"  {fit['company']:<20} {fit['channel']:<12} max_conv {fit['max_conv']:10.1f} ± {fit['max_conv_se']:<8.1f}"
+            f" K {fit['K']:12.1f} ± {fit['K_se']:<10.1f} r2 {fit['r2']:.3f}{flag}"
+        )
+    if not args.dry_run:
+        curve_store_from_env().save(fits)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
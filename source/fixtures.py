@@ -0,0 +1,12 @@
+"""
+Sample channel priors and minimum-spend assumptions shared by the tests and the
+benchmarks, so neither has to import the other.
+"""
+
+PRIORS = {
+    'google': {'CPM': {'lower': 8, 'mean': 12, 'upper': 16}, 'CTR': {'lower': 0.02, 'mean': 0.035, 'upper': 0.05}, 'CVR': {'lower': 0.02, 'mean': 0.04, 'upper': 0.06}},
+    'linkedin': {'CPM': {'lower': 25, 'mean': 33, 'upper': 40}, 'CTR': {'lower': 0.004, 'mean': 0.006, 'upper': 0.008}, 'CVR': {'lower': 0.05, 'mean': 0.07, 'upper': 0.1}},
+    'meta': {'CPM': {'lower': 6, 'mean': 9, 'upper': 12}, 'CTR': {'lower': 0.008, 'mean': 0.012, 'upper': 0.016}, 'CVR': {'lower': 0.015, 'mean': 0.025, 'upper': 0.035}},
+    'tiktok': {'CPM': {'lower': 4, 'mean': 6, 'upper': 9}, 'CTR': {'lower': 0.005, 'mean': 0.008, 'upper': 0.012}, 'CVR': {'lower': 0.005, 'mean': 0.01, 'upper': 0.02}},
+}
+ASSUMPTIONS = {'google': 0.25, 'meta': 0.2, 'tiktok': 0.1, 'linkedin': 0.2}
@@ -4,11 +4,8 @@ import mimetypes
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory, jsonify, Response
-from flask_cors import CORS
-from source.models.user import db
-from source.routes.user import user_bp
-from source.routes.budget import budget_bp
+from flask import Flask, jsonify
+from source.config import get_config
 
 # Fix MIME types for JavaScript modules
 mimetypes.init()
@@ -17,138 +14,82 @@ mimetypes.add_type('text/javascript', '.mjs')
 mimetypes.add_type('text/css', '.css')
 mimetypes.add_type('application/json', '.json')
 
-# Set up static folder to serve React build files
-static_folder = os.path.join(os.path.dirname(__file__), 'dist')
-if not os.path.exists(static_folder):
-    static_folder = os.path.join(os.path.dirname(__file__), '.')
+def create_app(config=None):
+    """
+    Build the Flask app. config is a class from source.config or its name there
+    (default: APP_ENV, else production). Blueprints and their dependencies are
+    imported here rather than when this module is imported.
+    """
+    from flask_cors import CORS
+    from source.models.user import db
+    from source.routes.user import user_bp
+    from source.routes.budget import budget_bp
+    from source.routes.static_assets import AssetIndex, frontend_bp
 
-app = Flask(__name__, static_folder=static_folder, static_url_path='')
-app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
+    # Static files are served from the in-memory AssetIndex, not Flask's static route
+    app = Flask(__name__, static_folder=None)
+    app.config.from_object(get_config(config))
 
-# Enable CORS for all routes
-CORS(app)
+    # Enable CORS for all routes
+    CORS(app)
 
-# Register API blueprints
-app.register_blueprint(user_bp, url_prefix='/api')
-app.register_blueprint(budget_bp, url_prefix='/api')
+    # Register API blueprints
+    app.register_blueprint(user_bp, url_prefix='/api')
+    app.register_blueprint(budget_bp, url_prefix='/api')
 
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db.init_app(app)
+    db.init_app(app)
+    if app.config['CREATE_TABLES']:
+        with app.app_context():
+            db.create_all()
 
-# Create database tables
-with app.app_context():
-    db.create_all()
+    # Every servable file under STATIC_FOLDER, read and compressed once
+    app.extensions['asset_index'] = AssetIndex(app.config['STATIC_FOLDER'], watch=app.config['STATIC_WATCH'])
 
-def get_correct_mime_type(filename):
-    """Get the correct MIME type for a file"""
-    if filename.endswith('.js') or filename.endswith('.mjs'):
-        return 'text/javascript'
-    elif filename.endswith('.css'):
-        return 'text/css'
-    elif filename.endswith('.json'):
-        return 'application/json'
-    elif filename.endswith('.html'):
-        return 'text/html'
-    elif filename.endswith('.png'):
-        return 'image/png'
-    elif filename.endswith('.jpg') or filename.endswith('.jpeg'):
-        return 'image/jpeg'
-    elif filename.endswith('.svg'):
-        return 'image/svg+xml'
-    elif filename.endswith('.ico'):
-        return 'image/x-icon'
-    else:
-        mime_type, _ = mimetypes.guess_type(filename)
-        return mime_type or 'application/octet-stream'
+    # API health check
+    @app.route('/api/health')
+    def health_check():
+        return jsonify({"status": "healthy", "message": "Backend is running"})
 
-# API health check
-@app.route('/api/health')
-def health_check():
-    return jsonify({"status": "healthy", "message": "Backend is running"})
+    # Registered last: its catch-all route serves the React app
+    app.register_blueprint(frontend_bp)
+    return app
 
-# Serve React static files with correct MIME types
-@app.route('/static/<path:filename>')
-def serve_static(filename):
-    try:
-        file_path = os.path.join(app.static_folder, 'static', filename)
-        with open(file_path, 'rb') as f:
-            content = f.read()
-        
-        mime_type = get_correct_mime_type(filename)
-        print(f"🔧 Serving /static/{filename} with MIME type: {mime_type}")
-        
-        return Response(content, mimetype=mime_type)
-    except FileNotFoundError:
-        return jsonify({"error": "Static file not found"}), 404
+def preload_app(config=None):
+    """
+    create_app plus the imports that are otherwise deferred to the first request, for
+    pre-fork servers, e.g. gunicorn --preload 'source.main:preload_app()'. Workers then
+    share these pages with the master instead of each importing them. Per-process
+    state (DB connections, pools, clients) is created after the fork.
+    """
+    from source.models.user import db
 
-# Handle Vite assets folder
-@app.route('/assets/<path:filename>')
-def serve_assets(filename):
     try:
-        file_path = os.path.join(app.static_folder, 'assets', filename)
-        with open(file_path, 'rb') as f:
-            content = f.read()
-        
-        mime_type = get_correct_mime_type(filename)
-        print(f"🔧 Serving /assets/{filename} with MIME type: {mime_type}")
-        
-        response = Response(content, mimetype=mime_type)
-        
-        # Add cache headers for assets
-        if filename.endswith(('.js', '.css', '.png', '.jpg', '.jpeg', '.svg', '.ico')):
-            response.headers['Cache-Control'] = 'public, max-age=31536000'
-        
-        return response
-    except FileNotFoundError:
-        return jsonify({"error": "Asset not found"}), 404
+        from google import genai  # noqa: F401  (first LLM call)
+    except ImportError:
+        pass
 
-# Serve React app and handle client-side routing
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
-def serve_react(path):
-    print(f"🌐 Frontend request: {path or 'root'}")
-    
-    # If it's an API route, return 404
-    if path.startswith('api/'):
-        print(f"❌ API route not found: {path}")
-        return jsonify({"error": "API endpoint not found"}), 404
-    
-    # Check if the requested file exists
-    if path and not path.startswith('api'):
-        file_path = os.path.join(app.static_folder, path)
-        print(f"📁 Checking file: {file_path}")
-        if os.path.exists(file_path) and os.path.isfile(file_path):
-            print(f"✅ Serving static file: {path}")
-            
-            try:
-                with open(file_path, 'rb') as f:
-                    content = f.read()
-                
-                mime_type = get_correct_mime_type(path)
-                print(f"🔧 MIME type for {path}: {mime_type}")
-                
-                return Response(content, mimetype=mime_type)
-            except Exception as e:
-                print(f"❌ Error serving {path}: {e}")
-                return jsonify({"error": "File read error"}), 500
-    
-    # For all other routes, serve index.html (SPA fallback)
-    index_path = os.path.join(app.static_folder, 'index.html')
-    if os.path.exists(index_path):
-        print(f"📄 Serving index.html for route: {path or 'root'}")
-        return send_from_directory(app.static_folder, 'index.html')
-    else:
-        print(f"❌ index.html not found at: {index_path}")
-        return jsonify({"error": "Frontend not found. Make sure to build your React app first."}), 404
+    app = create_app(config)
+    with app.app_context():
+        db.engine.dispose()
+    return app
+
+def __getattr__(name):
+    # `source.main:app` builds the app on first access, not on import
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == '__main__':
-    print(f"Static folder: {app.static_folder}")
-    print(f"Static folder exists: {os.path.exists(app.static_folder)}")
+    app = create_app('development')
+    static_folder = app.config['STATIC_FOLDER']
+    print(f"Static folder: {static_folder}")
+    print(f"Static folder exists: {os.path.exists(static_folder)}")
+    print(f"Indexed static files: {len(app.extensions['asset_index'])}")
     
-    if os.path.exists(app.static_folder):
-        files = os.listdir(app.static_folder)
+    if os.path.exists(static_folder):
+        files = os.listdir(static_folder)
         print(f"Files in static folder: {files}")
         
         # Check for common build outputs
@@ -157,7 +98,7 @@ if __name__ == '__main__':
         if 'assets' in files:
             print("✅ assets folder found")
             try:
-                assets_files = os.listdir(os.path.join(app.static_folder, 'assets'))
+                assets_files = os.listdir(os.path.join(static_folder, 'assets'))
                 print(f"Assets files: {assets_files[:5]}...")  # Show first 5 files
             except:
                 print("❌ Could not list assets folder")
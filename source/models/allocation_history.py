@@ -0,0 +1,262 @@
+import atexit
+import hashlib
+import json
+import logging
+import math
+import os
+import queue
+import threading
+import time
+import uuid
+
+from source.models.storage import connect, fold_name
+
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'allocations.db')
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Stored as JSON text; the rest are plain columns
+JSON_COLUMNS = ('inputs', 'allocation', 'summary')
+COLUMNS = (
+    'id', 'created_at', 'company', 'goal', 'budget', 'inputs', 'inputs_hash', 'priors_hash',
+    'allocation', 'summary', 'priors_ms', 'simulation_ms',
+)
+
+logger = logging.getLogger(__name__)
+
+
+def stable_hash(value):
+    """SHA-256 hex digest of value as canonical JSON (sorted keys, no whitespace)"""
+    text = json.dumps(value, sort_keys=True, separators=(',', ':'), default=float)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def encode_cursor(created_at, run_id):
+    return f'{created_at!r}_{run_id}'
+
+def decode_cursor(cursor):
+    created_at, _, run_id = cursor.partition('_')
+    try:
+        return float(created_at), run_id
+    except ValueError:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+
+
+class AllocationHistory:
+    """
+    Allocation runs in a WAL-mode SQLite file, one row per run: the inputs and their
+    hash, the priors hash, the allocation and summary, and timings. Indexed for
+    listing by company, goal and created_at, and for finding a run with the same
+    inputs and priors hash.
+
+    record() only enqueues the run and returns its id. A background thread commits
+    queued runs in batches of up to batch_size per transaction, waiting at most
+    flush_interval for a batch to fill, so requests never wait on a commit. Runs
+    are readable once written; flush() waits for that. Beyond max_pending queued
+    runs, new ones are dropped (and counted) rather than blocking.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, batch_size=256, flush_interval=0.2, max_pending=10_000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.stats = {'written': 0, 'dropped': 0, 'batches': 0, 'errors': 0}
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_created = 0.0
+        self._init_db()
+
+    def _connect(self):
+        return connect(self._local, self.path)
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS allocation_runs ('
+            ' id TEXT PRIMARY KEY, created_at REAL NOT NULL, company TEXT, goal TEXT, budget REAL NOT NULL,'
+            ' inputs TEXT NOT NULL, inputs_hash TEXT NOT NULL, priors_hash TEXT NOT NULL,'
+            ' allocation TEXT NOT NULL, summary TEXT NOT NULL, priors_ms REAL, simulation_ms REAL)'
+        )
+        # (created_at, id) is the keyset order of every listing
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_allocation_runs_created_at ON allocation_runs (created_at, id)')
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS ix_allocation_runs_company ON allocation_runs (company, created_at, id)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_allocation_runs_goal ON allocation_runs (goal, created_at, id)')
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS ix_allocation_runs_reuse'
+            ' ON allocation_runs (inputs_hash, priors_hash, created_at)'
+        )
+
+    # Writes
+
+    def _row(self, run):
+        with self._lock:
+            # Strictly increasing, so runs from one process list in the order they were recorded
+            self._last_created = max(time.time(), math.nextafter(self._last_created, math.inf))
+            row = dict(run, id=uuid.uuid4().hex, created_at=self._last_created)
+        row['company'] = fold_name(run['company']) if run.get('company') is not None else None
+        row['goal'] = fold_name(run['goal']) if run.get('goal') is not None else None
+        row['inputs_hash'] = stable_hash(run['inputs'])
+        return row
+
+    def record(self, run):
+        """
+        Queue a run for writing and return its id. run holds company, goal, budget,
+        inputs, priors_hash, allocation, summary and optionally priors_ms /
+        simulation_ms; inputs_hash is computed from inputs.
+        """
+        row = self._row(run)
+        if self._queue.qsize() >= self.max_pending:
+            with self._lock:
+                self.stats['dropped'] += 1
+            logger.warning("Allocation history queue full; run %s not recorded", row['id'])
+            return row['id']
+        self._ensure_writer()
+        self._queue.put(row)
+        return row['id']
+
+    def flush(self, timeout=None):
+        """Wait until every run queued so far is written; False on timeout"""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=5):
+        """Write what is queued and stop the writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def _ensure_writer(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._write_loop, name='allocation-history', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _write_loop(self):
+        while True:
+            batch, markers, stop = [], [], False
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    # flush(): write now rather than wait for the batch to fill
+                    markers.append(item)
+                else:
+                    batch.append(item)
+                if stop or markers or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+            for marker in markers:
+                marker.set()
+            if stop:
+                return
+
+    def _write(self, batch):
+        rows = [
+            tuple(json.dumps(row[col], default=float) if col in JSON_COLUMNS else row.get(col) for col in COLUMNS)
+            for row in batch
+        ]
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN')
+            conn.executemany(
+                f"INSERT OR REPLACE INTO allocation_runs ({', '.join(COLUMNS)})"
+                f" VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            logger.exception("Could not write %d allocation runs", len(rows))
+            with self._lock:
+                self.stats['errors'] += len(rows)
+            return
+        with self._lock:
+            self.stats['written'] += len(rows)
+            self.stats['batches'] += 1
+
+    # Reads
+
+    def _rows(self, where, params, order='created_at DESC, id DESC', limit=None):
+        sql = f"SELECT {', '.join(COLUMNS)} FROM allocation_runs"
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += f' ORDER BY {order}'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        runs = []
+        for values in self._connect().execute(sql, params):
+            run = dict(zip(COLUMNS, values))
+            for col in JSON_COLUMNS:
+                run[col] = json.loads(run[col])
+            runs.append(run)
+        return runs
+
+    def get(self, run_id):
+        runs = self._rows(['id = ?'], (run_id,))
+        return runs[0] if runs else None
+
+    def page(self, company=None, goal=None, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        """
+        Newest runs first, optionally for one company and / or goal: (runs,
+        next_cursor). Keyset pagination on (created_at, id): pass next_cursor back to
+        get the following page; it is None on the last page.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        where, params = [], []
+        if company is not None:
+            where.append('company = ?')
+            params.append(fold_name(company))
+        if goal is not None:
+            where.append('goal = ?')
+            params.append(fold_name(goal))
+        if cursor:
+            where.append('(created_at, id) < (?, ?)')
+            params.extend(decode_cursor(cursor))
+        runs = self._rows(where, params, limit=limit + 1)
+        next_cursor = None
+        if len(runs) > limit:
+            runs = runs[:limit]
+            next_cursor = encode_cursor(runs[-1]['created_at'], runs[-1]['id'])
+        return runs, next_cursor
+
+    def find_reusable(self, inputs, priors_hash, max_age=None):
+        """The newest written run with these inputs and priors hash (within max_age seconds), or None"""
+        where, params = ['inputs_hash = ?', 'priors_hash = ?'], [stable_hash(inputs), priors_hash]
+        if max_age is not None:
+            where.append('created_at > ?')
+            params.append(time.time() - max_age)
+        runs = self._rows(where, params, order='created_at DESC', limit=1)
+        return runs[0] if runs else None
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM allocation_runs').fetchone()[0]
+
+
+def from_env():
+    """History at ALLOCATION_HISTORY_PATH, batching per ALLOCATION_HISTORY_BATCH / ALLOCATION_HISTORY_FLUSH_SECONDS"""
+    return AllocationHistory(
+        path=os.getenv('ALLOCATION_HISTORY_PATH', DEFAULT_PATH),
+        batch_size=int(os.getenv('ALLOCATION_HISTORY_BATCH', 256)),
+        flush_interval=float(os.getenv('ALLOCATION_HISTORY_FLUSH_SECONDS', 0.2)),
+    )
@@ -0,0 +1,144 @@
+import json
+import os
+import threading
+from functools import cached_property
+
+import numpy as np
+
+from source.models.storage import fold_name
+
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), 'channels.json')
+
+# The funnel metrics every channel has a prior for, in prior_bounds order
+PRIOR_METRICS = ('CPM', 'CTR', 'CVR')
+BOUNDS = ('lower', 'mean', 'upper')
+
+
+class UnknownChannel(ValueError):
+    pass
+
+
+class ChannelRegistry:
+    """
+    Advertising channels the optimizer knows, loaded from a JSON file (see channels.json).
+
+    Each entry has a name, a display label, optional aliases, the saturating-curve
+    parameters max_conv and K, an optional monthly adstock decay (the share of a
+    month's spend still working the next month, default 0), optional default
+    CPM/CTR/CVR priors and an 'enabled' flag that puts it in the LLM prompt.
+    Parameters are held as contiguous arrays in registry order, and a set of channels
+    is looked up with one fancy-indexing gather, so per-request work is linear in the
+    number of channels requested.
+    """
+
+    def __init__(self, entries):
+        if not entries:
+            raise ValueError("A channel registry needs at least one channel")
+        self.names = [entry['name'] for entry in entries]
+        self.labels = [entry.get('label', entry['name']) for entry in entries]
+        self.enabled_mask = np.array([entry.get('enabled', True) for entry in entries], dtype=bool)
+        self.max_conv = np.array([entry['max_conv'] for entry in entries], dtype=float)
+        self.K = np.array([entry['K'] for entry in entries], dtype=float)
+        if np.any(self.max_conv <= 0) or np.any(self.K <= 0):
+            raise ValueError("max_conv and K must be positive for every channel")
+        self.adstock = np.array([entry.get('adstock', 0.0) for entry in entries], dtype=float)
+        if np.any(self.adstock < 0) or np.any(self.adstock >= 1):
+            raise ValueError("adstock must be in [0, 1) for every channel")
+
+        # (n_channels, metric, bound); NaN where a channel has no default prior
+        self.prior_bounds = np.full((len(entries), len(PRIOR_METRICS), len(BOUNDS)), np.nan)
+        for i, entry in enumerate(entries):
+            for j, metric in enumerate(PRIOR_METRICS):
+                prior = entry.get('priors', {}).get(metric)
+                if prior is not None:
+                    self.prior_bounds[i, j] = [prior[bound] for bound in BOUNDS]
+
+        self._lookup = {}
+        for i, entry in enumerate(entries):
+            for key in [entry['name'], *entry.get('aliases', ())]:
+                key = fold_name(key)
+                if self._lookup.setdefault(key, i) != i:
+                    raise ValueError(f"Channel name or alias '{key}' is used twice")
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_PATH):
+        with open(path) as f:
+            return cls(json.load(f)['channels'])
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return self.index(name, None) is not None
+
+    def index(self, name, default=UnknownChannel):
+        """Registry position of a channel name or alias (case- and whitespace-insensitive)"""
+        i = self._lookup.get(fold_name(name))
+        if i is None:
+            if default is UnknownChannel:
+                raise UnknownChannel(f"Unknown channel '{name}'; add it to the channel registry")
+            return default
+        return i
+
+    def indices(self, channels):
+        return np.fromiter((self.index(ch) for ch in channels), dtype=np.intp, count=len(channels))
+
+    def resolve(self, name):
+        return self.names[self.index(name)]
+
+    def canonicalize(self, priors):
+        """priors keyed by canonical channel names; raises UnknownChannel / ValueError on bad keys"""
+        canonical = {}
+        for name, channel_priors in priors.items():
+            key = self.resolve(name)
+            if key in canonical:
+                raise ValueError(f"Channel '{key}' appears more than once in the priors")
+            canonical[key] = channel_priors
+        return canonical
+
+    def curve_params(self, channels):
+        """(max_conv, K) arrays for channels, in the given order"""
+        idx = self.indices(channels)
+        return self.max_conv[idx], self.K[idx]
+
+    @property
+    def enabled(self):
+        return [name for name, on in zip(self.names, self.enabled_mask) if on]
+
+    @cached_property
+    def prompt_channel_names(self):
+        """Labels of the enabled channels as prose: 'A, B, and C'"""
+        labels = [label for label, on in zip(self.labels, self.enabled_mask) if on]
+        if len(labels) <= 2:
+            return ' and '.join(labels)
+        return ', '.join(labels[:-1]) + ', and ' + labels[-1]
+
+    @cached_property
+    def prompt_schema(self):
+        """One line of the output schema per enabled channel, sorted by name"""
+        metric = "{'lower': <decimal>, 'upper': <decimal>, 'mean': <decimal>}"
+        body = ', '.join(f"'{m}' : {metric}" for m in ('CVR', 'CPM', 'CTR'))
+        lines = [f'"{name}": {{{body}}}' for name in sorted(self.enabled)]
+        return ',\n'.join(' ' * 14 + line for line in lines)
+
+
+# Process-wide registry, loaded on first use
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """The registry loaded from CHANNEL_REGISTRY (default: channels.json next to this module)"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ChannelRegistry.from_file(os.getenv('CHANNEL_REGISTRY', DEFAULT_PATH))
+        return _registry
+
+def set_registry(registry):
+    """Replace the process-wide registry, e.g. with a larger one in benchmarks; returns the old one"""
+    global _registry
+    with _registry_lock:
+        old, _registry = _registry, registry
+    return old
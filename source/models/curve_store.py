@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+
+from source.models.storage import connect, fold_name
+
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'curves.db')
+
+COLUMNS = (
+    'company', 'channel', 'max_conv', 'K', 'max_conv_se', 'K_se', 'r2',
+    'n_rows', 'spend_min', 'spend_max', 'period_days', 'identified', 'fitted_at',
+)
+
+# Companies per query in curves_many (SQLite caps bound parameters at 999 in older builds)
+QUERY_BATCH = 500
+
+
+class CurveStore:
+    """
+    Fitted saturation curves (see curve_fitting.fit_curves) in a WAL-mode SQLite file,
+    one row per (company, channel). max_conv and K are per budget period (period_days)
+    with their standard errors; rows with identified = 0 are kept for inspection but
+    never used by the allocator.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._init_db()
+
+    def _connect(self):
+        return connect(self._local, self.path)
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS curve_fits ('
+            ' company TEXT NOT NULL, channel TEXT NOT NULL,'
+            ' max_conv REAL NOT NULL, K REAL NOT NULL, max_conv_se REAL, K_se REAL, r2 REAL,'
+            ' n_rows INTEGER NOT NULL, spend_min REAL, spend_max REAL, period_days REAL NOT NULL,'
+            ' identified INTEGER NOT NULL, fitted_at REAL NOT NULL,'
+            ' PRIMARY KEY (company, channel)) WITHOUT ROWID'
+        )
+
+    def save(self, fits):
+        """Insert or replace fits (dicts with the fit_curves fields plus company) in one transaction"""
+        now = time.time()
+        rows = [
+            tuple(now if col == 'fitted_at' else fold_name(fit[col]) if col == 'company' else fit[col]
+                  for col in COLUMNS)
+            for fit in fits
+        ]
+        conn = self._connect()
+        conn.execute('BEGIN')
+        try:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO curve_fits ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return len(rows)
+
+    def get(self, company):
+        """Every stored fit of a company, as dicts"""
+        cursor = self._connect().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM curve_fits WHERE company = ? ORDER BY channel",
+            (fold_name(company),)
+        )
+        return [dict(zip(COLUMNS, row)) for row in cursor]
+
+    def curves(self, company):
+        """{channel: (max_conv, K)} of the identified fits of a company, for the allocator"""
+        if company is None:
+            return {}
+        cursor = self._connect().execute(
+            'SELECT channel, max_conv, K FROM curve_fits WHERE company = ? AND identified = 1',
+            (fold_name(company),)
+        )
+        return {channel: (max_conv, K) for channel, max_conv, K in cursor}
+
+    def curves_many(self, companies):
+        """curves() of many companies in a few queries, keyed by fold_name(company)"""
+        keys = sorted({fold_name(company) for company in companies if company is not None})
+        found = {}
+        conn = self._connect()
+        for start in range(0, len(keys), QUERY_BATCH):
+            batch = keys[start:start + QUERY_BATCH]
+            cursor = conn.execute(
+                'SELECT company, channel, max_conv, K FROM curve_fits'
+                f" WHERE identified = 1 AND company IN ({', '.join('?' * len(batch))})",
+                batch
+            )
+            for company, channel, max_conv, K in cursor:
+                found.setdefault(company, {})[channel] = (max_conv, K)
+        return found
+
+    def delete(self, company):
+        return self._connect().execute('DELETE FROM curve_fits WHERE company = ?', (fold_name(company),)).rowcount
+
+
+def from_env():
+    """Store at CURVE_STORE_PATH (default: curves.db next to the other databases)"""
+    return CurveStore(os.getenv('CURVE_STORE_PATH', DEFAULT_PATH))
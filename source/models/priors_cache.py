@@ -0,0 +1,177 @@
+import bisect
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from source.models.storage import connect, fold_name
+
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'priors_cache.db')
+
+# Lower edges of the budget buckets used in cache keys; CPM/CTR/CVR priors barely move within one
+DEFAULT_BUDGET_EDGES = (500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000, 1000000)
+
+
+class KeyNormalizer:
+    """
+    Maps (company_name, budget, goal) to a priors cache key.
+
+    Company names and goals are case- and whitespace-folded, and the budget is replaced
+    by the lower edge of its bucket, so 5000.0 and 5001.0 share an entry. With no
+    budget_edges the exact budget is kept.
+    """
+
+    def __init__(self, budget_edges=DEFAULT_BUDGET_EDGES, fold_names=True):
+        self.budget_edges = sorted(float(edge) for edge in budget_edges)
+        self.fold_names = fold_names
+
+    def fold(self, text):
+        if not self.fold_names or not isinstance(text, str):
+            return text
+        return fold_name(text)
+
+    def bucket(self, budget):
+        budget = float(budget)
+        if not self.budget_edges:
+            return budget
+        i = bisect.bisect_right(self.budget_edges, budget)
+        return self.budget_edges[i - 1] if i else 0.0
+
+    def __call__(self, company_name, budget, goal):
+        return (self.fold(company_name), self.bucket(budget), self.fold(goal))
+
+
+class PriorsCache:
+    """
+    Two-level cache for LLM priors.
+
+    L1 is an in-process LRU dict, so hot keys never touch disk. L2 is a WAL-mode SQLite
+    file shared by every worker process on the host, with a TTL and LRU eviction
+    (by last access) once it holds more than max_entries rows. Keys are tuples of JSON
+    values; values must be JSON-serializable.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, ttl=7 * 24 * 3600, max_entries=10000, l1_size=256):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.l1_size = l1_size
+        self._l1 = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stats = {'l1_hits': 0, 'l2_hits': 0, 'misses': 0, 'evictions': 0}
+        self._init_db()
+
+    def _connect(self):
+        return connect(self._local, self.path)
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS priors_cache ('
+            ' key TEXT PRIMARY KEY, value TEXT NOT NULL,'
+            ' expires_at REAL NOT NULL, last_access REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_priors_cache_last_access ON priors_cache (last_access)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_priors_cache_expires_at ON priors_cache (expires_at)')
+
+    @staticmethod
+    def _serialize_key(key):
+        return json.dumps(list(key) if isinstance(key, tuple) else key)
+
+    def _l1_put(self, key, value, expires_at):
+        with self._lock:
+            self._l1[key] = (value, expires_at)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_size:
+                self._l1.popitem(last=False)
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is not None and entry[1] > now:
+                self._l1.move_to_end(key)
+                self.stats['l1_hits'] += 1
+                return entry[0]
+            self._l1.pop(key, None)
+
+        conn = self._connect()
+        skey = self._serialize_key(key)
+        row = conn.execute(
+            'SELECT value, expires_at FROM priors_cache WHERE key = ? AND expires_at > ?', (skey, now)
+        ).fetchone()
+        if row is None:
+            with self._lock:
+                self.stats['misses'] += 1
+            return default
+
+        conn.execute('UPDATE priors_cache SET last_access = ? WHERE key = ?', (now, skey))
+        value = json.loads(row[0])
+        self._l1_put(key, value, row[1])
+        with self._lock:
+            self.stats['l2_hits'] += 1
+        return value
+
+    def set(self, key, value):
+        now = time.time()
+        expires_at = now + self.ttl
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO priors_cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)',
+            (self._serialize_key(key), json.dumps(value), expires_at, now)
+        )
+        self._l1_put(key, value, expires_at)
+        self._evict(conn, now)
+
+    def delete(self, key):
+        with self._lock:
+            self._l1.pop(key, None)
+        self._connect().execute('DELETE FROM priors_cache WHERE key = ?', (self._serialize_key(key),))
+
+    def clear(self):
+        with self._lock:
+            self._l1.clear()
+        self._connect().execute('DELETE FROM priors_cache')
+
+    def _evict(self, conn, now):
+        expired = conn.execute('DELETE FROM priors_cache WHERE expires_at <= ?', (now,)).rowcount
+        overflow = conn.execute(
+            'DELETE FROM priors_cache WHERE key IN ('
+            ' SELECT key FROM priors_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        ).rowcount
+        if expired or overflow:
+            with self._lock:
+                self.stats['evictions'] += expired + overflow
+
+    def __len__(self):
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM priors_cache WHERE expires_at > ?', (time.time(),)
+        ).fetchone()[0]
+
+
+def key_normalizer_from_env():
+    """
+    KeyNormalizer configured from PRIORS_BUDGET_BUCKETS (comma-separated lower edges,
+    or 'none' for exact budgets) and PRIORS_FOLD_NAMES (0 to keep names verbatim)
+    """
+    edges = os.getenv('PRIORS_BUDGET_BUCKETS')
+    if edges is None:
+        edges = DEFAULT_BUDGET_EDGES
+    elif edges.strip().lower() == 'none':
+        edges = ()
+    else:
+        edges = [float(edge) for edge in edges.split(',') if edge.strip()]
+    return KeyNormalizer(edges, fold_names=os.getenv('PRIORS_FOLD_NAMES', '1') != '0')
+
+def from_env():
+    """Cache configured from PRIORS_CACHE_PATH / PRIORS_CACHE_TTL / PRIORS_CACHE_MAX_ENTRIES"""
+    return PriorsCache(
+        path=os.getenv('PRIORS_CACHE_PATH', DEFAULT_PATH),
+        ttl=float(os.getenv('PRIORS_CACHE_TTL', 7 * 24 * 3600)),
+        max_entries=int(os.getenv('PRIORS_CACHE_MAX_ENTRIES', 10000)),
+    )
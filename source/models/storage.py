@@ -0,0 +1,23 @@
+"""
+Helpers shared by the SQLite stores (priors cache, curve store, allocation history):
+per-thread WAL-mode connections and the name folding used in their keys.
+"""
+import sqlite3
+
+
+def fold_name(name):
+    """Case- and whitespace-folded name: ' Acme  Corp' and 'acme corp' are the same key"""
+    return ' '.join(str(name).split()).casefold()
+
+def connect(local, path):
+    """
+    This thread's connection to the SQLite file at path, opened on first use and kept
+    on local (a threading.local). Autocommit, WAL journal, synchronous=NORMAL.
+    """
+    conn = getattr(local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        local.conn = conn
+    return conn
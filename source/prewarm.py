@@ -0,0 +1,105 @@
+"""
+Prewarm the priors cache for known clients.
+
+    python -m source.prewarm companies.txt [--budgets 5000 25000] [--concurrency 4] [--rate 1.0]
+
+companies.txt holds one company name per line (blank lines and '#' comments are
+skipped). For every company, budget and goal in GOALS the priors are fetched from
+the LLM and stored under the same normalized key /api/allocate uses, so the first
+real request for a known client hits warm priors. Keys already cached are skipped
+unless --force is given.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from source.routes.budget import get_priors, get_priors_cache, priors_cache_key
+from source.routes.llm import GOALS
+
+
+class RateLimiter:
+    """Spaces calls at least 1 / rate seconds apart across threads"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def read_companies(path):
+    with open(path) as f:
+        names = [line.strip() for line in f]
+    return [name for name in names if name and not name.startswith('#')]
+
+
+def prewarm(companies, budgets, goals=tuple(GOALS), concurrency=4, rate=1.0, force=False):
+    """Fill the priors cache; returns (warmed, skipped, failed) counts"""
+    cache = get_priors_cache()
+    limiter = RateLimiter(rate)
+
+    jobs, seen, skipped = [], set(), 0
+    for company_name in companies:
+        for budget in budgets:
+            for goal in goals:
+                key = priors_cache_key(company_name, budget, goal)
+                if key in seen:
+                    continue
+                seen.add(key)
+                if force:
+                    cache.delete(key)
+                elif cache.get(key) is not None:
+                    skipped += 1
+                    continue
+                jobs.append((company_name, budget, goal))
+
+    def fetch(job):
+        limiter.wait()
+        return get_priors(*job)
+
+    warmed = failed = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(fetch, job): job for job in jobs}
+        for future in as_completed(futures):
+            company_name, budget, goal = futures[future]
+            try:
+                future.result()
+                warmed += 1
+                print(f"warmed {company_name} / {budget:g} / {goal}")
+            except Exception as e:
+                failed += 1
+                print(f"failed {company_name} / {budget:g} / {goal}: {e}")
+    return warmed, skipped, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Prewarm the LLM priors cache for a list of companies.')
+    parser.add_argument('companies', help='file with one company name per line')
+    parser.add_argument('--budgets', type=float, nargs='+', default=[5000.0], help='monthly budgets to warm')
+    parser.add_argument('--goals', nargs='+', default=list(GOALS), choices=list(GOALS))
+    parser.add_argument('--concurrency', type=int, default=4, help='LLM calls in flight')
+    parser.add_argument('--rate', type=float, default=1.0, help='max LLM calls started per second')
+    parser.add_argument('--force', action='store_true', help='refetch keys that are already cached')
+    args = parser.parse_args(argv)
+
+    warmed, skipped, failed = prewarm(
+        read_companies(args.companies), args.budgets, args.goals, args.concurrency, args.rate, args.force
+    )
+    print(f"{warmed} warmed, {skipped} already cached, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
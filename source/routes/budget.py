@@ -1,67 +1,981 @@
-from flask import Blueprint, jsonify, request
-import re
-import json
-from .llm import callLLMForBudgetAllocation
-from .optimization import calculate_budget_allocation
+from flask import Blueprint, Response, g, jsonify, request
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from .llm import callLLMForBudgetAllocation, stream_llm_for_budget_allocation
+from .parsing import parse_llm_output
+from source.models import allocation_history, priors_cache, curve_store
+from source.models.allocation_history import stable_hash
+from source.models.storage import fold_name
+import numpy as np
+from .optimization import (
+    calculate_budget_allocation, batch_budget_allocation, budget_sweep, channel_model, iter_budget_allocation,
+    ALLOCATION_STRATEGIES, DEFAULT_CHUNK_SIZE, MAX_SWEEP_POINTS, Summary,
+)
+from .planning import DEFAULT_HORIZON, PLAN_SIMULATIONS, plan_budget_allocation
+from .portfolio import PORTFOLIO_SIMULATIONS, portfolio_allocation
+from .sampling import MAX_ADAPTIVE_SIMULATIONS, VARIANCE_REDUCTION
+from .sensitivity import (
+    DEFAULT_SOBOL_SAMPLES, DEFAULT_STEP, MAX_SOBOL_SAMPLES, funnel_scenarios, sensitivity_analysis, tornado,
+)
+from .jobs import JobQueue, QueueFull, SingleFlight
+from . import instrumentation
+from .instrumentation import PRIORS_CACHE, REQUEST_SECONDS, stage_timer
+from .serialization import MSGPACK_ALIASES, NotAcceptable, dumps, dumps_json, encode_response, negotiate
 
 
 budget_bp = Blueprint('budget', __name__)
+logger = logging.getLogger(__name__)
+
+# Concurrent LLM prior lookups per batch request
+BATCH_LLM_CONCURRENCY = 8
+
+# Largest n_simulations a request may ask for (MAX_SIMULATIONS); also the adaptive mode's cap
+MAX_SIMULATIONS = int(os.getenv('MAX_SIMULATIONS', MAX_ADAPTIVE_SIMULATIONS))
+
+# Scenario draws one request may simulate in total (batch requests, portfolio accounts,
+# sweep budgets or sensitivity scenarios times n_simulations), so no request holds a
+# worker for long (MAX_REQUEST_DRAWS)
+MAX_REQUEST_DRAWS = int(os.getenv('MAX_REQUEST_DRAWS', 2 ** 26))
+
+# chunk_size a request may set; below the minimum the per-block Python overhead dominates
+MIN_CHUNK_SIZE = 1024
+MAX_CHUNK_SIZE = 10 * DEFAULT_CHUNK_SIZE
+
+# Shared priors cache, opened on first use
+_priors_cache = None
+priors_cache_key = priors_cache.key_normalizer_from_env()
+
+# Concurrent lookups of the same priors key share one LLM call
+_priors_flight = SingleFlight()
+
+# Saturation curves fitted from historical spend (see source/curve_fitting.py), opened on first use
+_curve_store = None
+
+# Stored /allocate runs, written in batches by a background thread; opened on first use
+_allocation_history = None
+
+# Background allocation jobs, created on first use
+_job_queue = None
+JOB_MAX_WAIT = 30
+
+# Opt-in sampling profiler for slow requests (PROFILE_SLOW_REQUESTS_MS)
+_slow_request_profiler = instrumentation.slow_request_profiler_from_env()
+
+# Progress events per simulation stage on the streaming endpoint
+STREAM_PROGRESS_STEPS = 10
+
+def _reset_after_fork():
+    # Connections, locks and worker threads are per process: a preloaded master's
+    # are recreated on first use in each worker
+    global _priors_cache, _priors_flight, _job_queue, _curve_store, _allocation_history
+    _priors_cache, _priors_flight, _job_queue, _curve_store = None, SingleFlight(), None, None
+    _allocation_history = None
+
+os.register_at_fork(after_in_child=_reset_after_fork)
 
 def extract_citation_number(text):
-    matches = re.findall(r"\[([^\]]+)\]", text)
-    return [int(match) for match in matches if match.isdigit()]
+    return parse_llm_output(text).citation_numbers
+
+def parse_int(data, name, default, low, high):
+    """data[name] (default when missing) as an int; ValueError unless it is in [low, high]"""
+    try:
+        value = int(data.get(name, default))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"{name} must be an integer")
+    if not low <= value <= high:
+        raise ValueError(f"{name} must be between {low:,} and {high:,}")
+    return value
+
+def parse_n_simulations(data, default=5000):
+    """n_simulations of a request; ValueError unless it is an integer in [1, MAX_SIMULATIONS]"""
+    return parse_int(data, 'n_simulations', default, 1, MAX_SIMULATIONS)
+
+def check_request_draws(n_items, n_simulations, items):
+    """ValueError when n_items (of what items names) x n_simulations is over MAX_REQUEST_DRAWS"""
+    if n_items * n_simulations > MAX_REQUEST_DRAWS:
+        raise ValueError(
+            f"{n_items:,} {items} x {n_simulations:,} simulations is over the limit of {MAX_REQUEST_DRAWS:,} "
+            "per request; lower n_simulations or split the request"
+        )
+
+def parse_chunk_size(data, default=None):
+    """chunk_size of a request, or default when unset; ValueError unless in [MIN_CHUNK_SIZE, MAX_CHUNK_SIZE]"""
+    if data.get('chunk_size') is None:
+        return default
+    return parse_int(data, 'chunk_size', None, MIN_CHUNK_SIZE, MAX_CHUNK_SIZE)
+
+def parse_strategy(data, default='softmax'):
+    """strategy of a request; ValueError unless it is one of ALLOCATION_STRATEGIES"""
+    strategy = data.get('strategy', default)
+    if strategy not in ALLOCATION_STRATEGIES:
+        raise ValueError(f"Unknown strategy '{strategy}', expected one of {ALLOCATION_STRATEGIES}")
+    return strategy
+
+def sampling_options(data):
+    """
+    {'seed', 'variance_reduction'} of a request, shared by every simulating endpoint.
+    ValueError unless seed is missing or a non-negative integer and variance_reduction
+    is one of VARIANCE_REDUCTION.
+    """
+    seed = data.get('seed')
+    if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int) or seed < 0):
+        raise ValueError("seed must be a non-negative integer")
+    variance_reduction = data.get('variance_reduction', 'mc')
+    if variance_reduction not in VARIANCE_REDUCTION:
+        raise ValueError(f"Unknown variance_reduction '{variance_reduction}', expected one of {VARIANCE_REDUCTION}")
+    return {'seed': seed, 'variance_reduction': variance_reduction}
+
+def simulation_options(data):
+    """Optional Monte Carlo settings of a request, as calculate_budget_allocation kwargs"""
+    tolerance = data.get('tolerance')
+    options = {
+        **sampling_options(data),
+        'common_random_numbers': bool(data.get('common_random_numbers', False)),
+        'strategy': parse_strategy(data),
+    }
+    if tolerance is not None:
+        if data.get('chunk_size') is not None:
+            raise ValueError("Adaptive mode (tolerance) cannot be combined with chunk_size")
+        # Adaptive mode: n_simulations is only a cap on the draws
+        options['tolerance'] = float(tolerance)
+        options['n_simulations'] = parse_n_simulations(data, min(MAX_ADAPTIVE_SIMULATIONS, MAX_SIMULATIONS))
+        return options
+
+    options['n_simulations'] = parse_n_simulations(data)
+    options['chunk_size'] = parse_chunk_size(
+        data, DEFAULT_CHUNK_SIZE if options['n_simulations'] > DEFAULT_CHUNK_SIZE else None
+    )
+    return options
+
+def parse_constraints(constraints):
+    """Minimum budget fractions by channel from a request's {"<channel>_min": fraction} constraints"""
+    if constraints is None:
+        return {}
+    if not isinstance(constraints, dict):
+        raise ValueError("constraints must be an object of <channel>_min fractions")
+    assumptions = {}
+    for key, value in constraints.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"Constraint '{key}' must be a number")
+        assumptions[key.replace('_min', '')] = value
+    return assumptions
+
+def parse_allocation_request(data):
+    """(company_name, budget, goal, assumptions) from an /allocate payload"""
+    company_name = data.get('company_name')
+    budget = float(data.get('monthly_budget'))
+    goal = data.get('primary_goal')
+    assumptions = parse_constraints(data.get('constraints'))
+    return company_name, budget, goal, assumptions
+
+def get_priors_cache():
+    """The process-wide PriorsCache (in-process L1 over a SQLite file shared by all workers)"""
+    global _priors_cache
+    if _priors_cache is None:
+        _priors_cache = priors_cache.from_env()
+    return _priors_cache
+
+def get_curve_store():
+    global _curve_store
+    if _curve_store is None:
+        _curve_store = curve_store.from_env()
+    return _curve_store
+
+def get_curves(company_name, data):
+    """Fitted curves of a company, unless the request sets use_fitted_curves to false"""
+    if not data.get('use_fitted_curves', True):
+        return {}
+    return get_curve_store().curves(company_name)
+
+def get_priors(company_name, budget, goal):
+    """LLM priors for a request, through the priors cache"""
+    # Key: normalized (company_name, budget bucket, goal)
+    # Value: (priors, citations_text, extra_citations)
+    cache = get_priors_cache()
+    cache_key = priors_cache_key(company_name, budget, goal)
+
+    cached = cache.get(cache_key)
+    if cached is not None:
+        PRIORS_CACHE.inc(result='hit')
+        return tuple(cached)
+    PRIORS_CACHE.inc(result='miss')
+
+    def fetch():
+        with stage_timer('llm_fetch'):
+            priors, citations_text, extra_citations = callLLMForBudgetAllocation(company_name, budget, goal)
+        cache.set(cache_key, [priors, citations_text, extra_citations])
+        return priors, citations_text, extra_citations
+
+    return _priors_flight.do(cache_key, fetch)
+
+def stream_priors(company_name, budget, goal):
+    """
+    get_priors for the streaming endpoint, through the same cache and _priors_flight.
+    Yields ('text', chunk) and ('priors', priors) while this request's own LLM call
+    streams, then ('done', (priors, citations_text, extra_citations)). A request that
+    joins a call already in flight for the same key only gets the final 'done'.
+    """
+    cache = get_priors_cache()
+    cache_key = priors_cache_key(company_name, budget, goal)
+
+    cached = cache.get(cache_key)
+    if cached is not None:
+        PRIORS_CACHE.inc(result='hit')
+        yield 'done', tuple(cached)
+        return
+    PRIORS_CACHE.inc(result='miss')
+
+    # The flight runs on its own thread so this generator can pass the leader's chunks on
+    chunks = queue.Queue()
+    looked_up = Future()
+
+    def fetch():
+        with stage_timer('llm_fetch'):
+            for kind, payload in stream_llm_for_budget_allocation(company_name, budget, goal):
+                if kind == 'done':
+                    result = payload
+                else:
+                    chunks.put((kind, payload))
+        cache.set(cache_key, list(result))
+        return result
+
+    def run():
+        try:
+            looked_up.set_result(_priors_flight.do(cache_key, fetch))
+        except BaseException as e:
+            looked_up.set_exception(e)
+        finally:
+            chunks.put(None)
+
+    threading.Thread(target=run, name='priors-stream', daemon=True).start()
+    yield from iter(chunks.get, None)
+    yield 'done', looked_up.result()
+
+def read_channel_priors(priors, cache_key, curves=None):
+    """
+    The 'channel' priors of an LLM answer, checked by reading them into the channel
+    model. Priors that cannot be read (missing fields, unknown channels) are evicted
+    from the priors cache before the error propagates; no other error evicts them.
+    """
+    try:
+        channel_model(priors['channel'], curves)
+    except (KeyError, TypeError, AttributeError, ValueError):
+        get_priors_cache().delete(cache_key)
+        raise
+    return priors['channel']
+
+def build_response(priors, citations_text, extra_citations, summary, allocation, layout='nested', curves=None):
+    """
+    The /allocate response body, with confidence_intervals in the given Summary layout
+    and, when fitted curves were used, the channels they covered in fitted_curves
+    """
+    with stage_timer('summary_layout'):
+        confidence_intervals = summary.to_dict(layout)
+    response = {
+        'allocation': allocation,
+        'confidence_intervals': confidence_intervals,
+        'explanation': priors.get('reasoning', ''),
+        'citations': citations_text,
+        'additional_info': list(set(extra_citations) - set(citations_text))
+    }
+    if 'estimator_error' in summary.attrs:
+        response['estimator_error'] = summary.attrs['estimator_error']
+    if curves:
+        response['fitted_curves'] = sorted(set(curves) & set(allocation))
+    return response
+
+def get_allocation_history():
+    global _allocation_history
+    if _allocation_history is None:
+        _allocation_history = allocation_history.from_env()
+    return _allocation_history
+
+def allocation_inputs(company_name, budget, goal, assumptions, options, curves):
+    """Everything an /allocate result depends on besides the priors, as stored and hashed for reuse"""
+    return {
+        'company': fold_name(company_name) if company_name is not None else None,
+        'budget': budget,
+        'goal': fold_name(goal) if goal is not None else None,
+        'constraints': assumptions,
+        'options': options,
+        'curves': {ch: list(params) for ch, params in sorted(curves.items())},
+    }
+
+def run_allocation(data, layout='nested'):
+    """
+    Full /allocate pipeline for one payload: priors, simulation, response body. The
+    run is recorded in the allocation history and its id returned as run_id; with
+    "reuse": true a stored run with the same inputs and priors is returned instead
+    of simulating again (marked reused).
+    """
+    company_name, budget, goal, assumptions = parse_allocation_request(data)
+    options = simulation_options(data)
+    started = time.perf_counter()
+    looked_up = get_priors(company_name, budget, goal)
+    priors, citations_text, extra_citations = looked_up
+    curves = get_curves(company_name, data)
+    priors_ms = (time.perf_counter() - started) * 1000
+
+    history = get_allocation_history()
+    inputs = allocation_inputs(company_name, budget, goal, assumptions, options, curves)
+    priors_hash = stable_hash(list(looked_up))
+    if data.get('reuse'):
+        run = history.find_reusable(inputs, priors_hash)
+        if run is not None:
+            summary = Summary.from_record(run['summary'])
+            response = build_response(
+                priors, citations_text, extra_citations, summary, run['allocation'], layout, curves
+            )
+            response.update(run_id=run['id'], reused=True)
+            return response
+
+    channels = read_channel_priors(priors, priors_cache_key(company_name, budget, goal), curves)
+    started = time.perf_counter()
+    summary, allocation = calculate_budget_allocation(channels, budget, assumptions, curves=curves, **options)
+    simulation_ms = (time.perf_counter() - started) * 1000
+
+    run_id = history.record({
+        'company': company_name, 'goal': goal, 'budget': budget, 'inputs': inputs, 'priors_hash': priors_hash,
+        'allocation': allocation, 'summary': summary.to_record(),
+        'priors_ms': priors_ms, 'simulation_ms': simulation_ms,
+    })
+    response = build_response(priors, citations_text, extra_citations, summary, allocation, layout, curves)
+    response['run_id'] = run_id
+    return response
+
+def get_job_queue():
+    """The process-wide JobQueue, sized from ALLOCATION_JOB_WORKERS / ALLOCATION_JOB_MAX_PENDING"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue(
+            max_workers=int(os.getenv('ALLOCATION_JOB_WORKERS', 4)),
+            max_pending=int(os.getenv('ALLOCATION_JOB_MAX_PENDING', 64)),
+        )
+    return _job_queue
 
 @budget_bp.route('/allocate', methods=['POST'])
 def allocate_budget():
-    """Main endpoint for budget allocation"""
+    """
+    Main endpoint for budget allocation. JSON by default; msgpack when the Accept
+    header asks for it, and ?layout=columnar for column arrays in confidence_intervals.
+    """
     try:
+        mimetype, layout = negotiate(request)
         data = request.json
-        print("Received data:", data)  # Debugging line
-        company_name = data.get('company_name')
-        budget = float(data.get('monthly_budget'))
-        goal = data.get('primary_goal')
-        assumptions = data.get('constraints', {})
-        assumptions = {k.replace('_min', ''): v for k, v in assumptions.items()}
-        print(assumptions)
-        # Simple cache system (in-memory, per-process)
-        # Key: tuple (company_name, budget, goal)
-        # Value: (priors, citations_text, extra_citations)
-        global _priors_cache
-        if '_priors_cache' not in globals():
-            _priors_cache = {}
-
-        cache_key = (company_name, budget, goal)
-
-        if cache_key in _priors_cache:
-            priors, citations_text, extra_citations = _priors_cache[cache_key]
-            print('Using cached priors')
-        else:
-            priors, citations_text, extra_citations = callLLMForBudgetAllocation(company_name, budget, goal)
-            _priors_cache[cache_key] = (priors, citations_text, extra_citations)
-            print('Fetched new priors from LLM')
+        response = run_allocation(data, layout)
+        with stage_timer('serialization'):
+            return encode_response(response, mimetype)
+
+    except NotAcceptable as e:
+        return jsonify({'error': str(e)}), 406
+    except Exception as e:
+        logger.exception("Error in budget allocation: %s", e)
+        return jsonify({'error': str(e)}), 400
+
+@budget_bp.route('/allocate/jobs', methods=['POST'])
+def submit_allocation_job():
+    """
+    Asynchronous /allocate: returns 202 with a job id right away and runs the
+    allocation (including the LLM call) on a background thread. 503 when the
+    job backlog is full.
+    """
+    data = request.json
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected an allocation request object'}), 400
+    try:
+        _, layout = negotiate(request)
+    except NotAcceptable as e:
+        return jsonify({'error': str(e)}), 406
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        job = get_job_queue().submit(run_allocation, data, layout)
+    except QueueFull as e:
+        response = jsonify({'error': f'Too many pending allocation jobs ({e})'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    body = job.to_dict()
+    body['status_url'] = f"{request.path}/{job.id}"
+    return jsonify(body), 202
+
+@budget_bp.route('/allocate/jobs/<job_id>', methods=['GET'])
+def get_allocation_job(job_id):
+    """Poll a job; ?wait=<seconds> long-polls up to JOB_MAX_WAIT for it to finish"""
+    try:
+        mimetype, _ = negotiate(request)
+    except NotAcceptable as e:
+        return jsonify({'error': str(e)}), 406
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    # Clamped to [0, JOB_MAX_WAIT]; negative and NaN waits do not wait
+    wait = min(wait, JOB_MAX_WAIT) if wait > 0 else 0.0
+    job = get_job_queue().get(job_id, wait=wait)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return encode_response(job.to_dict(), mimetype)
+
+@budget_bp.route('/allocate/batch', methods=['POST'])
+def allocate_budget_batch():
+    """
+    Many allocations in one request.
+
+    Body: {"requests": [<allocate payload>, ...], "n_simulations", "strategy", ...} or a
+    bare list of payloads. Priors are fetched once per distinct (company, goal), with
+    up to BATCH_LLM_CONCURRENCY LLM calls in flight, and all simulations run in one
+    batched pass. Streams NDJSON, one {"index", "result"} or {"index", "error"} line
+    per request, errors first; with Accept: application/msgpack the same objects are
+    streamed as consecutive msgpack maps.
+    """
+    try:
+        mimetype, layout = negotiate(request)
+    except NotAcceptable as e:
+        return jsonify({'error': str(e)}), 406
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    binary = mimetype in MSGPACK_ALIASES
+
+    def emit(obj):
+        return dumps(obj, mimetype) if binary else dumps_json(obj) + b'\n'
+
+    data = request.json
+    if isinstance(data, list):
+        data = {'requests': data}
+    if not isinstance(data, dict) or not isinstance(data.get('requests'), list):
+        return jsonify({'error': 'Expected a list of allocation requests'}), 400
+
+    items = data['requests']
+    try:
+        options = {
+            'n_simulations': parse_n_simulations(data),
+            **sampling_options(data),
+            'strategy': parse_strategy(data),
+            'common_random_numbers': bool(data.get('common_random_numbers', False)),
+        }
+        check_request_draws(len(items), options['n_simulations'], 'requests')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        parsed, lookups = {}, {}
+        for index, item in enumerate(items):
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError('Expected an object with an allocation request')
+                company_name, budget, goal, assumptions = parse_allocation_request(item)
+                curves = get_curves(company_name, item)
+            except Exception as e:
+                yield emit({'index': index, 'error': str(e)})
+                continue
+            key = (priors_cache_key.fold(company_name), priors_cache_key.fold(goal))
+            parsed[index] = (budget, assumptions, curves, key)
+            # The first request of each (company, goal) supplies the names and budget for the prompt
+            lookups.setdefault(key, (company_name, budget, goal))
+
+        priors_by_key = {}
+        with ThreadPoolExecutor(max_workers=BATCH_LLM_CONCURRENCY) as pool:
+            futures = {pool.submit(get_priors, *lookup): key for key, lookup in lookups.items()}
+            for future in as_completed(futures):
+                try:
+                    priors_by_key[futures[future]] = future.result()
+                except Exception as e:
+                    priors_by_key[futures[future]] = e
+
+        ready = []
+        for index, (budget, assumptions, curves, key) in parsed.items():
+            looked_up = priors_by_key[key]
+            if isinstance(looked_up, Exception):
+                yield emit({'index': index, 'error': str(looked_up)})
+            elif not isinstance(looked_up[0], dict) or 'channel' not in looked_up[0]:
+                yield emit({'index': index, 'error': 'No priors returned by the LLM'})
+            else:
+                ready.append((index, budget, assumptions, curves, looked_up))
 
-        reasoning = priors.get('reasoning', '')
-        print("Priors:", json.dumps(priors, indent=2))  # Debugging line
         try:
-            summary, allocation = calculate_budget_allocation(priors['channel'], budget, assumptions)
-        except:
-            del _priors_cache
+            results = batch_budget_allocation(
+                [looked_up[0]['channel'] for *_, looked_up in ready],
+                [budget for _, budget, *_ in ready],
+                [assumptions for _, _, assumptions, *_ in ready],
+                curves_list=[curves for *_, curves, _ in ready],
+                **options
+            )
+        except Exception as e:
+            results = [e] * len(ready)
+
+        for (index, _, _, curves, looked_up), result in zip(ready, results):
+            if isinstance(result, Exception):
+                yield emit({'index': index, 'error': str(result)})
+            else:
+                yield emit({'index': index, 'result': build_response(*looked_up, *result, layout, curves)})
 
+    return Response(generate(), mimetype=mimetype if binary else 'application/x-ndjson')
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {dumps_json(data).decode()}\n\n"
+
+@budget_bp.route('/allocate/stream', methods=['POST'])
+def allocate_budget_stream():
+    """
+    /allocate as Server-Sent Events, so the UI can render before the LLM finishes.
+
+    Events, in order: 'llm' (response text as it arrives; skipped on a cache hit and
+    when an identical request's LLM call is already in flight, which this one then
+    shares), 'priors', 'citations', 'progress' (stage, simulations_done, interim allocation and,
+    in the saturation stage, running confidence intervals) about STREAM_PROGRESS_STEPS
+    times per stage, then 'result' with the /allocate body. Failures end the stream
+    with an 'error' event. ?layout=columnar applies to every confidence_intervals.
+    """
+    data = request.json
+    try:
+        _, layout = negotiate(request)
+        company_name, budget, goal, assumptions = parse_allocation_request(data)
+        n_simulations = parse_n_simulations(data)
+        chunk_size = parse_chunk_size(data, max(n_simulations // STREAM_PROGRESS_STEPS, 1))
+        options = {
+            'n_simulations': n_simulations,
+            **sampling_options(data),
+            'chunk_size': chunk_size,
+            'strategy': parse_strategy(data),
+            'common_random_numbers': bool(data.get('common_random_numbers', False)),
+            'curves': get_curves(company_name, data),
+        }
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        cache_key = priors_cache_key(company_name, budget, goal)
+        try:
+            streamed_priors = False
+            for kind, payload in stream_priors(company_name, budget, goal):
+                if kind == 'text':
+                    yield sse_event('llm', {'text': payload})
+                elif kind == 'priors':
+                    streamed_priors = True
+                    yield sse_event('priors', payload)
+                else:
+                    priors, citations_text, extra_citations = payload
+            # Cache hits and requests that joined another's LLM call get the priors at the end
+            if not streamed_priors:
+                yield sse_event('priors', priors)
+            yield sse_event('citations', {
+                'citations': citations_text,
+                'additional_info': list(set(extra_citations) - set(citations_text)),
+            })
+
+            channels = read_channel_priors(priors, cache_key, options['curves'])
+            summary = allocation = None
+            for stage, done, summary, allocation in iter_budget_allocation(channels, budget, assumptions, **options):
+                progress = {'stage': stage, 'simulations_done': done, 'allocation': allocation}
+                if summary is not None:
+                    progress['confidence_intervals'] = summary.to_dict(layout)
+                yield sse_event('progress', progress)
+        except Exception as e:
+            yield sse_event('error', {'error': str(e)})
+            return
+
+        yield sse_event('result', build_response(
+            priors, citations_text, extra_citations, summary, allocation, layout, options['curves']
+        ))
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def sweep_budgets(data):
+    """
+    Budget grid of a sweep request: an explicit list or {"start", "stop", "num"}, with
+    at most MAX_SWEEP_POINTS budgets (checked before the grid is built)
+    """
+    if 'budgets' in data:
+        budgets = data['budgets']
+        if not isinstance(budgets, list) or not 0 < len(budgets) <= MAX_SWEEP_POINTS:
+            raise ValueError(f"budgets must be a list of 1 to {MAX_SWEEP_POINTS} budgets")
+        return [float(b) for b in budgets]
+    budget_range = data.get('budget_range')
+    if not budget_range:
+        raise ValueError("Provide 'budgets' or 'budget_range'")
+    num = parse_int(budget_range, 'num', 50, 1, MAX_SWEEP_POINTS)
+    return np.linspace(float(budget_range['start']), float(budget_range['stop']), num)
+
+@budget_bp.route('/allocate/sweep', methods=['POST'])
+def allocate_budget_sweep():
+    """
+    Response curve over a grid of budgets for one set of priors.
+
+    Priors come from the payload ('priors', either the LLM output or its 'channel'
+    dict) or are looked up once for company_name / primary_goal. Returns columnar
+    arrays, one entry per budget, as JSON or (per the Accept header) msgpack.
+    """
+    try:
+        mimetype, _ = negotiate(request)
+        data = request.json
+        budgets = sweep_budgets(data)
+        strategy = parse_strategy(data, 'water_filling')
+        sampling = sampling_options(data)
+        n_simulations = parse_n_simulations(data)
+        check_request_draws(len(budgets), n_simulations, 'budgets')
+        assumptions = parse_constraints(data.get('constraints'))
+
+        if 'priors' in data:
+            priors, citations_text, extra_citations = data['priors'], [], []
+        else:
+            prompt_budget = float(data.get('monthly_budget', np.median(budgets)))
+            priors, citations_text, extra_citations = get_priors(
+                data.get('company_name'), prompt_budget, data.get('primary_goal')
+            )
+        channel_priors = priors.get('channel', priors)
+        curves = get_curves(data.get('company_name'), data)
+
+        sweep = budget_sweep(
+            channel_priors, budgets, assumptions,
+            n_simulations=n_simulations,
+            strategy=strategy,
+            curves=curves,
+            **sampling,
+        )
+        columns = sweep['channels'] + ['total']
+        # Arrays go to the encoder as they are; transposed copies keep each row contiguous
         response = {
-            'allocation': allocation,
-            'confidence_intervals': summary.to_json(),
-            'explanation': reasoning,
+            'budgets': sweep['budgets'],
+            'allocation': dict(zip(sweep['channels'], np.ascontiguousarray(sweep['allocation'].T))),
+            'conversions': {
+                stat: dict(zip(columns, np.ascontiguousarray(sweep[stat].T))) for stat in ('P10', 'mean', 'P90')
+            },
+            'explanation': priors.get('reasoning', ''),
             'citations': citations_text,
             'additional_info': list(set(extra_citations) - set(citations_text))
         }
+        if curves:
+            response['fitted_curves'] = sorted(set(curves) & set(sweep['channels']))
+        return encode_response(response, mimetype)
+
+    except NotAcceptable as e:
+        return jsonify({'error': str(e)}), 406
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+def by_channel(outputs, channels):
+    """{'allocation': (P, C), 'total_conversions': (P,)} with the allocation split into one array per channel"""
+    return {
+        'allocation': dict(zip(channels, np.ascontiguousarray(outputs['allocation'].T))),
+        'total_conversions': outputs['total_conversions'],
+    }
 
-        print("Response:", json.dumps(response, indent=2))
-        return jsonify(response)
+@budget_bp.route('/allocate/sensitivity', methods=['POST'])
+def allocate_budget_sensitivity():
+    """
+    Which priors drive the recommendation (see sensitivity.sensitivity_analysis).
 
+    Body: an /allocate payload, optionally with inline 'priors' (the LLM output or its
+    'channel' dict) instead of the lookup, plus 'step' (relative perturbation) and
+    'sobol_samples' (0 skips the Sobol indices). Per-parameter results are arrays in
+    the order of 'parameters'; 'tornado' lists the parameters that move total
+    conversions, largest swing first. JSON or (per the Accept header) msgpack.
+    """
+    try:
+        mimetype, _ = negotiate(request)
+        data = request.json
+        company_name, budget, goal, assumptions = parse_allocation_request(data)
+        strategy = parse_strategy(data)
+        sampling = sampling_options(data)
+        n_simulations = parse_n_simulations(data)
+        sobol_samples = parse_int(data, 'sobol_samples', DEFAULT_SOBOL_SAMPLES, 0, MAX_SOBOL_SAMPLES)
+        if 'priors' in data:
+            priors, citations_text, extra_citations = data['priors'], [], []
+        else:
+            priors, citations_text, extra_citations = get_priors(company_name, budget, goal)
+        channel_priors = priors.get('channel', priors)
+        check_request_draws(funnel_scenarios(len(channel_priors), sobol_samples), n_simulations, 'prior scenarios')
+        curves = get_curves(company_name, data)
+
+        result = sensitivity_analysis(
+            channel_priors, budget, assumptions,
+            n_simulations=n_simulations,
+            strategy=strategy,
+            common_random_numbers=bool(data.get('common_random_numbers', False)),
+            step=float(data.get('step', DEFAULT_STEP)),
+            sobol_samples=sobol_samples,
+            curves=curves,
+            **sampling,
+        )
+        channels = result['channels']
+        response = {
+            'channels': channels,
+            'parameters': [
+                {'channel': ch, 'metric': metric, 'bound': bound} for ch, metric, bound in result['parameters']
+            ],
+            'base': {
+                'allocation': dict(zip(channels, result['base']['allocation'].tolist())),
+                'total_conversions': result['base']['total_conversions'],
+            },
+            'one_at_a_time': {
+                'step': result['step'],
+                'low': by_channel(result['one_at_a_time']['low'], channels),
+                'high': by_channel(result['one_at_a_time']['high'], channels),
+            },
+            'tornado': tornado(result),
+            'explanation': priors.get('reasoning', ''),
+            'citations': citations_text,
+            'additional_info': list(set(extra_citations) - set(citations_text))
+        }
+        if 'sobol' in result:
+            response['sobol'] = {
+                'samples': result['sobol']['samples'],
+                'first_order': by_channel(result['sobol']['first_order'], channels),
+                'total_order': by_channel(result['sobol']['total_order'], channels),
+            }
+        if curves:
+            response['fitted_curves'] = sorted(set(curves) & set(channels))
+        return encode_response(response, mimetype)
+
+    except NotAcceptable as e:
+        return jsonify({'error': str(e)}), 406
     except Exception as e:
-        print(f"Error in budget allocation: {e} {e.stacktrace()}")
         return jsonify({'error': str(e)}), 400
 
+@budget_bp.route('/allocate/portfolio', methods=['POST'])
+def allocate_portfolio():
+    """
+    One shared budget across many accounts (see portfolio.portfolio_allocation).
+
+    Body: {"total_budget", "accounts": [{"id", "company_name", "floor", "channels",
+    "constraints", "use_fitted_curves"}, ...], "n_simulations", "seed",
+    "variance_reduction", "use_fitted_curves"}. Accounts use the registry's curves
+    (or their company's fitted curves) and no LLM priors. Returns columnar arrays,
+    one entry per account, as JSON or (per the Accept header) msgpack.
+    """
+    try:
+        mimetype, _ = negotiate(request)
+        data = request.json
+        accounts = data.get('accounts') if isinstance(data, dict) else None
+        if not isinstance(accounts, list) or not accounts:
+            raise ValueError('Expected a list of accounts')
+        n_simulations = parse_n_simulations(data, PORTFOLIO_SIMULATIONS)
+        check_request_draws(len(accounts), n_simulations, 'accounts')
+
+        use_fitted = data.get('use_fitted_curves', True)
+        companies = [
+            account.get('company_name') if account.get('use_fitted_curves', use_fitted) else None
+            for account in accounts
+        ]
+        fitted = get_curve_store().curves_many(companies) if any(c is not None for c in companies) else {}
+        curves_list = [fitted.get(fold_name(company)) if company is not None else None for company in companies]
+
+        result = portfolio_allocation(
+            [account.get('channels') for account in accounts],
+            float(data['total_budget']),
+            floors=[float(account.get('floor', 0)) for account in accounts],
+            assumptions_list=[
+                parse_constraints(account.get('constraints')) for account in accounts
+            ],
+            curves_list=curves_list,
+            n_simulations=n_simulations,
+            **sampling_options(data),
+        )
+        channels = result['channels']
+        # Per-channel arrays are transposed copies so each is contiguous; channels an
+        # account does not use have present false and zero spend
+        response = {
+            'accounts': [account.get('id', account.get('company_name', i)) for i, account in enumerate(accounts)],
+            'channels': channels,
+            'allocation': dict(zip(channels, np.ascontiguousarray(result['allocation'].T))),
+            'present': dict(zip(channels, np.ascontiguousarray(result['present'].T))),
+            'conversions': dict(zip(channels, np.ascontiguousarray(result['conversions'].T))),
+            'account_spend': result['account_spend'],
+            'floor_bound': result['floor_bound'],
+            'marginal_return': result['marginal_return'],
+            'account_conversions': {stat: result[stat] for stat in ('P10', 'mean', 'P90')},
+            'portfolio': result['portfolio'],
+            'fitted_curves': sum(1 for curves in curves_list if curves),
+        }
+        return encode_response(response, mimetype)
+
+    except NotAcceptable as e:
+        return jsonify({'error': str(e)}), 406
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+def plan_budgets(data):
+    """Per-month budgets of a plan request: 'monthly_budgets', or 'monthly_budget' for each of 'horizon' months"""
+    if 'monthly_budgets' in data:
+        return [float(b) for b in data['monthly_budgets']]
+    return [float(data['monthly_budget'])] * int(data.get('horizon', DEFAULT_HORIZON))
+
+@budget_bp.route('/allocate/plan', methods=['POST'])
+def allocate_budget_plan():
+    """
+    Spend schedule over several months with adstock (see planning.plan_budget_allocation).
+
+    Body: an /allocate payload with 'monthly_budget' and 'horizon' (months, default 12)
+    or a 'monthly_budgets' list, optionally inline 'priors', 'adstock' ({channel:
+    decay} overriding the registry), 'carryover' ({channel: effective spend} from
+    before the plan) and 'flexible' (only the horizon total is fixed). Priors only pick
+    the channels; spend follows the saturating curves. Per-channel arrays have one
+    entry per month, as JSON or (per the Accept header) msgpack.
+    """
+    try:
+        mimetype, layout = negotiate(request)
+        data = request.json
+        budgets = plan_budgets(data)
+        sampling = sampling_options(data)
+        company_name, goal = data.get('company_name'), data.get('primary_goal')
+        assumptions = parse_constraints(data.get('constraints'))
+        if 'priors' in data:
+            priors, citations_text, extra_citations = data['priors'], [], []
+        else:
+            priors, citations_text, extra_citations = get_priors(company_name, float(np.mean(budgets)), goal)
+        curves = get_curves(company_name, data)
+
+        plan = plan_budget_allocation(
+            priors.get('channel', priors), budgets, assumptions,
+            adstock_decay=data.get('adstock'),
+            carryover=data.get('carryover'),
+            flexible=bool(data.get('flexible', False)),
+            n_simulations=parse_n_simulations(data, PLAN_SIMULATIONS),
+            common_random_numbers=bool(data.get('common_random_numbers', False)),
+            curves=curves,
+            **sampling,
+        )
+        channels = plan['channels']
+        columns = channels + ['total']
+        # Transposed copies keep each channel's monthly array contiguous
+        response = {
+            'channels': channels,
+            'budgets': plan['budgets'],
+            'adstock': dict(zip(channels, plan['decay'].tolist())),
+            'allocation': dict(zip(channels, np.ascontiguousarray(plan['allocation'].T))),
+            'effective_spend': dict(zip(channels, np.ascontiguousarray(plan['effective_spend'].T))),
+            'marginal_return': plan['marginal_return'],
+            'conversions': {
+                stat: dict(zip(columns, np.ascontiguousarray(plan[stat].T))) for stat in ('P10', 'mean', 'P90')
+            },
+            'horizon': plan['horizon'].to_dict(layout),
+            'expected_conversions': plan['expected_conversions'],
+            'myopic_conversions': plan['myopic_conversions'],
+            'solver': plan['solver'],
+            'explanation': priors.get('reasoning', ''),
+            'citations': citations_text,
+            'additional_info': list(set(extra_citations) - set(citations_text))
+        }
+        if curves:
+            response['fitted_curves'] = sorted(set(curves) & set(channels))
+        return encode_response(response, mimetype)
+
+    except NotAcceptable as e:
+        return jsonify({'error': str(e)}), 406
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@budget_bp.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if _slow_request_profiler is not None:
+        g.profile = _slow_request_profiler.start()
+
+@budget_bp.teardown_request
+def observe_request(error=None):
+    started = g.pop('request_started', None)
+    if started is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.endpoint)
+    profile = g.pop('profile', None)
+    if profile is not None:
+        _slow_request_profiler.finish(profile, request.endpoint)
+
+@budget_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Latency histograms and counters of this process, in Prometheus text format"""
+    return Response(instrumentation.render(), mimetype='text/plain; version=0.0.4')
+
+def run_to_dict(run, layout='nested'):
+    """A stored run for the history API, with confidence_intervals in the given layout"""
+    summary = Summary.from_record(run['summary'])
+    body = {
+        'run_id': run['id'],
+        'created_at': run['created_at'],
+        'company': run['company'],
+        'goal': run['goal'],
+        'budget': run['budget'],
+        'inputs': run['inputs'],
+        'inputs_hash': run['inputs_hash'],
+        'priors_hash': run['priors_hash'],
+        'allocation': run['allocation'],
+        'confidence_intervals': summary.to_dict(layout),
+        'timing': {'priors_ms': run['priors_ms'], 'simulation_ms': run['simulation_ms']},
+    }
+    if 'estimator_error' in summary.attrs:
+        body['estimator_error'] = summary.attrs['estimator_error']
+    return body
+
+@budget_bp.route('/allocations', methods=['GET'])
+def list_allocations():
+    """
+    Stored /allocate runs, newest first. ?company= and ?goal= filter, ?limit= sets the
+    page size and ?cursor= (the previous page's next_cursor) continues a listing.
+    """
+    try:
+        mimetype, layout = negotiate(request)
+        runs, next_cursor = get_allocation_history().page(
+            company=request.args.get('company'),
+            goal=request.args.get('goal'),
+            limit=request.args.get('limit', allocation_history.DEFAULT_PAGE_SIZE),
+            cursor=request.args.get('cursor'),
+        )
+    except NotAcceptable as e:
+        return jsonify({'error': str(e)}), 406
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return encode_response({'runs': [run_to_dict(run, layout) for run in runs], 'next_cursor': next_cursor}, mimetype)
+
+@budget_bp.route('/allocations/<run_id>', methods=['GET'])
+def get_allocation(run_id):
+    try:
+        mimetype, layout = negotiate(request)
+    except NotAcceptable as e:
+        return jsonify({'error': str(e)}), 406
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    run = get_allocation_history().get(run_id)
+    if run is None:
+        return jsonify({'error': 'Run not found'}), 404
+    return encode_response(run_to_dict(run, layout), mimetype)
+
+@budget_bp.route('/allocations/lookup', methods=['POST'])
+def lookup_allocation():
+    """
+    The stored run an /allocate payload would reuse: same inputs and the same cached
+    priors. Never calls the LLM; 404 when the priors are not cached or no run matches.
+    """
+    try:
+        mimetype, layout = negotiate(request)
+        data = request.json
+        company_name, budget, goal, assumptions = parse_allocation_request(data)
+        options = simulation_options(data)
+    except NotAcceptable as e:
+        return jsonify({'error': str(e)}), 406
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+    looked_up = get_priors_cache().get(priors_cache_key(company_name, budget, goal))
+    if looked_up is None:
+        return jsonify({'error': 'No cached priors for this request'}), 404
+    inputs = allocation_inputs(company_name, budget, goal, assumptions, options, get_curves(company_name, data))
+    run = get_allocation_history().find_reusable(inputs, stable_hash(list(looked_up)))
+    if run is None:
+        return jsonify({'error': 'No stored run with these inputs and priors'}), 404
+    return encode_response(run_to_dict(run, layout), mimetype)
+
+@budget_bp.route('/curves/<company_name>', methods=['GET'])
+def get_fitted_curves(company_name):
+    """Saturation curves fitted for a company, with their standard errors and fit stats"""
+    return jsonify({'company': company_name, 'curves': get_curve_store().get(company_name)})
+
 @budget_bp.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -0,0 +1,235 @@
+import bisect
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans an L1 cache hit up to a slow grounded LLM call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metric:
+    """Base for Counter and Histogram: a name, help text and one child per label set"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(line for key, value in items for line in self._render_value(key, value))
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_value(self, key, value):
+        yield f'{self.name}{self._label_text(key)} {value}'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Per-bucket counts (last one is +Inf), then sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
+
+    def count(self, **labels):
+        with self._lock:
+            counts = self._values.get(self._key(labels))
+            return sum(counts[:-1]) if counts else 0
+
+    def _render_value(self, key, counts):
+        cumulative = 0
+        for bound, n in zip(self.buckets + ('+Inf',), counts[:-1]):
+            cumulative += n
+            yield f'{self.name}_bucket{self._label_text(key, [("le", bound)])} {cumulative}'
+        yield f'{self.name}_sum{self._label_text(key)} {counts[-1]}'
+        yield f'{self.name}_count{self._label_text(key)} {cumulative}'
+
+
+REGISTRY = []
+
+STAGE_SECONDS = Histogram(
+    'allocation_stage_seconds', 'Time spent in each stage of an allocation request', ['stage']
+)
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'API request latency until the response is returned', ['endpoint']
+)
+PRIORS_CACHE = Counter('priors_cache_lookups_total', 'Priors cache lookups by result', ['result'])
+LLM_ATTEMPTS = Counter('llm_attempts_total', 'LLM backend calls by outcome', ['outcome'])
+LLM_RETRIES = Counter('llm_retries_total', 'LLM calls retried after a failed attempt')
+SLOW_REQUESTS = Counter('slow_requests_profiled_total', 'Requests over the profiling threshold')
+
+
+def render():
+    """Every registered metric in the Prometheus text exposition format"""
+    return '\n'.join(line for metric in REGISTRY for line in metric.render()) + '\n'
+
+@contextmanager
+def stage_timer(stage):
+    """Observe the wall time of the block in allocation_stage_seconds{stage}"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for chosen threads.
+
+    One daemon thread wakes every interval seconds and records the current stack of each
+    thread with an open session, as collapsed 'file:function;...' strings (the input
+    format of flamegraph.pl and speedscope). It sleeps while no session is open.
+    """
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self, thread_id=None):
+        """Open a session for thread_id (default: the caller); returns its handle"""
+        session = (thread_id or threading.get_ident(), collections.Counter())
+        with self._lock:
+            self._sessions[id(session)] = session
+            # Not alive in a child forked after the first session
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return session
+
+    def stop(self, session):
+        """Close a session; returns a Counter of collapsed stack -> samples"""
+        with self._lock:
+            self._sessions.pop(id(session), None)
+        return session[1]
+
+    def _collapse(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def _run(self):
+        while True:
+            with self._lock:
+                sessions = list(self._sessions.values())
+                if not sessions:
+                    self._wake.clear()
+            if not sessions:
+                self._wake.wait()
+                continue
+            frames = sys._current_frames()
+            for thread_id, stacks in sessions:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stacks[self._collapse(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+class SlowRequestProfiler:
+    """
+    Opt-in profiling of slow requests: every request is sampled, and the stacks of those
+    that take longer than threshold seconds are written to directory as
+    <time>-<name>.folded (one 'stack count' line each) and counted in
+    slow_requests_profiled_total.
+    """
+
+    def __init__(self, threshold, directory, interval=0.005):
+        self.threshold = threshold
+        self.directory = directory
+        self.profiler = SamplingProfiler(interval)
+
+    def start(self):
+        return time.perf_counter(), self.profiler.start()
+
+    def finish(self, handle, name):
+        started, session = handle
+        stacks = self.profiler.stop(session)
+        elapsed = time.perf_counter() - started
+        if elapsed < self.threshold or not stacks:
+            return None
+
+        SLOW_REQUESTS.inc()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{int(time.time() * 1000)}-{name}.folded")
+        with open(path, 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        logger.warning('Slow request %s took %.3fs; profile written to %s', name, elapsed, path)
+        return path
+
+
+def slow_request_profiler_from_env():
+    """
+    SlowRequestProfiler when PROFILE_SLOW_REQUESTS_MS is set, else None. Profiles go to
+    PROFILE_DIR (default: profiles/ next to the database); PROFILE_INTERVAL_MS sets
+    the sampling period.
+    """
+    threshold = os.getenv('PROFILE_SLOW_REQUESTS_MS')
+    if not threshold:
+        return None
+    default_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'profiles')
+    return SlowRequestProfiler(
+        float(threshold) / 1000,
+        os.getenv('PROFILE_DIR', default_dir),
+        interval=float(os.getenv('PROFILE_INTERVAL_MS', 5)) / 1000,
+    )
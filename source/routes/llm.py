@@ -1,94 +1,106 @@
 import os
-from .constants import SYSTEM_PROMPT, PROMPT
-import json5
-from google import genai
-from google.genai import types
-import re
-import os
+from .constants import SYSTEM_PROMPT_TEMPLATE, PROMPT
+from source.models.channels import get_registry
+from .parsing import LLMOutputParser, parse_llm_output
+from .providers import get_provider
+from .instrumentation import stage_timer
 
-def callLLMForBudgetAllocation(company_name, budget, goal):
-  
-  goal_ = {
+# Marketing goals accepted by callLLMForBudgetAllocation, with their prompt descriptions
+GOALS = {
     "generate_leads": "Attract and capture potential customers through targeted ads, landing pages, gated content, and lead magnets to grow the customer base.",
     "brand_awareness": "Increase recognition and visibility of the brand using social media, influencer partnerships, PR, and content marketing.",
     "increase_sales": "Boost revenue through promotional offers, retargeting ads, upselling, cross-selling, and optimized sales funnels.",
     "website_traffic": "Drive more visitors to the website using SEO, paid search, content marketing, and social media campaigns."
-  }
+}
 
-  prompt = PROMPT.format(company_name, budget, goal_[goal])
-  priors, answer, citations = get_grounded_response_citations(SYSTEM_PROMPT + prompt)
+# Short goal names accepted as well
+GOAL_ALIASES = {
+    "leads": "generate_leads",
+    "awareness": "brand_awareness",
+    "sales": "increase_sales",
+    "traffic": "website_traffic",
+}
 
-  citations_from_text = extract_sources_only(answer)
-  return priors, citations_from_text, citations
+def goal_description(goal):
+  """Prompt description of a goal in GOALS or GOAL_ALIASES"""
+  description = GOALS.get(GOAL_ALIASES.get(goal, goal))
+  if description is None:
+    raise ValueError(f"Unknown goal '{goal}', expected one of {sorted(GOALS)}")
+  return description
 
-def extract_json_loose(text):
-    """
-    Extract JSON from an LLM output, tolerating common formatting errors via json5.
-    """
-    # Grab JSON-like block
-    match = re.search(r"\{.*\}", text, re.DOTALL)
-    if not match:
-        raise ValueError("No JSON object found in text.")
-    
-    json_str = match.group(0)
+def system_prompt():
+  """The system prompt, asking for priors of every enabled channel in the registry"""
+  registry = get_registry()
+  return SYSTEM_PROMPT_TEMPLATE.format(
+    channel_names=registry.prompt_channel_names, channel_schema=registry.prompt_schema
+  )
 
-    # Try parsing with json5 (tolerates single quotes, unquoted keys, trailing commas)
-    try:
-        return json5.loads(json_str)
-    except Exception as e:
-        raise ValueError(f"Could not parse even with loose parser: {e}")
+def callLLMForBudgetAllocation(company_name, budget, goal):
+  
+  prompt = PROMPT.format(company_name, budget, goal_description(goal))
+  parsed, citations = get_grounded_response_citations(system_prompt() + prompt)
 
+  return parsed.priors, parsed.urls, citations
 
-def add_citations(response):
-    citation_links = []
-    if response.candidates and response.candidates[0].grounding_metadata and response.candidates[0].grounding_metadata.grounding_supports:
-        supports = response.candidates[0].grounding_metadata.grounding_supports
-        chunks = response.candidates[0].grounding_metadata.grounding_chunks
+def stream_llm_for_budget_allocation(company_name, budget, goal):
+  """
+  Streaming callLLMForBudgetAllocation. Yields ('text', chunk) as the grounded
+  response arrives, ('priors', priors) as soon as the JSON block closes, and finally
+  ('done', (priors, citations_from_text, citations)).
+  """
+  prompt = PROMPT.format(company_name, budget, goal_description(goal))
+  parser = LLMOutputParser()
+  citations = []
 
-        # Sort supports by end_index in descending order to avoid shifting issues when inserting.
-        sorted_supports = sorted(supports, key=lambda s: s.segment.end_index, reverse=True)
+  for text, links in stream_grounded_response(system_prompt() + prompt):
+    citations.extend(links)
+    if not text:
+      continue
+    yield 'text', text
+    priors = parser.feed(text)
+    if priors is not None:
+      yield 'priors', priors
 
-        for support in sorted_supports:
-            if support.grounding_chunk_indices:
-                for i in support.grounding_chunk_indices:
-                    if i < len(chunks):
-                        uri = chunks[i].web.uri
-                        citation_links.append(uri)
-    return citation_links
+  streamed = parser.priors is not None
+  parsed = parser.close()
+  if parsed.priors is None:
+    raise ValueError(f"No JSON object found in text: {parser.error}")
+  if not streamed:
+    yield 'priors', parsed.priors
+  yield 'done', (parsed.priors, parsed.urls, citations)
 
-def get_grounded_response_citations(prompt_text):
-    
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            GEMINI_KEY = os.getenv('GEMINI_KEY')
-            client = genai.Client(api_key=GEMINI_KEY)
+def extract_json_loose(text):
+    """
+    Extract the priors JSON from an LLM output: strict json first, json5 for
+    common formatting errors (single quotes, unquoted keys, trailing commas).
+    """
+    priors = parse_llm_output(text).priors
+    if priors is None:
+        raise ValueError("No JSON object found in text.")
+    return priors
 
-            grounding_tool = types.Tool(
-                google_search=types.GoogleSearch()
-            )
 
-            config = types.GenerateContentConfig(
-                tools=[grounding_tool]
-            )
+def stream_grounded_response(prompt_text):
+    """
+    Grounded LLM call through the streaming API. Yields (text, citation_links)
+    per received chunk.
+    """
+    return get_provider().stream(prompt_text)
 
-            response = client.models.generate_content(
-                model="gemini-2.0-flash",
-                contents=prompt_text,
-                config=config
-            )
+def get_grounded_response_citations(prompt_text):
+    """
+    (ParsedOutput, citation links) for a grounded prompt. Answers without parseable
+    priors are retried; raises LLMError once the provider gives up.
+    """
+    def parse(response):
+        with stage_timer('json_parse'):
+            parsed = parse_llm_output(response.text)
+        if parsed.priors is None:
+            raise ValueError("No JSON object found in text.")
+        return parsed, response.citations
 
-            text_with_citations = add_citations(response)
-            answer = extract_json_loose(response.text)
-            return answer, response.text, text_with_citations
-        except Exception as e:
-            print(f"Attempt {attempt+1} failed: {e}")
-            if attempt == max_retries - 1:
-                print("Max retries reached. Returning empty result.")
-                return ('', [])
+    return get_provider().generate(prompt_text, parse=parse)
 
 def extract_sources_only(text: str):
-    # Find all URLs in the remaining text
-    urls = re.findall(r'https?://\S+', text)
-    return urls
-  
\ No newline at end of file
+    # All URLs in the text
+    return parse_llm_output(text).urls
@@ -1,6 +1,23 @@
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
+from .quantiles import QuantileSketch
+from .parallel import run_sharded, shard_sizes
+from .sampling import NormalSource, adaptive_sample
+from .instrumentation import stage_timer
+from source.models.channels import PRIOR_METRICS as METRICS, get_registry
+
+
+# Relative std of the Monte Carlo noise added on top of the saturating curve
+SATURATION_NOISE = 0.05
+
+# Default number of scenarios per block in chunked (bounded-memory) mode
+DEFAULT_CHUNK_SIZE = 100_000
+
+# How the budget above the per-channel minimums is split
+ALLOCATION_STRATEGIES = ('softmax', 'water_filling')
+
+# Upper bound on simulated values held at once by batch_budget_allocation / budget_sweep
+BATCH_ELEMENTS = 4_000_000
+MAX_SWEEP_POINTS = 1000
 
 
 # Define saturating curve function
@@ -16,110 +33,587 @@ def sample_param(param):
     std = (param['upper'] - param['lower']) / 4
     return np.clip(np.random.normal(loc=mean, scale=std), param['lower'], param['upper'])
 
-def calculate_budget_allocation(priors, total_budget, assumptions=None):
+def scale_minimums(min_budgets, total_budget):
+    """Scale per-channel minimums (last axis) down to fit total_budget when they exceed it."""
+    total_budget = np.asarray(total_budget, dtype=float)
+    sum_min = min_budgets.sum(axis=-1)
+    scale = np.where(sum_min > total_budget, total_budget / np.where(sum_min > 0, sum_min, 1), 1.0)
+    return min_budgets * scale[..., None]
 
-    n_simulations = 5000
+def softmax_allocation(mean_convs, min_budgets, total_budget):
+    """Minimums plus the remaining budget split by a (stable) softmax over mean_convs."""
+    remaining_budget = np.asarray(total_budget, dtype=float) - min_budgets.sum(axis=-1)
+    exp_vals = np.exp(mean_convs - np.max(mean_convs, axis=-1, keepdims=True))
+    softmax_weights = exp_vals / np.sum(exp_vals, axis=-1, keepdims=True)
+    return min_budgets + remaining_budget[..., None] * softmax_weights
 
-    channels = list(priors.keys())
-    # Step 1: Initial equal allocation
-    initial_alloc = {ch: total_budget / len(channels) for ch in channels}
-
-    # Step 2: Monte Carlo to estimate expected conversions per channel (linear approximation)
-    mean_convs = []
-    for ch, budget in initial_alloc.items():
-        conv_list = []
-        for _ in range(n_simulations):
-            cpm = sample_param(priors[ch]['CPM'])
-            ctr = sample_param(priors[ch]['CTR'])
-            cvr = sample_param(priors[ch]['CVR'])
-            impressions = budget / cpm * 1000
-            clicks = impressions * ctr
-            conversions = clicks * cvr
-            conv_list.append(conversions)
-        mean_convs.append(np.mean(conv_list))
-
-    mean_convs = np.array(mean_convs)
-
-    # Step 3: Softmax allocation with minimum fraction
-    min_budgets = {ch: frac * total_budget for ch, frac in assumptions.items()}
-    
-    sum_min_budgets = sum(min_budgets.values())
-
-    if sum_min_budgets > total_budget:
-        scale_factor = total_budget / sum_min_budgets
-        min_budgets = {ch: b * scale_factor for ch, b in min_budgets.items()}
-        sum_min_budgets = total_budget
-
-    remaining_budget = total_budget - sum_min_budgets
-
-    # Stable softmax
-    max_conv_val = np.max(mean_convs)
-    exp_vals = np.exp(mean_convs - max_conv_val)
-    softmax_weights = exp_vals / np.sum(exp_vals)
-
-    softmax_allocation = {
-        ch: min_budgets[ch] + remaining_budget * w
-        for ch, w in zip(channels, softmax_weights)
+def water_filling_price(max_conv, K, min_budgets, total_budget):
+    """
+    Marginal return lam shared by the free channels of water_filling_allocation, with
+    shape (...); inf where the minimums use up the whole budget.
+
+    Channels join the free set in order of their marginal return at the minimum; for
+    each candidate free set lam has a closed form, and exactly one candidate is
+    consistent.
+    """
+    max_conv, K, min_budgets = np.broadcast_arrays(
+        np.asarray(max_conv, dtype=float), np.asarray(K, dtype=float), np.asarray(min_budgets, dtype=float)
+    )
+    total_budget = np.asarray(total_budget, dtype=float)
+    sum_min = min_budgets.sum(axis=-1)
+
+    a = max_conv * K
+    threshold = a / (min_budgets + K) ** 2
+    order = np.argsort(-threshold, axis=-1)
+    take = lambda arr: np.take_along_axis(arr, order, axis=-1)
+    sqrt_a, K_sorted, min_sorted, thr_sorted = take(np.sqrt(a)), take(K), take(min_budgets), take(threshold)
+
+    # Candidate k: the k channels with the highest threshold are free, the rest sit at their minimum
+    free_budget = total_budget[..., None] - (sum_min[..., None] - np.cumsum(min_sorted, axis=-1))
+    lam = (np.cumsum(sqrt_a, axis=-1) / (free_budget + np.cumsum(K_sorted, axis=-1))) ** 2
+    next_thr = np.concatenate([thr_sorted[..., 1:], np.zeros_like(thr_sorted[..., :1])], axis=-1)
+    consistent = (lam <= thr_sorted * (1 + 1e-12)) & (lam >= next_thr * (1 - 1e-12))
+    k = np.where(consistent.any(axis=-1), consistent.argmax(axis=-1), consistent.shape[-1] - 1)
+    lam_star = np.take_along_axis(lam, k[..., None], axis=-1)[..., 0]
+    return np.where(total_budget > sum_min, lam_star, np.inf)
+
+def water_filling_allocation(max_conv, K, min_budgets, total_budget):
+    """
+    Exact maximizer of sum(conversions_from_spend(x, max_conv, K)) subject to
+    sum(x) == total_budget and x >= min_budgets.
+
+    The curves are concave, so at the optimum every channel above its minimum has the
+    same marginal return lam = max_conv * K / (x + K)**2, i.e. x = sqrt(max_conv * K / lam) - K,
+    with lam from water_filling_price. Works on any leading batch shape
+    (..., n_channels); total_budget has shape (...). If the minimums exceed the budget
+    they are scaled down to fit.
+    """
+    max_conv, K, min_budgets = np.broadcast_arrays(
+        np.asarray(max_conv, dtype=float), np.asarray(K, dtype=float), np.asarray(min_budgets, dtype=float)
+    )
+    total_budget = np.asarray(total_budget, dtype=float)
+    sum_min = min_budgets.sum(axis=-1)
+    lam_star = water_filling_price(max_conv, K, min_budgets, total_budget)[..., None]
+
+    optimum = np.maximum(min_budgets, np.sqrt(max_conv * K / lam_star) - K)
+    scale = np.where(sum_min > 0, total_budget / np.where(sum_min > 0, sum_min, 1), 0)
+    scaled_min = min_budgets * scale[..., None]
+    return np.where((total_budget > sum_min)[..., None], optimum, scaled_min)
+
+def prior_arrays(priors, channels, registry=None):
+    """
+    Stack the CPM/CTR/CVR priors of every channel into arrays, taking metrics missing
+    from priors from the registry defaults.
+    Returns {metric: (lower, mean, upper)}, each of shape (n_channels,).
+    """
+    registry = registry or get_registry()
+    # (metric, bound, channel), so every returned array is contiguous
+    bounds = registry.prior_bounds[registry.indices(channels)].transpose(1, 2, 0).copy()
+    for i, ch in enumerate(channels):
+        for j, metric in enumerate(METRICS):
+            prior = priors[ch].get(metric)
+            if prior is not None:
+                bounds[j, :, i] = prior['lower'], prior['mean'], prior['upper']
+    missing = np.isnan(bounds).any(axis=1)
+    if missing.any():
+        j, i = np.argwhere(missing)[0]
+        raise ValueError(f"No {METRICS[j]} prior for channel '{channels[i]}'")
+    return {metric: tuple(bounds[j]) for j, metric in enumerate(METRICS)}
+
+def channel_model(priors, curves=None):
+    """
+    (priors, channels, prior arrays, max_conv, K) for the channels in priors. Channel
+    names are resolved through the registry, so aliases such as 'Facebook' map to
+    their channel and unknown names raise UnknownChannel. curves, {channel: (max_conv,
+    K)} fitted from historical spend, replace the registry's curve parameters.
+    """
+    registry = get_registry()
+    priors = registry.canonicalize(priors)
+    channels = list(priors)
+    max_conv, K = registry.curve_params(channels)
+    for i, ch in enumerate(channels):
+        if curves and ch in curves:
+            max_conv[i], K[i] = curves[ch]
+    return priors, channels, prior_arrays(priors, channels, registry), max_conv, K
+
+def sample_params(lower, mean, upper, z):
+    """
+    Vectorized sample_param: maps standard normals z of shape (n_simulations, n_channels)
+    to clipped-normal draws with std = (upper - lower) / 4.
+    """
+    std = (upper - lower) / 4
+    return np.clip(mean + std * z, lower, upper)
+
+def funnel_source(n_channels, rng, variance_reduction='mc', common_random_numbers=False):
+    return NormalSource(len(METRICS), n_channels, rng, variance_reduction, common_random_numbers)
+
+def saturation_source(n_channels, rng, variance_reduction='mc', common_random_numbers=False):
+    return NormalSource(1, n_channels, rng, variance_reduction, common_random_numbers)
+
+def funnel_conversions(arrays, budgets, z):
+    """
+    CPM -> CTR -> CVR funnel conversions for standard normals z of shape
+    (n_simulations, len(METRICS), *channel_shape).
+    """
+    cpm, ctr, cvr = (sample_params(*arrays[metric], z[:, i]) for i, metric in enumerate(METRICS))
+    impressions = budgets / cpm * 1000
+    clicks = impressions * ctr
+    return clicks * cvr
+
+def simulate_funnel(arrays, budgets, n_simulations, source):
+    """
+    Monte Carlo of the CPM -> CTR -> CVR funnel for the given per-channel budgets.
+    Returns conversions of shape (n_simulations, n_channels).
+    """
+    return funnel_conversions(arrays, budgets, source.draw(n_simulations))
+
+def saturation_conversions(budgets, max_conv, K, noise):
+    """Saturating-curve conversions with multiplicative noise (standard normals), clipped at zero."""
+    expected = conversions_from_spend(budgets, max_conv, K)
+    return np.maximum(expected * (1 + SATURATION_NOISE * noise), 0)
+
+def simulate_saturation(budgets, max_conv, K, n_simulations, source):
+    """
+    Saturating-curve conversions with small multiplicative Monte Carlo noise,
+    clipped at zero. Returns shape (n_simulations, n_channels).
+    """
+    return saturation_conversions(budgets, max_conv, K, source.draw(n_simulations)[:, 0])
+
+def with_total(conversions):
+    """Append the per-scenario total (sum over the last axis) as a last column."""
+    return np.concatenate([conversions, conversions.sum(axis=-1, keepdims=True)], axis=-1)
+
+def chunk_sizes(n_simulations, chunk_size):
+    """Split n_simulations into blocks of at most chunk_size."""
+    full, rest = divmod(n_simulations, chunk_size)
+    return [chunk_size] * full + ([rest] if rest else [])
+
+def funnel_mean(arrays, budgets, n_simulations, source, chunk_size=None):
+    """Mean funnel conversions per channel, streamed in blocks when chunk_size is set."""
+    if chunk_size is None:
+        return simulate_funnel(arrays, budgets, n_simulations, source).mean(axis=0)
+    total = np.zeros(len(budgets))
+    for size in chunk_sizes(n_simulations, chunk_size):
+        total += simulate_funnel(arrays, budgets, size, source).sum(axis=0)
+    return total / n_simulations
+
+def stream_saturation(budgets, max_conv, K, n_simulations, source, chunk_size):
+    """
+    Chunked simulate_saturation: feeds every block (channels + total column) into a
+    QuantileSketch so peak memory does not depend on n_simulations.
+    """
+    sketch = QuantileSketch(len(budgets) + 1, rng=source.rng)
+    for size in chunk_sizes(n_simulations, chunk_size):
+        sketch.update(with_total(simulate_saturation(budgets, max_conv, K, size, source)))
+    return sketch
+
+def funnel_shard(arrays, budgets, n_simulations, chunk_size, sampling, seed_seq):
+    """Process-pool shard of Step 2: summed funnel conversions per channel."""
+    source = funnel_source(len(budgets), np.random.default_rng(seed_seq), *sampling)
+    return {'sum': funnel_mean(arrays, budgets, n_simulations, source, chunk_size) * n_simulations}
+
+def saturation_shard(budgets, max_conv, K, n_simulations, chunk_size, sampling, seed_seq):
+    """Process-pool shard of Step 4: a QuantileSketch of this shard's scenarios."""
+    source = saturation_source(len(budgets), np.random.default_rng(seed_seq), *sampling)
+    return stream_saturation(budgets, max_conv, K, n_simulations, source, chunk_size).to_arrays()
+
+def parallel_funnel_mean(arrays, budgets, n_simulations, seed_seq, n_workers, chunk_size, sampling):
+    shards = [(arrays, budgets, size, chunk_size, sampling) for size in shard_sizes(n_simulations, n_workers)]
+    results = run_sharded(funnel_shard, shards, seed_seq, n_workers)
+    return sum(r['sum'] for r in results) / n_simulations
+
+def parallel_saturation(budgets, max_conv, K, n_simulations, seed_seq, n_workers, chunk_size, sampling):
+    shards = [(budgets, max_conv, K, size, chunk_size, sampling) for size in shard_sizes(n_simulations, n_workers)]
+    results = run_sharded(saturation_shard, shards, seed_seq, n_workers)
+    # Merge in shard order with a seeded generator so the result is reproducible
+    rng = np.random.default_rng(seed_seq.spawn(1)[0])
+    sketch = QuantileSketch.from_arrays(results[0], rng=rng)
+    for r in results[1:]:
+        sketch.merge(QuantileSketch.from_arrays(r))
+    return sketch
+
+class Summary:
+    """
+    P10 / mean / P90 per row (the channels, then 'total') as one (n_rows, 3) float
+    array. Replaces the pandas summary DataFrame on the request path: it keeps the
+    parts callers used (index, attrs, values, summary[column], loc[row, column]) and
+    converts straight to response layouts.
+    """
+
+    columns = ('P10', 'mean', 'P90')
+
+    def __init__(self, p10, mean, p90, index):
+        self.index = list(index)
+        # Column-major so each column is one contiguous array
+        self.values = np.asfortranarray(np.column_stack([p10, mean, p90]), dtype=float)
+        self.attrs = {}
+        self._rows = {row: i for i, row in enumerate(self.index)}
+
+    @property
+    def loc(self):
+        return _SummaryLocator(self)
+
+    def __getitem__(self, column):
+        return self.values[:, self.columns.index(column)]
+
+    def to_dict(self, layout='nested'):
+        """
+        'nested': {column: {row: value}}, the shape DataFrame.to_json() produced.
+        'columnar': {'index': rows, column: array}, one array per column.
+        """
+        if layout == 'nested':
+            return {
+                name: dict(zip(self.index, self.values[:, j].tolist())) for j, name in enumerate(self.columns)
+            }
+        if layout == 'columnar':
+            columnar = {'index': self.index}
+            columnar.update((name, self.values[:, j]) for j, name in enumerate(self.columns))
+            return columnar
+        raise ValueError(f"Unknown layout '{layout}', expected 'nested' or 'columnar'")
+
+    def to_record(self):
+        """JSON-ready lists plus attrs, for storage; from_record reverses it"""
+        record = {'index': self.index, 'attrs': self.attrs}
+        record.update((name, self.values[:, j].tolist()) for j, name in enumerate(self.columns))
+        return record
+
+    @classmethod
+    def from_record(cls, record):
+        summary = cls(record['P10'], record['mean'], record['P90'], record['index'])
+        summary.attrs.update(record.get('attrs', {}))
+        return summary
+
+    def to_frame(self):
+        """The summary as a pandas DataFrame, for analysis code"""
+        import pandas as pd
+        df = pd.DataFrame(self.values, index=self.index, columns=list(self.columns))
+        df.attrs.update(self.attrs)
+        return df
+
+
+class _SummaryLocator:
+    def __init__(self, summary):
+        self.summary = summary
+
+    def __getitem__(self, key):
+        row, column = key
+        return float(self.summary.values[self.summary._rows[row], self.summary.columns.index(column)])
+
+def summarize_sketch(sketch, channels):
+    """
+    Same layout as summarize_samples, built from a QuantileSketch. The estimator
+    error is attached as summary.attrs['estimator_error'].
+    """
+    index = list(channels) + ['total']
+    p10, p90 = sketch.quantile([0.1, 0.9])
+    summary = Summary(p10, sketch.mean(), p90, index)
+    summary.attrs['estimator_error'] = {
+        'n_simulations': int(sketch.count),
+        'mean_std_error': dict(zip(index, sketch.std_error().tolist())),
+        'quantile_rank_error': sketch.relative_rank_error(),
     }
+    return summary
+
+def summarize_samples(samples, channels):
+    """
+    P10 / mean / P90 of samples whose columns are the channels followed by the total,
+    as a Summary.
+    """
+    p10, p90 = np.percentile(samples, [10, 90], axis=0)
+    return Summary(p10, samples.mean(axis=0), p90, list(channels) + ['total'])
+
+def summarize_conversions(conversions, channels):
+    """
+    P10 / mean / P90 per channel plus the per-scenario total, as a Summary.
+    """
+    return summarize_samples(with_total(conversions), channels)
+
+def adaptive_report(report, funnel_report, index, sampling):
+    """estimator_error entry for adaptive mode: draws used and CI half-widths."""
+    half_width = report['half_width']
+    return {
+        'n_simulations': report['n_simulations'],
+        'funnel_simulations': funnel_report['n_simulations'],
+        'converged': report['converged'] and funnel_report['converged'],
+        'tolerance': report['tolerance'],
+        'variance_reduction': sampling[0],
+        'common_random_numbers': sampling[1],
+        'ci_half_width': {
+            col: {'mean': float(half_width[0, i]), 'P10': float(half_width[1, i]), 'P90': float(half_width[2, i])}
+            for i, col in enumerate(index)
+        },
+    }
+
+def calculate_budget_allocation(priors, total_budget, assumptions=None, n_simulations=5000, seed=None,
+                                chunk_size=None, n_workers=None, tolerance=None,
+                                variance_reduction='mc', common_random_numbers=False, strategy='softmax',
+                                curves=None):
+    """
+    Allocate total_budget across the channels in priors.
+
+    With chunk_size set, scenarios are simulated in blocks of that size and P10/P90 come
+    from a streaming QuantileSketch, so memory stays flat for any n_simulations.
+    With n_workers set, both Monte Carlo stages are sharded across a process pool
+    (implies chunked mode); results are reproducible for a given seed and n_workers.
+    With tolerance set, both stages sample in rounds until the relative 95% CI
+    half-width of every mean and percentile is within tolerance; n_simulations is then
+    the cap, and the draws actually used are reported in summary.attrs['estimator_error'].
+
+    variance_reduction ('mc', 'antithetic' or 'sobol') and common_random_numbers
+    control how the underlying normal draws are generated in every mode.
+
+    strategy picks how the budget above the minimums is split: 'softmax' over the
+    Monte Carlo funnel conversions (the original heuristic), or 'water_filling', the
+    exact optimum under the saturating curves (no Monte Carlo needed for the split).
+
+    curves, {channel: (max_conv, K)} fitted from historical spend, override the
+    registry's curve parameters for those channels.
+    """
+    if strategy not in ALLOCATION_STRATEGIES:
+        raise ValueError(f"Unknown strategy '{strategy}', expected one of {ALLOCATION_STRATEGIES}")
+    if tolerance is not None and (chunk_size or n_workers):
+        raise ValueError("Adaptive mode (tolerance) cannot be combined with chunk_size or n_workers")
+
+    rng = np.random.default_rng(seed)
+    sampling = (variance_reduction, common_random_numbers)
+    if n_workers:
+        chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        funnel_seed, saturation_seed = np.random.SeedSequence(seed).spawn(2)
+    assumptions = assumptions or {}
+
+    priors, channels, arrays, max_conv, K = channel_model(priors, curves)
+    n_channels = len(channels)
+
+    # Step 1: Initial equal allocation
+    initial_alloc = np.full(n_channels, total_budget / n_channels)
+
+    # Step 2: Monte Carlo to estimate expected conversions per channel (linear approximation),
+    # only the softmax strategy uses it
+    funnel_report = {'n_simulations': 0, 'converged': True}
+    with stage_timer('funnel_simulation'):
+        if strategy == 'water_filling':
+            mean_convs = None
+        elif tolerance is not None:
+            funnel_samples, funnel_report = adaptive_sample(
+                lambda source, n: simulate_funnel(arrays, initial_alloc, n, source),
+                lambda child: funnel_source(n_channels, child, *sampling),
+                rng, tolerance, max_simulations=n_simulations,
+            )
+            mean_convs = funnel_samples.mean(axis=0)
+        elif n_workers:
+            mean_convs = parallel_funnel_mean(
+                arrays, initial_alloc, n_simulations, funnel_seed, n_workers, chunk_size, sampling
+            )
+        else:
+            source = funnel_source(n_channels, rng, *sampling)
+            mean_convs = funnel_mean(arrays, initial_alloc, n_simulations, source, chunk_size)
+
+    # Step 3: Allocation of the remaining budget with minimum fraction
+    min_budgets = np.array([assumptions.get(ch, 0) * total_budget for ch in channels], dtype=float)
+    min_budgets = scale_minimums(min_budgets, total_budget)
+
+    with stage_timer('allocation'):
+        if strategy == 'water_filling':
+            budgets = water_filling_allocation(max_conv, K, min_budgets, total_budget)
+        else:
+            budgets = softmax_allocation(mean_convs, min_budgets, total_budget)
 
     # Step 4: Monte Carlo with saturating curve
-    
-    # Define max_conv and K per channel (can tune these values)
-    max_conv_dict = {'google': 600, 'linkedin': 200, 'meta': 150, 'tiktok': 100}
-    K_dict = {'google': 2000, 'linkedin': 1000, 'meta': 800, 'tiktok': 500}
-
-    final_channel_conversions = {ch: [] for ch in channels}
-    final_total_conversions = []
-
-    for _ in range(n_simulations):
-        total_conv = 0
-        for ch, budget in softmax_allocation.items():
-            conversions = conversions_from_spend(budget, max_conv=max_conv_dict[ch], K=K_dict[ch])
-            # Optional: add small Monte Carlo noise
-            noise = np.random.normal(0, 0.05 * conversions)
-            conversions += noise
-            conversions = max(0, conversions)  # Ensure non-negative
-            final_channel_conversions[ch].append(conversions)
-            total_conv += conversions
-        final_total_conversions.append(total_conv)
+    with stage_timer('saturation_simulation'):
+        if tolerance is not None:
+            samples, report = adaptive_sample(
+                lambda source, n: with_total(simulate_saturation(budgets, max_conv, K, n, source)),
+                lambda child: saturation_source(n_channels, child, *sampling),
+                rng, tolerance, quantiles=(10, 90), max_simulations=n_simulations,
+            )
+        elif chunk_size is None:
+            source = saturation_source(n_channels, rng, *sampling)
+            final_conversions = simulate_saturation(budgets, max_conv, K, n_simulations, source)
+        elif n_workers:
+            sketch = parallel_saturation(
+                budgets, max_conv, K, n_simulations, saturation_seed, n_workers, chunk_size, sampling
+            )
+        else:
+            source = saturation_source(n_channels, rng, *sampling)
+            sketch = stream_saturation(budgets, max_conv, K, n_simulations, source, chunk_size)
 
     # Step 5: Summarize
-    summary = {}
-    for ch in channels:
-        conv_list = final_channel_conversions[ch]
-        summary[ch] = {
-            'P10': np.percentile(conv_list, 10),
-            'mean': np.mean(conv_list),
-            'P90': np.percentile(conv_list, 90)
-        }
-
-    summary['total'] = {
-        'P10': np.percentile(final_total_conversions, 10),
-        'mean': np.mean(final_total_conversions),
-        'P90': np.percentile(final_total_conversions, 90)
-    }
+    with stage_timer('summary'):
+        if tolerance is not None:
+            summary = summarize_samples(samples, channels)
+            summary.attrs['estimator_error'] = adaptive_report(report, funnel_report, summary.index, sampling)
+        elif chunk_size is None:
+            summary = summarize_conversions(final_conversions, channels)
+        else:
+            summary = summarize_sketch(sketch, channels)
+
+    allocation = {ch: float(b) for ch, b in zip(channels, budgets)}
 
-    df_summary = pd.DataFrame(summary).T
-
-    # Output
-    # print("Optimized Budget Allocation (Softmax + Saturating Curve + Minimums):")
-    # for ch, budget in softmax_allocation.items():
-    #     print(f"{ch}: ${budget:.2f}")
-
-    # print("\nConversions Summary (P10, Mean, P90):")
-    # print(df_summary)
-
-    # Visualization
-    # channels_plot = channels
-    # means = df_summary.loc[channels_plot, 'mean']
-    # lower_err = np.maximum(means - df_summary.loc[channels_plot, 'P10'], 0)
-    # upper_err = np.maximum(df_summary.loc[channels_plot, 'P90'] - means, 0)
-    # errors = [lower_err, upper_err]
-
-    # plt.figure(figsize=(10,6))
-    # plt.bar(channels_plot, means, yerr=errors, capsize=5, color='skyblue')
-    # plt.ylabel('Expected Conversions')
-    # plt.title('Optimized Funnel Conversions per Channel (Saturating Curve)')
-    # plt.grid(axis='y', linestyle='--', alpha=0.6)
-    # plt.show()
-    return df_summary, softmax_allocation
\ No newline at end of file
+    return summary, allocation
+
+def iter_budget_allocation(priors, total_budget, assumptions=None, n_simulations=5000, seed=None, chunk_size=1000,
+                           strategy='softmax', variance_reduction='mc', common_random_numbers=False, curves=None):
+    """
+    Progressive calculate_budget_allocation for streaming clients.
+
+    Simulates in blocks of chunk_size and yields (stage, simulations_done, summary,
+    allocation) after every block. In the 'funnel' stage the allocation is the interim
+    softmax split from the running mean and summary is None; in the 'saturation'
+    stage the allocation is final and summary holds running P10/mean/P90 from a
+    QuantileSketch. The last item matches calculate_budget_allocation with the same
+    seed and chunk_size.
+    """
+    if strategy not in ALLOCATION_STRATEGIES:
+        raise ValueError(f"Unknown strategy '{strategy}', expected one of {ALLOCATION_STRATEGIES}")
+
+    rng = np.random.default_rng(seed)
+    sampling = (variance_reduction, common_random_numbers)
+    assumptions = assumptions or {}
+    priors, channels, arrays, max_conv, K = channel_model(priors, curves)
+    n_channels = len(channels)
+    as_dict = lambda budgets: {ch: float(b) for ch, b in zip(channels, budgets)}
+
+    min_budgets = np.array([assumptions.get(ch, 0) * total_budget for ch in channels], dtype=float)
+    min_budgets = scale_minimums(min_budgets, total_budget)
+
+    if strategy == 'water_filling':
+        budgets = water_filling_allocation(max_conv, K, min_budgets, total_budget)
+    else:
+        initial_alloc = np.full(n_channels, total_budget / n_channels)
+        source = funnel_source(n_channels, rng, *sampling)
+        total, done = np.zeros(n_channels), 0
+        for size in chunk_sizes(n_simulations, chunk_size):
+            total += simulate_funnel(arrays, initial_alloc, size, source).sum(axis=0)
+            done += size
+            budgets = softmax_allocation(total / done, min_budgets, total_budget)
+            yield 'funnel', done, None, as_dict(budgets)
+
+    source = saturation_source(n_channels, rng, *sampling)
+    sketch = QuantileSketch(n_channels + 1, rng=source.rng)
+    for size in chunk_sizes(n_simulations, chunk_size):
+        sketch.update(with_total(simulate_saturation(budgets, max_conv, K, size, source)))
+        yield 'saturation', sketch.count, summarize_sketch(sketch, channels), as_dict(budgets)
+
+def batch_budget_allocation(priors_list, total_budgets, assumptions_list=None, n_simulations=5000, seed=None,
+                            strategy='softmax', variance_reduction='mc', common_random_numbers=False,
+                            curves_list=None):
+    """
+    calculate_budget_allocation for many requests in one vectorized pass.
+
+    Requests sharing a channel set are stacked into (n_items, n_channels) arrays and
+    simulated together, in blocks of items bounded by BATCH_ELEMENTS. Returns a list in
+    input order holding (summary, allocation) per item, or the exception raised
+    while preparing that item. curves_list holds each item's fitted curves (or None).
+    """
+    if strategy not in ALLOCATION_STRATEGIES:
+        raise ValueError(f"Unknown strategy '{strategy}', expected one of {ALLOCATION_STRATEGIES}")
+
+    rng = np.random.default_rng(seed)
+    sampling = (variance_reduction, common_random_numbers)
+    assumptions_list = assumptions_list or [None] * len(priors_list)
+    curves_list = curves_list or [None] * len(priors_list)
+    results = [None] * len(priors_list)
+
+    # Validate each item on its own so one bad request does not fail the batch
+    groups = {}
+    inputs = zip(priors_list, total_budgets, assumptions_list, curves_list)
+    for i, (priors, budget, assumptions, curves) in enumerate(inputs):
+        try:
+            priors, channels, arrays, max_conv, K = channel_model(priors, curves)
+            assumptions = assumptions or {}
+            groups.setdefault(tuple(channels), []).append({
+                'index': i,
+                'budget': float(budget),
+                'arrays': arrays,
+                'min_budgets': np.array([assumptions.get(ch, 0) * float(budget) for ch in channels], dtype=float),
+                'max_conv': max_conv,
+                'K': K,
+            })
+        except Exception as e:
+            results[i] = e
+
+    for channels, items in groups.items():
+        block = max(1, BATCH_ELEMENTS // (n_simulations * len(channels) * len(METRICS)))
+        for start in range(0, len(items), block):
+            chunk = items[start:start + block]
+            shape = (len(chunk), len(channels))
+            budgets = np.array([item['budget'] for item in chunk])
+            arrays = {
+                metric: tuple(np.stack([item['arrays'][metric][j] for item in chunk]) for j in range(3))
+                for metric in METRICS
+            }
+            max_conv = np.stack([item['max_conv'] for item in chunk])
+            K = np.stack([item['K'] for item in chunk])
+            min_budgets = scale_minimums(np.stack([item['min_budgets'] for item in chunk]), budgets)
+
+            if strategy == 'water_filling':
+                allocations = water_filling_allocation(max_conv, K, min_budgets, budgets)
+            else:
+                initial_alloc = np.repeat(budgets[:, None] / len(channels), len(channels), axis=1)
+                source = funnel_source(shape, rng, *sampling)
+                mean_convs = simulate_funnel(arrays, initial_alloc, n_simulations, source).mean(axis=0)
+                allocations = softmax_allocation(mean_convs, min_budgets, budgets)
+
+            source = saturation_source(shape, rng, *sampling)
+            samples = with_total(simulate_saturation(allocations, max_conv, K, n_simulations, source))
+            p10, p90 = np.percentile(samples, [10, 90], axis=0)
+            means = samples.mean(axis=0)
+
+            index = list(channels) + ['total']
+            for j, item in enumerate(chunk):
+                summary = Summary(p10[j], means[j], p90[j], index)
+                results[item['index']] = (summary, {ch: float(b) for ch, b in zip(channels, allocations[j])})
+
+    return results
+
+def budget_sweep(priors, budgets, assumptions=None, n_simulations=5000, seed=None, strategy='water_filling',
+                 variance_reduction='mc', curves=None):
+    """
+    Response curve: allocation and P10/mean/P90 conversions at every budget in a grid,
+    for one set of priors.
+
+    All grid points share the same random draws, so the curves are smooth, and each
+    stage is a single broadcast over (n_simulations, n_budgets, n_channels) (in blocks
+    of budgets bounded by BATCH_ELEMENTS). Returns a dict of arrays: budgets (g,),
+    channels, allocation (g, c) and P10 / mean / P90 of shape (g, c + 1), the last
+    column being the total.
+    """
+    if strategy not in ALLOCATION_STRATEGIES:
+        raise ValueError(f"Unknown strategy '{strategy}', expected one of {ALLOCATION_STRATEGIES}")
+    budgets = np.asarray(budgets, dtype=float)
+    if budgets.ndim != 1 or not 0 < len(budgets) <= MAX_SWEEP_POINTS:
+        raise ValueError(f"Expected between 1 and {MAX_SWEEP_POINTS} budgets")
+
+    rng = np.random.default_rng(seed)
+    assumptions = assumptions or {}
+    priors, channels, arrays, max_conv, K = channel_model(priors, curves)
+    n_channels = len(channels)
+
+    fractions = np.array([assumptions.get(ch, 0) for ch in channels], dtype=float)
+    min_budgets = scale_minimums(budgets[:, None] * fractions, budgets)
+
+    if strategy == 'water_filling':
+        allocations = water_filling_allocation(max_conv, K, min_budgets, budgets)
+    else:
+        # Funnel conversions are linear in spend: one simulation per dollar serves every budget
+        z = funnel_source(n_channels, rng, variance_reduction).draw(n_simulations)
+        per_dollar = funnel_conversions(arrays, 1.0, z).mean(axis=0)
+        mean_convs = budgets[:, None] / n_channels * per_dollar
+        allocations = softmax_allocation(mean_convs, min_budgets, budgets)
+
+    noise = saturation_source(n_channels, rng, variance_reduction).draw(n_simulations)[:, 0, None]
+    stats = np.empty((3, len(budgets), n_channels + 1))
+    block = max(1, BATCH_ELEMENTS // (n_simulations * (n_channels + 1)))
+    for start in range(0, len(budgets), block):
+        samples = with_total(saturation_conversions(allocations[start:start + block], max_conv, K, noise))
+        stats[0, start:start + block], stats[2, start:start + block] = np.percentile(samples, [10, 90], axis=0)
+        stats[1, start:start + block] = samples.mean(axis=0)
+
+    return {
+        'budgets': budgets,
+        'channels': channels,
+        'allocation': allocations,
+        'P10': stats[0],
+        'mean': stats[1],
+        'P90': stats[2],
+    }
@@ -0,0 +1,112 @@
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+
+# Long-lived pools, one per worker count in use. A pool is never replaced while
+# other threads may still be submitting to it.
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+def get_pool(n_workers):
+    """Return the shared process pool with n_workers processes, creating it on first use."""
+    with _pool_lock:
+        pool = _pools.get(n_workers)
+        if pool is None:
+            pool = _pools[n_workers] = ProcessPoolExecutor(max_workers=n_workers)
+        return pool
+
+def _forget_pool():
+    # A forked child inherits the parent's pool objects but none of their worker threads
+    global _pools, _pool_lock
+    _pools, _pool_lock = {}, threading.Lock()
+
+os.register_at_fork(after_in_child=_forget_pool)
+
+@atexit.register
+def shutdown_pool():
+    with _pool_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True)
+
+def shard_sizes(n_simulations, n_workers):
+    """
+    Split n_simulations into at most n_workers near-equal, deterministic shards. There
+    are never more shards than simulations, so no shard is empty.
+    """
+    if n_simulations < 1:
+        raise ValueError("n_simulations must be at least 1")
+    n_shards = min(n_workers, n_simulations)
+    base, rest = divmod(n_simulations, n_shards)
+    return [base + (i < rest) for i in range(n_shards)]
+
+def _export(arrays):
+    """Copy a dict of arrays into one new shared-memory segment; return its name and layout."""
+    layout = []
+    offset = 0
+    for key, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        layout.append((key, arr.dtype.str, arr.shape, offset))
+        offset += arr.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for (key, dtype, shape, start), arr in zip(layout, arrays.values()):
+        view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)
+        view[...] = arr
+        del view
+    name = shm.name
+    shm.close()
+    # The parent attaches, copies and unlinks the segment; without this the worker's
+    # registration is left over and the resource tracker warns about a leak at exit
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return name, layout
+
+def _import(name, layout):
+    """Read back (and release) a segment written by _export."""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return {
+            key: np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start).copy()
+            for key, dtype, shape, start in layout
+        }
+    finally:
+        shm.close()
+        shm.unlink()
+
+def _run_shard(fn, args, seed_seq):
+    return _export(fn(*args, seed_seq))
+
+def run_sharded(fn, shard_args, seed_seq, n_workers):
+    """
+    Run fn(*shard_args[i], child_seed_i) on the process pool, one shard per worker.
+
+    Each shard gets its own SeedSequence spawned from seed_seq, so results depend only on
+    the seed and the worker count. fn must be a picklable module-level function returning
+    a dict of arrays; those come back through shared memory. Results keep shard order.
+    """
+    seeds = seed_seq.spawn(len(shard_args))
+    if n_workers <= 1:
+        return [fn(*args, s) for args, s in zip(shard_args, seeds)]
+
+    pool = get_pool(n_workers)
+    futures = [pool.submit(_run_shard, fn, args, s) for args, s in zip(shard_args, seeds)]
+
+    # Drain every future so no segment is left behind if one shard fails
+    results, error = [], None
+    for future in futures:
+        try:
+            results.append(_import(*future.result()))
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        raise error
+    return results
@@ -0,0 +1,162 @@
+import json
+import re
+from collections import namedtuple
+
+
+ParsedOutput = namedtuple('ParsedOutput', ['priors', 'sources', 'citation_numbers', 'urls'])
+
+# Everything the scanner stops at: JSON structure, '[n]' citations or '[n] <url>'
+# Sources entries, and bare URLs. Text in between is skipped by the regex engine.
+TOKEN = re.compile(r"""
+    (?P<struct>[{}"'\\])
+  | \[(?P<ref>\d{1,3})\][ \t]*:?[ \t]*<?(?P<source>(?:https?://|www\.)[^\s"'<>(){}\[\]]+)?
+  | (?P<url>https?://[^\s"'<>(){}\[\]]+)
+""", re.VERBOSE)
+
+URL_TRAILING = '.,;:!?*'
+
+# A '[n] ' at the end of the scanned text may still be followed by its Sources URL
+OPEN_REF = re.compile(r'\[\d{1,3}\][ \t]*:?[ \t]*<?\Z')
+
+# The two json5-isms LLMs produce most, cheap to rewrite for the C parser
+QUOTED_KEY = re.compile(r"'(\w+)'(\s*:)")
+TRAILING_COMMA = re.compile(r',(\s*[}\]])')
+
+
+def parse_block(block):
+    """
+    A {...} block as a dict. Tries the C-backed json parser, then again after fixing
+    single-quoted keys and trailing commas, and only then the pure-Python json5.
+    """
+    try:
+        value = json.loads(block)
+    except ValueError:
+        try:
+            value = json.loads(TRAILING_COMMA.sub(r'\1', QUOTED_KEY.sub(r'"\1"\2', block)))
+        except ValueError:
+            import json5  # pure Python and slow to import; most answers never need it
+            value = json5.loads(block)
+    if not isinstance(value, dict):
+        raise ValueError(f"Expected a JSON object, got {type(value).__name__}")
+    return value
+
+
+class LLMOutputParser:
+    """
+    Single-pass parser for the priors answer, fed the raw text or streamed chunks.
+
+    One scan collects the priors object (the first top-level {...} block that parses;
+    braces inside quoted strings are ignored and scanning for blocks stops once it is
+    found, so braces in the Sources section are never picked up), the numbered Sources
+    list ('[n] <url>' -> sources[n]), in-text citation indices ('[n]') and every http(s)
+    URL. Text is only scanned up to the last whitespace of what has arrived, so tokens
+    split across chunks are seen whole.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+        self._pending = ''
+        self._depth = 0
+        self._quote = None
+        self._start = None
+        self._value_end = None
+        self.error = None
+        self.priors = None
+        self.sources = {}
+        self.citation_numbers = []
+        self.urls = []
+
+    def feed(self, chunk):
+        """Consume a chunk; returns the priors the first time they parse, else None."""
+        text = self._pending + chunk
+        cut = max(text.rfind(' '), text.rfind('\n'), text.rfind('\t'), text.rfind('\r')) + 1
+        open_ref = OPEN_REF.search(text, max(cut - 16, 0), cut)
+        if open_ref:
+            cut = open_ref.start()
+        self._pending = text[cut:]
+        return self._scan(text[:cut]) if cut else None
+
+    def close(self):
+        """Flush the remaining text and return the ParsedOutput; priors is None if none parsed"""
+        if self._pending:
+            self._scan(self._pending)
+            self._pending = ''
+        if self.priors is None and self._start is not None:
+            self._repair()
+        return ParsedOutput(self.priors, self.sources, self.citation_numbers, self.urls)
+
+    def _scan(self, text):
+        base = self._offset
+        self._chunks.append(text)
+        self._offset += len(text)
+        found = None
+        pos = 0
+        while True:
+            m = TOKEN.search(text, pos)
+            if m is None:
+                return found
+            pos = m.end()
+            ch = m.group('struct')
+
+            if ch is None:
+                if m.group('ref') is None:
+                    self.urls.append(m.group('url').rstrip(URL_TRAILING))
+                elif m.group('source'):
+                    source = m.group('source').rstrip(URL_TRAILING)
+                    self.sources[int(m.group('ref'))] = source
+                    if source.startswith('http'):
+                        self.urls.append(source)
+                else:
+                    self.citation_numbers.append(int(m.group('ref')))
+            elif self._depth == 0:
+                if ch == '{' and self.priors is None:
+                    self._depth = 1
+                    self._start = base + m.start()
+                    self._value_end = None
+            elif self._quote:
+                if ch == '\\':
+                    pos += 1  # skip the escaped character
+                elif ch == self._quote:
+                    self._quote = None
+                    self._value_end = base + pos
+            elif ch in '"\'':
+                self._quote = ch
+            elif ch == '{':
+                self._depth += 1
+            elif ch == '}':
+                self._depth -= 1
+                self._value_end = base + pos
+                if self._depth == 0:
+                    found = self._close_block(base + pos) or found
+
+    def _close_block(self, end):
+        block = ''.join(self._chunks)[self._start:end]
+        self._start = None
+        try:
+            self.priors = parse_block(block)
+        except ValueError as e:
+            # Not the priors (e.g. a '{company}' placeholder in prose); keep looking
+            self.error = e
+            return None
+        return self.priors
+
+    def _repair(self):
+        """
+        Priors block that never closed (e.g. a truncated answer): cut it after the last
+        string or object that ended inside it and add the missing braces.
+        """
+        text = ''.join(self._chunks)[self._start:self._value_end]
+        for missing in range(1, self._depth + 1):
+            try:
+                self.priors = parse_block(text + '}' * missing)
+                return
+            except ValueError as e:
+                self.error = e
+
+
+def parse_llm_output(text):
+    """ParsedOutput of a complete LLM answer"""
+    parser = LLMOutputParser()
+    parser.feed(text)
+    return parser.close()
@@ -0,0 +1,233 @@
+"""
+Multi-month planning: a spend schedule over a horizon of months, with adstock.
+
+A share of each month's spend keeps working in the following months. With geometric
+adstock (decay d per channel) the effective spend of month t is
+
+    A[t] = x[t] + d * A[t - 1]        (A[-1] = carryover from before the plan)
+
+and month t's conversions follow the saturating curve of A[t]. The plan solves
+
+    maximize   sum over months and channels of max_conv * A / (A + K)
+    subject to sum(x[t]) == budget[t]       (every month; or only the horizon total
+                                             when flexible)
+               x[t] >= minimum[t]
+
+The objective is concave in the schedule x (A is linear in x), so a projected ascent
+finds the optimum. Each step is a diagonal Newton step: the gradient and curvature of
+x[t] collect month t's and every later month's marginal returns, discounted by d per
+month, in one backward pass over the months that is vectorized across channels. The
+step is projected back onto the budgets in the same metric, exactly and for every
+month at once (see project_spend), and halved while it does not improve the objective.
+Monte Carlo bands per month come from the saturation noise model of
+calculate_budget_allocation, simulated for the whole months x channels schedule at once.
+"""
+import numpy as np
+
+from source.models.channels import get_registry
+from .instrumentation import stage_timer
+from .optimization import (
+    Summary, channel_model, conversions_from_spend, saturation_conversions, saturation_source, scale_minimums,
+    water_filling_allocation, with_total,
+)
+
+
+DEFAULT_HORIZON = 12
+MAX_HORIZON = 120
+PLAN_SIMULATIONS = 2000
+# n_simulations x months x channels held at once by the Monte Carlo
+MAX_PLAN_ELEMENTS = 20_000_000
+
+# The ascent stops once no spend moves by more than this (relative to the largest
+# budget) or no step of at least MIN_STEP improves the objective (optimal to rounding),
+# and after MAX_PLAN_ITERATIONS steps at the latest
+PLAN_TOLERANCE = 1e-8
+MAX_PLAN_ITERATIONS = 500
+MIN_STEP = 1e-10
+
+
+def adstock(spend, decay, carryover=0.0):
+    """Effective spend of every month: spend of shape (..., n_months, n_channels) with geometric carryover"""
+    spend = np.asarray(spend, dtype=float)
+    effective = np.empty_like(spend)
+    previous = np.broadcast_to(np.asarray(carryover, dtype=float), spend[..., 0, :].shape)
+    for t in range(spend.shape[-2]):
+        previous = effective[..., t, :] = spend[..., t, :] + decay * previous
+    return effective
+
+def marginal_returns(effective, decay, max_conv, K):
+    """
+    (gradient, curvature) of the planned conversions with respect to each month's
+    spend: month t's spend adds to every later month's effective spend, discounted by
+    decay per month. curvature is the (positive) diagonal of the negated Hessian.
+    """
+    gradient = np.empty_like(effective)
+    curvature = np.empty_like(effective)
+    slope = max_conv * K / (effective + K) ** 2
+    bend = 2 * slope / (effective + K)
+    later_slope = later_bend = 0.0
+    for t in range(effective.shape[-2] - 1, -1, -1):
+        later_slope = gradient[..., t, :] = slope[..., t, :] + decay * later_slope
+        later_bend = curvature[..., t, :] = bend[..., t, :] + decay ** 2 * later_bend
+    return gradient, curvature
+
+def project_spend(target, weights, minimums, budgets):
+    """
+    Closest spend to target per row, in the metric sum(weights * (x - target) ** 2), with
+    row sums equal to budgets and x >= minimums. Arrays are (n_rows, n), budgets (n_rows,).
+
+    The solution is x = max(minimums, target - nu / weights) with one nu per row;
+    entries join the free set in order of weights * (target - minimums), and nu has a
+    closed form for each candidate free set, as in water_filling_price.
+    """
+    remaining = budgets - minimums.sum(axis=-1)
+    threshold = weights * (target - minimums)
+    order = np.argsort(-threshold, axis=-1)
+    take = lambda arr: np.take_along_axis(arr, order, axis=-1)
+    thr_sorted = take(threshold)
+    nu = (np.cumsum(take(target - minimums), axis=-1) - remaining[:, None]) / np.cumsum(take(1 / weights), axis=-1)
+    # The free set is the longest prefix whose entries are still above their nu
+    k = thr_sorted.shape[-1] - 1 - np.argmax((nu < thr_sorted)[:, ::-1], axis=-1)
+    nu = nu[np.arange(len(nu)), k]
+    spend = np.maximum(minimums, target - nu[:, None] / weights)
+    return np.where((remaining > 0)[:, None], spend, minimums)
+
+def plan_conversions(effective, max_conv, K):
+    return conversions_from_spend(effective, max_conv, K).sum()
+
+def solve_plan(max_conv, K, decay, min_budgets, budgets, carryover=0.0, flexible=False,
+               tolerance=PLAN_TOLERANCE, max_iterations=MAX_PLAN_ITERATIONS):
+    """
+    Optimal spend schedule of shape (n_months, n_channels) for per-month budgets and
+    minimums. With flexible set only the horizon total is fixed, so budget can move
+    between months. Starts from the month-by-month (myopic) water-filling split.
+
+    Returns (spend, effective, report): the schedule, its adstocked effective spend and
+    {'iterations', 'converged'}.
+    """
+    n_months, n_channels = min_budgets.shape
+    spend = water_filling_allocation(max_conv, K, min_budgets, budgets)
+    rows, totals = ((1, n_months * n_channels), budgets.sum(keepdims=True)) if flexible else (min_budgets.shape, budgets)
+    minimums = min_budgets.reshape(rows)
+    scale = tolerance * max(float(budgets.max()), 1.0)
+
+    effective = adstock(spend, decay, carryover)
+    value = plan_conversions(effective, max_conv, K)
+    step, converged, iterations = 1.0, False, 0
+    while iterations < max_iterations and not converged:
+        iterations += 1
+        gradient, curvature = marginal_returns(effective, decay, max_conv, K)
+        candidate = project_spend(
+            (spend + step * gradient / curvature).reshape(rows), curvature.reshape(rows), minimums, totals
+        ).reshape(n_months, n_channels)
+        candidate_effective = adstock(candidate, decay, carryover)
+        candidate_value = plan_conversions(candidate_effective, max_conv, K)
+        if candidate_value < value:
+            step /= 2
+            converged = step < MIN_STEP
+            continue
+        change = np.abs(candidate - spend).max()
+        spend, effective, value = candidate, candidate_effective, candidate_value
+        step = min(1.0, 2 * step)
+        if change <= scale:
+            converged = True
+            break
+    return spend, effective, {'iterations': iterations, 'converged': converged}
+
+def simulate_plan(effective, max_conv, K, n_simulations, rng, variance_reduction='mc', common_random_numbers=False):
+    """
+    Monte Carlo conversions of a schedule under simulate_saturation's noise model.
+    Returns (monthly, horizon): P10 / mean / P90 of shape (3, n_months, n_channels + 1)
+    per month (the last column is the month's total), and (3, n_channels + 1) summed
+    over the horizon.
+    """
+    source = saturation_source(effective.shape, rng, variance_reduction, common_random_numbers)
+    conversions = with_total(saturation_conversions(effective, max_conv, K, source.draw(n_simulations)[:, 0]))
+    monthly = np.empty((3,) + conversions.shape[1:])
+    monthly[[0, 2]] = np.percentile(conversions, [10, 90], axis=0)
+    monthly[1] = conversions.mean(axis=0)
+    totals = conversions.sum(axis=1)
+    horizon = np.stack([np.percentile(totals, 10, axis=0), totals.mean(axis=0), np.percentile(totals, 90, axis=0)])
+    return monthly, horizon
+
+def plan_budget_allocation(priors, monthly_budgets, assumptions=None, adstock_decay=None, carryover=None,
+                           flexible=False, n_simulations=PLAN_SIMULATIONS, seed=None, variance_reduction='mc',
+                           common_random_numbers=False, curves=None):
+    """
+    Plan spend across the channels in priors over len(monthly_budgets) months.
+
+    assumptions holds minimum fractions of each month's budget per channel, as in
+    calculate_budget_allocation; adstock_decay ({channel: decay}) overrides the
+    registry's decays and carryover ({channel: effective spend}) is adstock still
+    working from before the plan. curves, {channel: (max_conv, K)} fitted from
+    historical spend, override the registry's curve parameters.
+
+    Returns a dict: channels, decay, budgets (n_months,), allocation and effective
+    spend (n_months, n_channels), marginal_return per month (conversions per extra
+    dollar, counting later months), the P10 / mean / P90 conversions per month
+    (n_months, n_channels + 1, with the month's total last), a Summary over the
+    horizon, the expected conversions of the plan and of planning each month on its
+    own (myopic), and the solver report.
+    """
+    budgets = np.asarray(monthly_budgets, dtype=float).ravel()
+    if not 1 <= len(budgets) <= MAX_HORIZON:
+        raise ValueError(f"The horizon must be between 1 and {MAX_HORIZON} months")
+    if np.any(budgets < 0):
+        raise ValueError("Monthly budgets must not be negative")
+    assumptions = assumptions or {}
+
+    registry = get_registry()
+    priors, channels, _, max_conv, K = channel_model(priors, curves)
+    n_months, n_channels = len(budgets), len(channels)
+    if n_simulations * n_months * n_channels > MAX_PLAN_ELEMENTS:
+        raise ValueError(f"n_simulations x months x channels is limited to {MAX_PLAN_ELEMENTS:,}")
+
+    # Overrides for channels outside the plan (or the registry) are ignored, like minimums
+    column = {ch: i for i, ch in enumerate(channels)}
+    plan_column = lambda name: column.get(registry.resolve(name)) if name in registry else None
+    decay = registry.adstock[registry.indices(channels)]
+    for name, value in (adstock_decay or {}).items():
+        i = plan_column(name)
+        if i is not None:
+            if not 0 <= value < 1:
+                raise ValueError(f"Adstock decay of '{name}' must be in [0, 1)")
+            decay[i] = value
+    initial = np.zeros(n_channels)
+    for name, value in (carryover or {}).items():
+        i = plan_column(name)
+        if i is not None:
+            if value < 0:
+                raise ValueError(f"Carryover of '{name}' must not be negative")
+            initial[i] = value
+
+    fractions = np.array([assumptions.get(ch, 0) for ch in channels], dtype=float)
+    min_budgets = scale_minimums(budgets[:, None] * fractions, budgets)
+
+    with stage_timer('allocation'):
+        spend, effective, report = solve_plan(max_conv, K, decay, min_budgets, budgets, initial, flexible)
+        gradient, _ = marginal_returns(effective, decay, max_conv, K)
+        # The free channels of a month share its marginal return; at the minimums it is lower
+        free = spend > min_budgets * (1 + 1e-9) + 1e-9
+        marginal_return = np.where(free, gradient, -np.inf).max(axis=1)
+        marginal_return = np.where(np.isfinite(marginal_return), marginal_return, gradient.max(axis=1))
+        myopic = adstock(water_filling_allocation(max_conv, K, min_budgets, budgets), decay, initial)
+
+    with stage_timer('saturation_simulation'):
+        monthly, horizon = simulate_plan(
+            effective, max_conv, K, n_simulations, np.random.default_rng(seed), variance_reduction,
+            common_random_numbers,
+        )
+
+    return {
+        'channels': channels,
+        'decay': decay,
+        'budgets': budgets,
+        'allocation': spend,
+        'effective_spend': effective,
+        'marginal_return': marginal_return,
+        'P10': monthly[0], 'mean': monthly[1], 'P90': monthly[2],
+        'horizon': Summary(*horizon, channels + ['total']),
+        'expected_conversions': float(plan_conversions(effective, max_conv, K)),
+        'myopic_conversions': float(plan_conversions(myopic, max_conv, K)),
+        'solver': report,
+    }
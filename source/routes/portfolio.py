@@ -0,0 +1,236 @@
+"""
+Portfolio mode: many accounts (e.g. an agency's clients) optimized together under one
+shared budget.
+
+Accounts x channels are stacked into (n_accounts, n_channels) arrays over the union of
+the accounts' channels, and the joint problem
+
+    maximize   sum over accounts and channels of max_conv * x / (x + K)
+    subject to sum(x) == total_budget
+               sum(x[account]) >= floor[account]
+               x >= minimum (per account and channel)
+
+is solved exactly from its KKT conditions. Every free channel of an account has the
+same marginal return, the account's price. An account whose floor is slack pays the
+portfolio price; one held at its floor pays the (lower) price at which it spends
+exactly its floor, which water_filling_price gives in closed form for all accounts at
+once. The portfolio price is then a scalar root of a monotone spend function: a
+bisection of vectorized passes over the whole array, finished with the closed form for
+the free set it identifies.
+"""
+import numpy as np
+
+from source.models.channels import get_registry
+from .instrumentation import stage_timer
+from .optimization import (
+    BATCH_ELEMENTS, SATURATION_NOISE, conversions_from_spend, saturation_source, scale_minimums, water_filling_price
+)
+
+
+# Bisection stops once the price bracket is this narrow (relative), at most MAX_PRICE_STEPS halvings
+PRICE_TOLERANCE = 1e-13
+MAX_PRICE_STEPS = 200
+
+MAX_PORTFOLIO_ACCOUNTS = 100_000
+PORTFOLIO_SIMULATIONS = 500
+
+# One dimension per account and channel is beyond a Sobol sequence
+PORTFOLIO_VARIANCE_REDUCTION = ('mc', 'antithetic')
+
+
+def portfolio_model(channels_list, assumptions_list=None, curves_list=None, registry=None):
+    """
+    (channels, present, max_conv, K, min_fractions) for a list of accounts.
+
+    channels_list holds each account's channel names (None: the enabled registry
+    channels), assumptions_list its {channel: minimum fraction of the floor} and
+    curves_list its fitted {channel: (max_conv, K)}. The arrays have shape
+    (n_accounts, n_channels) over the union of the accounts' channels, in registry
+    order; channels an account does not use have max_conv 0 and present False.
+    """
+    registry = registry or get_registry()
+    n_accounts = len(channels_list)
+    assumptions_list = assumptions_list or [None] * n_accounts
+    curves_list = curves_list or [None] * n_accounts
+
+    # Accounts mostly share a handful of channel sets: look each set up once
+    lookups = {}
+    columns = []
+    for i, channels in enumerate(channels_list):
+        key = tuple(channels if channels is not None else registry.enabled)
+        idx = lookups.get(key)
+        if idx is None:
+            idx = lookups[key] = registry.indices(key)
+            if len(idx) == 0:
+                raise ValueError(f"Account {i} has no channels")
+            if len(np.unique(idx)) != len(idx):
+                raise ValueError(f"Account {i} lists a channel more than once")
+        columns.append(idx)
+    rows = np.repeat(np.arange(n_accounts), [len(idx) for idx in columns])
+    columns = np.concatenate(columns)
+
+    used = np.unique(columns)
+    position = np.empty(len(registry), dtype=np.intp)
+    position[used] = np.arange(len(used))
+    present = np.zeros((n_accounts, len(used)), dtype=bool)
+    present[rows, position[columns]] = True
+
+    channels = [registry.names[j] for j in used]
+    column = {name: j for j, name in enumerate(channels)}
+    max_conv = np.where(present, registry.max_conv[used], 0.0)
+    K = np.broadcast_to(registry.K[used], present.shape).copy()
+    min_fractions = np.zeros(present.shape)
+    for i, (assumptions, curves) in enumerate(zip(assumptions_list, curves_list)):
+        for name, (fitted_max_conv, fitted_K) in (curves or {}).items():
+            j = column.get(name)
+            if j is not None and present[i, j]:
+                max_conv[i, j], K[i, j] = fitted_max_conv, fitted_K
+        # Like calculate_budget_allocation, minimums of channels the account does not use are ignored
+        for name, fraction in (assumptions or {}).items():
+            j = column.get(registry.resolve(name)) if name in registry else None
+            if j is not None and present[i, j]:
+                min_fractions[i, j] = fraction
+
+    return channels, present, max_conv, K, min_fractions
+
+def solve_portfolio(max_conv, K, min_budgets, floors, total_budget):
+    """
+    Exact optimum of the portfolio problem for (n_accounts, n_channels) arrays.
+
+    Returns (allocation, account_price, floor_bound): the spend per account and
+    channel, each account's marginal return (conversions per extra dollar) and
+    whether its floor is binding. Raises ValueError when the floors and minimums
+    need more than total_budget.
+    """
+    max_conv, K, min_budgets = (np.asarray(arr, dtype=float) for arr in (max_conv, K, min_budgets))
+    a = max_conv * K
+    sqrt_a = np.sqrt(a)
+    floors = np.maximum(np.asarray(floors, dtype=float), min_budgets.sum(axis=1))
+    required = floors.sum()
+    if total_budget < required * (1 - 1e-12):
+        raise ValueError(
+            f"Account floors and channel minimums need {required:.2f}, more than the total budget {total_budget:.2f}"
+        )
+
+    # Price at which each account spends exactly its floor (inf where its minimums cover it)
+    floor_price = water_filling_price(max_conv, K, min_budgets, floors)
+
+    def allocate(price):
+        account_price = np.minimum(price, floor_price)
+        return np.maximum(min_budgets, sqrt_a / np.sqrt(account_price)[:, None] - K), account_price
+
+    # At or above the highest threshold every account spends max(floor, minimums)
+    high = (a / (min_budgets + K) ** 2).max()
+    if total_budget <= required:
+        allocation, account_price = allocate(high)
+        return allocation, account_price, floor_price <= high
+
+    # With every channel free, spend at this price is exactly total_budget, so the
+    # minimums and floors can only raise it
+    low = (sqrt_a.sum() / (total_budget + K[a > 0].sum())) ** 2
+    log_low, log_high = np.log(low), np.log(high)
+    for _ in range(MAX_PRICE_STEPS):
+        if log_high - log_low < PRICE_TOLERANCE:
+            break
+        mid = 0.5 * (log_low + log_high)
+        if allocate(np.exp(mid))[0].sum() > total_budget:
+            log_low = mid
+        else:
+            log_high = mid
+
+    # Closed form for the free set at the bracketed price: bound accounts spend their
+    # floor, other channels either sit at their minimum or share the portfolio price
+    price = np.exp(log_high)
+    bound = floor_price < price
+    free = ~bound[:, None] & (sqrt_a / np.sqrt(price) - K > min_budgets)
+    if free.any():
+        fixed = floors[bound].sum() + min_budgets[~bound[:, None] & ~free].sum()
+        price = (sqrt_a[free].sum() / (total_budget - fixed + K[free].sum())) ** 2
+    allocation, account_price = allocate(price)
+    return allocation, account_price, floor_price < price
+
+def simulate_portfolio(allocation, max_conv, K, n_simulations, rng, variance_reduction='mc'):
+    """
+    Monte Carlo conversions of every account at once, under the same noise model as
+    simulate_saturation.
+
+    Accounts are simulated in blocks bounded by BATCH_ELEMENTS, and each scenario's
+    portfolio total is accumulated across blocks. Returns (channel_mean, stats,
+    portfolio): the mean conversions per account and channel, the P10 / mean / P90 of
+    each account's total with shape (3, n_accounts), and the P10 / mean / P90 of the
+    portfolio total.
+    """
+    n_accounts, n_channels = allocation.shape
+    expected = conversions_from_spend(allocation, max_conv, K)
+    channel_mean = np.empty((n_accounts, n_channels))
+    stats = np.empty((3, n_accounts))
+    portfolio_total = np.zeros(n_simulations)
+    block = max(1, BATCH_ELEMENTS // (n_simulations * n_channels))
+    for start in range(0, n_accounts, block):
+        rows = slice(start, start + block)
+        source = saturation_source(allocation[rows].shape, rng, variance_reduction)
+        # saturation_conversions, in place on the draws: they are the largest array held
+        conversions = source.draw(n_simulations)[:, 0]
+        conversions *= SATURATION_NOISE
+        conversions += 1
+        np.maximum(conversions, 0, out=conversions)
+        conversions *= expected[rows]
+        channel_mean[rows] = conversions.mean(axis=0)
+        # A matmul beats a strided sum over the short channel axis
+        totals = conversions @ np.ones(n_channels)
+        stats[0, rows], stats[2, rows] = np.percentile(totals, [10, 90], axis=0)
+        stats[1, rows] = totals.mean(axis=0)
+        portfolio_total += totals.sum(axis=1)
+
+    p10, p90 = np.percentile(portfolio_total, [10, 90])
+    return channel_mean, stats, {'P10': float(p10), 'mean': float(portfolio_total.mean()), 'P90': float(p90)}
+
+def portfolio_allocation(channels_list, total_budget, floors=None, assumptions_list=None, curves_list=None,
+                         n_simulations=PORTFOLIO_SIMULATIONS, seed=None, variance_reduction='mc'):
+    """
+    Allocate one total_budget across many accounts and their channels.
+
+    channels_list, assumptions_list and curves_list are as in portfolio_model; floors
+    holds each account's minimum total spend (default 0), and an account's
+    '<channel>_min' fractions are fractions of its floor. Returns a dict of arrays:
+    channels, present and allocation (n_accounts, n_channels), account_spend,
+    marginal_return and floor_bound (n_accounts,), conversions, the mean per account
+    and channel, P10 / mean / P90 of each account's total conversions and portfolio,
+    the budget, spend, price and P10 / mean / P90 of the portfolio total.
+    """
+    n_accounts = len(channels_list)
+    if not 0 < n_accounts <= MAX_PORTFOLIO_ACCOUNTS:
+        raise ValueError(f"Expected between 1 and {MAX_PORTFOLIO_ACCOUNTS} accounts")
+    if variance_reduction not in PORTFOLIO_VARIANCE_REDUCTION:
+        raise ValueError(f"Portfolio variance reduction must be one of {PORTFOLIO_VARIANCE_REDUCTION}")
+    total_budget = float(total_budget)
+    floors = np.zeros(n_accounts) if floors is None else np.asarray(floors, dtype=float)
+    if floors.shape != (n_accounts,) or np.any(floors < 0):
+        raise ValueError("Expected one non-negative floor per account")
+
+    with stage_timer('portfolio_model'):
+        channels, present, max_conv, K, min_fractions = portfolio_model(channels_list, assumptions_list, curves_list)
+        min_budgets = scale_minimums(min_fractions * floors[:, None], floors)
+
+    with stage_timer('allocation'):
+        allocation, account_price, floor_bound = solve_portfolio(max_conv, K, min_budgets, floors, total_budget)
+
+    with stage_timer('saturation_simulation'):
+        channel_mean, stats, portfolio = simulate_portfolio(
+            allocation, max_conv, K, n_simulations, np.random.default_rng(seed), variance_reduction
+        )
+
+    portfolio.update(budget=total_budget, spend=float(allocation.sum()), price=float(account_price.max()))
+    return {
+        'channels': channels,
+        'present': present,
+        'allocation': allocation,
+        'account_spend': allocation.sum(axis=1),
+        'marginal_return': account_price,
+        'floor_bound': floor_bound,
+        'conversions': channel_mean,
+        'P10': stats[0],
+        'mean': stats[1],
+        'P90': stats[2],
+        'portfolio': portfolio,
+    }
@@ -0,0 +1,371 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+
+from .instrumentation import LLM_ATTEMPTS, LLM_RETRIES
+
+
+logger = logging.getLogger(__name__)
+
+LLMResponse = namedtuple('LLMResponse', ['text', 'citations'])
+
+DEFAULT_MODEL = 'gemini-2.0-flash'
+DEFAULT_REPLAY_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'llm_replay.jsonl')
+
+
+class LLMError(Exception):
+    """Raised by LLMProvider once every attempt at a call has failed"""
+
+
+class CircuitOpen(LLMError):
+    """Raised without calling the backend while the circuit breaker is open"""
+
+
+def prompt_key(prompt_text):
+    return hashlib.sha256(prompt_text.encode('utf-8')).hexdigest()
+
+def add_citations(response):
+    citation_links = []
+    if response.candidates and response.candidates[0].grounding_metadata and response.candidates[0].grounding_metadata.grounding_supports:
+        supports = response.candidates[0].grounding_metadata.grounding_supports
+        chunks = response.candidates[0].grounding_metadata.grounding_chunks
+
+        # Sort supports by end_index in descending order to avoid shifting issues when inserting.
+        sorted_supports = sorted(supports, key=lambda s: s.segment.end_index, reverse=True)
+
+        for support in sorted_supports:
+            if support.grounding_chunk_indices:
+                for i in support.grounding_chunk_indices:
+                    if i < len(chunks):
+                        uri = chunks[i].web.uri
+                        citation_links.append(uri)
+    return citation_links
+
+
+class Backend:
+    """
+    Where LLMProvider sends prompts.
+
+    generate(prompt_text, timeout) -> LLMResponse
+    stream(prompt_text, timeout) -> iterator of (text, citation_links) chunks
+
+    timeout is in seconds. Implementations are shared by every request thread.
+    """
+
+    def generate(self, prompt_text, timeout):
+        raise NotImplementedError
+
+    def stream(self, prompt_text, timeout):
+        response = self.generate(prompt_text, timeout)
+        yield response.text, response.citations
+
+
+class GeminiBackend(Backend):
+    """
+    Grounded Gemini calls through one long-lived client, so its HTTP connection pool
+    (and TLS sessions) are reused across requests.
+    """
+
+    def __init__(self, api_key=None, model=DEFAULT_MODEL):
+        from google import genai
+        from google.genai import types
+
+        self._types = types
+        self.model = model
+        self.client = genai.Client(api_key=api_key or os.getenv('GEMINI_KEY'))
+        self.tools = [types.Tool(google_search=types.GoogleSearch())]
+
+    def _config(self, timeout):
+        return self._types.GenerateContentConfig(
+            tools=self.tools,
+            http_options=self._types.HttpOptions(timeout=int(timeout * 1000)),
+        )
+
+    def generate(self, prompt_text, timeout):
+        response = self.client.models.generate_content(
+            model=self.model, contents=prompt_text, config=self._config(timeout)
+        )
+        return LLMResponse(response.text or '', add_citations(response))
+
+    def stream(self, prompt_text, timeout):
+        for chunk in self.client.models.generate_content_stream(
+            model=self.model, contents=prompt_text, config=self._config(timeout)
+        ):
+            yield chunk.text or '', add_citations(chunk)
+
+
+class ReplayBackend(Backend):
+    """
+    Serves responses recorded by RecordingBackend, without network access.
+
+    The recording is a JSONL file of {"key", "text", "citations"} lines, keyed by the
+    SHA-256 of the prompt. With strict=False a prompt that was never recorded gets one
+    of the recorded responses, picked deterministically from its key, so load tests
+    can use arbitrary company names. latency (seconds) is slept before each response.
+    """
+
+    def __init__(self, path, strict=False, latency=0.0, chunk_chars=64):
+        self.path = path
+        self.strict = strict
+        self.latency = latency
+        self.chunk_chars = chunk_chars
+        self.responses = {}
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.responses[entry['key']] = LLMResponse(entry['text'], entry.get('citations', []))
+        self._keys = sorted(self.responses)
+
+    def generate(self, prompt_text, timeout):
+        key = prompt_key(prompt_text)
+        response = self.responses.get(key)
+        if response is None:
+            if self.strict or not self._keys:
+                raise KeyError(f"No recorded response for prompt {key[:12]}")
+            response = self.responses[self._keys[int(key, 16) % len(self._keys)]]
+        if self.latency:
+            time.sleep(min(self.latency, timeout))
+        return response
+
+    def stream(self, prompt_text, timeout):
+        response = self.generate(prompt_text, timeout)
+        text = response.text
+        for start in range(0, max(len(text), 1), self.chunk_chars):
+            yield text[start:start + self.chunk_chars], response.citations if start == 0 else []
+
+
+class RecordingBackend(Backend):
+    """Passes calls through to backend and appends every response to a replay file"""
+
+    def __init__(self, backend, path):
+        self.backend = backend
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _record(self, prompt_text, response):
+        line = json.dumps({'key': prompt_key(prompt_text), 'text': response.text, 'citations': response.citations})
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line + '\n')
+
+    def generate(self, prompt_text, timeout):
+        response = self.backend.generate(prompt_text, timeout)
+        self._record(prompt_text, response)
+        return response
+
+    def stream(self, prompt_text, timeout):
+        texts, citations = [], []
+        for text, links in self.backend.stream(prompt_text, timeout):
+            texts.append(text)
+            citations.extend(links)
+            yield text, links
+        self._record(prompt_text, LLMResponse(''.join(texts), citations))
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing backend.
+
+    After failure_threshold consecutive failures the circuit opens and calls fail fast
+    with CircuitOpen for reset_timeout seconds. Then one trial call is let through
+    (half-open): success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == 'closed':
+                return
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                return
+            raise CircuitOpen(f"LLM circuit {self.state.replace('_', '-')} after {self._failures} consecutive failures")
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+
+class LLMProvider:
+    """
+    Retrying front end to a Backend.
+
+    Each attempt gets at most timeout seconds and the whole call, backoff included,
+    at most deadline seconds. Failed attempts are retried up to max_retries times in
+    total with full-jitter exponential backoff (uniform in [0, backoff_base * 2**attempt],
+    capped at backoff_max). Backend failures feed the circuit breaker.
+    """
+
+    def __init__(self, backend, timeout=60, deadline=120, max_retries=3, backoff_base=0.5, backoff_max=8,
+                 breaker=None):
+        self.backend = backend
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _before_call(self):
+        try:
+            self.breaker.before_call()
+        except CircuitOpen:
+            LLM_ATTEMPTS.inc(outcome='circuit_open')
+            raise
+
+    def _record_failure(self):
+        LLM_ATTEMPTS.inc(outcome='error')
+        self.breaker.record_failure()
+
+    def _retry(self, attempt, error, deadline):
+        """Sleep before the next attempt; False when out of attempts or time"""
+        logger.warning("LLM attempt %d failed: %s", attempt + 1, error)
+        delay = self.backoff(attempt)
+        if attempt == self.max_retries - 1 or time.monotonic() + delay >= deadline:
+            return False
+        LLM_RETRIES.inc()
+        time.sleep(delay)
+        return True
+
+    def generate(self, prompt_text, parse=None):
+        """
+        Backend response for prompt_text, or parse(response) when given. parse errors
+        are retried like backend errors but do not count against the circuit breaker.
+        """
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(self.max_retries):
+            self._before_call()
+            remaining = deadline - time.monotonic()
+            try:
+                response = self.backend.generate(prompt_text, min(self.timeout, remaining))
+            except Exception as e:
+                self._record_failure()
+                error = e
+            else:
+                self.breaker.record_success()
+                try:
+                    result = parse(response) if parse else response
+                except Exception as e:
+                    LLM_ATTEMPTS.inc(outcome='parse_error')
+                    error = e
+                else:
+                    LLM_ATTEMPTS.inc(outcome='success')
+                    return result
+
+            if not self._retry(attempt, error, deadline):
+                break
+        raise LLMError(f"LLM call failed after {attempt+1} attempts: {error}") from error
+
+    def stream(self, prompt_text):
+        """
+        Backend stream for prompt_text. Only failures before the first chunk are
+        retried; a stream that breaks mid-way raises LLMError.
+        """
+        deadline = time.monotonic() + self.deadline
+        for attempt in range(self.max_retries):
+            self._before_call()
+            started = False
+            try:
+                for chunk in self.backend.stream(prompt_text, min(self.timeout, deadline - time.monotonic())):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                self._record_failure()
+                if started:
+                    raise LLMError(f"LLM stream failed: {e}") from e
+                error = e
+            else:
+                self.breaker.record_success()
+                LLM_ATTEMPTS.inc(outcome='success')
+                return
+
+            if not self._retry(attempt, error, deadline):
+                break
+        raise LLMError(f"LLM call failed after {attempt+1} attempts: {error}") from error
+
+
+# One provider (and so one pooled client) per process, created on first use
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # The client's connection pool must not be shared with the parent
+    global _provider, _provider_lock
+    _provider, _provider_lock = None, threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def backend_from_env():
+    """
+    Backend selected by LLM_BACKEND:
+      'gemini'  (default) live calls
+      'record'  live calls, appended to LLM_REPLAY_PATH
+      'replay'  recorded responses from LLM_REPLAY_PATH; LLM_REPLAY_STRICT=1 rejects
+                unrecorded prompts, LLM_REPLAY_LATENCY adds a delay in seconds
+    """
+    kind = os.getenv('LLM_BACKEND', 'gemini')
+    path = os.getenv('LLM_REPLAY_PATH', DEFAULT_REPLAY_PATH)
+    if kind == 'gemini':
+        return GeminiBackend(model=os.getenv('LLM_MODEL', DEFAULT_MODEL))
+    if kind == 'record':
+        return RecordingBackend(GeminiBackend(model=os.getenv('LLM_MODEL', DEFAULT_MODEL)), path)
+    if kind == 'replay':
+        return ReplayBackend(
+            path,
+            strict=os.getenv('LLM_REPLAY_STRICT', '0') == '1',
+            latency=float(os.getenv('LLM_REPLAY_LATENCY', 0)),
+        )
+    raise ValueError(f"Unknown LLM_BACKEND '{kind}', expected gemini, record or replay")
+
+def get_provider():
+    """
+    The process-wide LLMProvider, configured from LLM_BACKEND (see backend_from_env),
+    LLM_TIMEOUT, LLM_DEADLINE, LLM_MAX_RETRIES, LLM_BREAKER_THRESHOLD and
+    LLM_BREAKER_RESET
+    """
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = LLMProvider(
+                backend_from_env(),
+                timeout=float(os.getenv('LLM_TIMEOUT', 60)),
+                deadline=float(os.getenv('LLM_DEADLINE', 120)),
+                max_retries=int(os.getenv('LLM_MAX_RETRIES', 3)),
+                breaker=CircuitBreaker(
+                    failure_threshold=int(os.getenv('LLM_BREAKER_THRESHOLD', 5)),
+                    reset_timeout=float(os.getenv('LLM_BREAKER_RESET', 30)),
+                ),
+            )
+        return _provider
+
+def set_provider(provider):
+    """Replace the process-wide provider, e.g. with a ReplayBackend in tests; returns the old one"""
+    global _provider
+    with _provider_lock:
+        old, _provider = _provider, provider
+    return old
@@ -0,0 +1,114 @@
+import numpy as np
+
+
+class QuantileSketch:
+    """
+    Mergeable streaming quantile sketch (KLL-style compactors) for several columns at once.
+
+    Every column sees the same number of samples, so all columns share one stack of levels:
+    level h holds an array of shape (m, n_columns) whose rows each stand for 2**h samples.
+    Memory is O(k * log(n / k)) regardless of how many samples are streamed in.
+    """
+
+    def __init__(self, n_columns, k=4096, rng=None):
+        self.n_columns = n_columns
+        self.k = k
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.levels = []
+        self.count = 0
+        self.total = np.zeros(n_columns)
+        self.total_sq = np.zeros(n_columns)
+        # Deterministic upper bound on the rank error (in samples) introduced by compaction
+        self.rank_error = 0
+
+    def update(self, samples):
+        """Add a block of samples of shape (m, n_columns)."""
+        samples = np.asarray(samples, dtype=float)
+        self.count += len(samples)
+        self.total += samples.sum(axis=0)
+        self.total_sq += np.square(samples).sum(axis=0)
+        self._push(0, samples)
+
+    def merge(self, other):
+        """Fold another sketch over the same columns into this one."""
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.rank_error += other.rank_error
+        for h, level in enumerate(other.levels):
+            if len(level):
+                self._push(h, level)
+        return self
+
+    def to_arrays(self):
+        """Flatten the sketch into plain arrays (e.g. to ship it through shared memory)."""
+        return {
+            'rows': np.concatenate(self.levels) if self.levels else np.empty((0, self.n_columns)),
+            'level_sizes': np.array([len(level) for level in self.levels], dtype=np.int64),
+            'moments': np.stack([self.total, self.total_sq]),
+            'counts': np.array([self.count, self.rank_error, self.k], dtype=np.int64),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, rng=None):
+        """Inverse of to_arrays."""
+        count, rank_error, k = (int(v) for v in arrays['counts'])
+        sketch = cls(arrays['moments'].shape[1], k=k, rng=rng)
+        sketch.count = count
+        sketch.rank_error = rank_error
+        sketch.total, sketch.total_sq = arrays['moments'].copy()
+        bounds = np.cumsum(arrays['level_sizes'])[:-1]
+        sketch.levels = [level.copy() for level in np.split(arrays['rows'], bounds)]
+        return sketch
+
+    def _push(self, h, samples):
+        while len(self.levels) <= h:
+            self.levels.append(np.empty((0, self.n_columns)))
+
+        buf = np.concatenate([self.levels[h], samples]) if len(self.levels[h]) else samples
+        if len(buf) < self.k:
+            self.levels[h] = buf
+            return
+
+        # Compact j levels at once: keep one random row from every block of 2**j sorted rows
+        j = 1
+        while len(buf) >> j >= self.k:
+            j += 1
+        block = 1 << j
+        n_blocks = len(buf) // block
+        buf = np.sort(buf, axis=0)
+        offset = self.rng.integers(block)
+
+        self.levels[h] = buf[n_blocks * block:]
+        self.rank_error += block << h
+        self._push(h + j, buf[offset:n_blocks * block:block])
+
+    def mean(self):
+        return self.total / self.count
+
+    def std_error(self):
+        """Standard error of the streamed mean per column."""
+        var = np.maximum(self.total_sq / self.count - np.square(self.mean()), 0)
+        return np.sqrt(var / max(self.count - 1, 1))
+
+    def relative_rank_error(self):
+        """Upper bound on |estimated rank - true rank| / n for any quantile query."""
+        return self.rank_error / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        """Estimated q-quantiles (q in [0, 1], scalar or sequence) for every column."""
+        values = np.concatenate([level for level in self.levels if len(level)])
+        weights = np.concatenate([
+            np.full(len(level), 1 << h) for h, level in enumerate(self.levels) if len(level)
+        ])
+
+        order = np.argsort(values, axis=0)
+        sorted_values = np.take_along_axis(values, order, axis=0)
+        cum_weights = np.cumsum(weights[order], axis=0)
+
+        q = np.atleast_1d(q)
+        result = np.empty((len(q), self.n_columns))
+        for col in range(self.n_columns):
+            idx = np.searchsorted(cum_weights[:, col], q * self.count, side='left')
+            result[:, col] = sorted_values[np.minimum(idx, len(sorted_values) - 1), col]
+        return result
@@ -0,0 +1,108 @@
+import numpy as np
+
+
+VARIANCE_REDUCTION = ('mc', 'antithetic', 'sobol')
+
+# Adaptive mode: error is estimated from independent batches (batch means)
+N_BATCHES = 10
+T_CRITICAL = 2.262  # two-sided 95% Student t, N_BATCHES - 1 degrees of freedom
+INITIAL_BATCH_DRAWS = 128  # per batch in the first round; a power of two for Sobol
+MAX_ADAPTIVE_SIMULATIONS = 2 ** 20
+
+
+class NormalSource:
+    """
+    Standard-normal draws of shape (n, n_groups, *n_channels) for one simulation stage.
+
+    method:
+      'mc'          plain pseudo-random draws
+      'antithetic'  every draw z is paired with -z
+      'sobol'       scrambled Sobol points mapped through the normal inverse CDF
+                    (needs scipy); the sequence continues across calls
+    common: common random numbers across channels, i.e. one draw per group that every
+      channel shares.
+    """
+
+    def __init__(self, n_groups, n_channels, rng, method='mc', common=False):
+        if method not in VARIANCE_REDUCTION:
+            raise ValueError(f"Unknown variance reduction '{method}', expected one of {VARIANCE_REDUCTION}")
+        # n_channels may also be a shape, e.g. (n_items, n_channels) for batched runs
+        self.channel_shape = tuple(np.atleast_1d(n_channels))
+        self.shape = (n_groups, 1 if common else int(np.prod(self.channel_shape)))
+        self.rng = rng
+        self.method = method
+        self._sobol = None
+        if method == 'sobol':
+            try:
+                from scipy.stats import qmc
+            except ImportError:
+                raise ValueError("Sobol sampling requires scipy")
+            self._sobol = qmc.Sobol(d=self.shape[0] * self.shape[1], scramble=True, seed=rng)
+
+    def draw(self, n):
+        if self.method == 'sobol':
+            from scipy.special import ndtri
+            # Keep points strictly inside (0, 1) so ndtri stays finite
+            u = np.clip(self._sobol.random(n), 1e-12, 1 - 1e-12)
+            z = ndtri(u).reshape(n, *self.shape)
+        elif self.method == 'antithetic':
+            half = self.rng.standard_normal(((n + 1) // 2, *self.shape))
+            z = np.concatenate([half, -half])[:n]
+        else:
+            z = self.rng.standard_normal((n, *self.shape))
+        if self.shape[1] == 1:
+            z = np.broadcast_to(z, (n, self.shape[0], int(np.prod(self.channel_shape))))
+        return z.reshape(n, self.shape[0], *self.channel_shape)
+
+
+def adaptive_sample(simulate, make_source, rng, tolerance, quantiles=(), max_simulations=MAX_ADAPTIVE_SIMULATIONS):
+    """
+    Draw in doubling rounds until the 95% CI half-width of every column's mean (and of
+    each requested quantile, in percent) is within tolerance, relative to the estimate.
+
+    simulate(source, n) -> samples of shape (n, n_columns)
+    make_source(rng) -> a NormalSource; one independent source per batch
+
+    The CI comes from N_BATCHES independent batches, which keeps it valid for antithetic
+    and Sobol draws where per-sample variance is not. Returns (samples, report).
+    """
+    sources = [make_source(child) for child in rng.spawn(N_BATCHES)]
+    batches = [[] for _ in range(N_BATCHES)]
+    per_batch = INITIAL_BATCH_DRAWS
+    drawn = 0
+    quantiles = list(quantiles)
+
+    while True:
+        for batch, source in zip(batches, sources):
+            batch.append(simulate(source, per_batch))
+        drawn += per_batch
+        samples_by_batch = [np.concatenate(batch) for batch in batches]
+
+        estimates = np.stack([_estimates(s, quantiles) for s in samples_by_batch])
+        half_width = T_CRITICAL * estimates.std(axis=0, ddof=1) / np.sqrt(N_BATCHES)
+        pooled = _estimates(np.concatenate(samples_by_batch), quantiles)
+        relative = half_width / np.maximum(np.abs(pooled), 1e-12)
+        relative[half_width == 0] = 0
+
+        converged = bool(np.all(relative <= tolerance))
+        if converged or drawn * N_BATCHES * 2 > max_simulations:
+            break
+        # Doubling keeps Sobol rounds at powers of two
+        per_batch = drawn
+
+    report = {
+        'n_simulations': drawn * N_BATCHES,
+        'converged': converged,
+        'tolerance': tolerance,
+        'max_relative_half_width': float(relative.max()),
+        'half_width': half_width,
+    }
+    return np.concatenate(samples_by_batch), report
+
+
+def _estimates(samples, quantiles):
+    """Rows: mean, then each quantile (percent). Columns: sample columns."""
+    rows = [samples.mean(axis=0)]
+    if quantiles:
+        rows.extend(np.percentile(samples, quantiles, axis=0))
+    return np.stack(rows)
@@ -0,0 +1,213 @@
+"""
+Sensitivity of an allocation to its CPM/CTR/CVR priors.
+
+Every lower / mean / upper bound of every channel's priors is a parameter. One at a
+time (tornado) analysis moves each parameter by -step and +step (relative) and
+reruns the allocation; the global analysis draws all parameters uniformly within
+that range and estimates first-order and total Sobol indices (Saltelli / Jansen
+estimators) of the allocation and of the expected total conversions.
+
+Priors only reach the allocation through the funnel estimate of each channel's
+conversions (the softmax strategy; water filling does not depend on them), and a
+channel's funnel estimate only depends on that channel's nine bounds. So every
+perturbed scenario is evaluated per channel, on the same random draws as the base
+run, as one batched array of bounds; the allocation and conversion steps for all
+scenarios are then single broadcasts. With the same seed the base scenario is
+exactly calculate_budget_allocation's.
+"""
+import numpy as np
+
+from source.models.channels import BOUNDS, PRIOR_METRICS as METRICS
+from .instrumentation import stage_timer
+from .optimization import (
+    ALLOCATION_STRATEGIES, BATCH_ELEMENTS, SATURATION_NOISE, channel_model, conversions_from_spend,
+    funnel_conversions, funnel_source, saturation_source, scale_minimums, softmax_allocation,
+    water_filling_allocation,
+)
+
+
+DEFAULT_STEP = 0.2
+DEFAULT_SOBOL_SAMPLES = 64
+MAX_SOBOL_SAMPLES = 4096
+
+
+def funnel_means(bounds, z, budget):
+    """
+    Mean funnel conversions of one channel at budget for a stack of prior bounds of
+    shape (n_scenarios, len(METRICS), len(BOUNDS)), all on the standard normals z of
+    shape (n_simulations, len(METRICS)).
+    """
+    means = np.empty(len(bounds))
+    block = max(1, BATCH_ELEMENTS // (len(z) * len(METRICS)))
+    for start in range(0, len(bounds), block):
+        chunk = bounds[start:start + block]
+        arrays = {metric: tuple(chunk[:, j, k] for k in range(len(BOUNDS))) for j, metric in enumerate(METRICS)}
+        means[start:start + block] = funnel_conversions(arrays, budget, z[:, :, None]).mean(axis=0)
+    return means
+
+def parameter_scenarios(base, factors):
+    """
+    Bounds of one channel for each scenario: base (len(METRICS), len(BOUNDS)) scaled by
+    factors of shape (..., len(METRICS), len(BOUNDS)).
+    """
+    return (base * factors).reshape(-1, len(METRICS), len(BOUNDS))
+
+def sobol_indices(f_A, f_B, f_AB):
+    """
+    First-order (Saltelli 2010) and total (Jansen) Sobol indices from model outputs on
+    the A and B sample matrices, (N, ...), and on A with parameter i taken from B,
+    (n_parameters, N, ...). Outputs that do not vary get 0.
+    """
+    # Centered outputs: the estimators' own variance grows with the squared mean
+    center = np.concatenate([f_A, f_B]).mean(axis=0)
+    f_A, f_B, f_AB = f_A - center, f_B - center, f_AB - center
+    variance = np.concatenate([f_A, f_B]).var(axis=0)
+    safe = np.where(variance > 0, variance, 1)
+    first = np.where(variance > 0, (f_B * (f_AB - f_A)).mean(axis=1) / safe, 0)
+    total = np.where(variance > 0, 0.5 * ((f_A - f_AB) ** 2).mean(axis=1) / safe, 0)
+    return first, total
+
+def funnel_scenarios(n_channels, sobol_samples=DEFAULT_SOBOL_SAMPLES):
+    """
+    Prior scenarios sensitivity_analysis evaluates on the n_simulations funnel draws:
+    per channel the base run, two per parameter and sobol_samples * (parameters + 2)
+    """
+    per_channel = len(METRICS) * len(BOUNDS)
+    return n_channels * (1 + 2 * per_channel + sobol_samples * (per_channel + 2))
+
+def sensitivity_analysis(priors, total_budget, assumptions=None, n_simulations=5000, seed=None, strategy='softmax',
+                         variance_reduction='mc', common_random_numbers=False, step=DEFAULT_STEP,
+                         sobol_samples=DEFAULT_SOBOL_SAMPLES, curves=None):
+    """
+    One-at-a-time and Sobol sensitivities of the allocation and expected total
+    conversions to every prior bound.
+
+    Returns a dict: channels; parameters, the (channel, metric, bound) of each row
+    below; base (allocation (C,), total_conversions); one_at_a_time with low / high
+    runs at -step / +step, each allocation (P, C) and total_conversions (P,); and
+    sobol with first_order / total_order indices in the same layout, from
+    sobol_samples * (P + 2) scenarios drawn within +-step. Set sobol_samples to 0 to
+    skip the global analysis.
+    """
+    if strategy not in ALLOCATION_STRATEGIES:
+        raise ValueError(f"Unknown strategy '{strategy}', expected one of {ALLOCATION_STRATEGIES}")
+    if not 0 < step < 1:
+        raise ValueError("step must be between 0 and 1")
+    if not 0 <= sobol_samples <= MAX_SOBOL_SAMPLES:
+        raise ValueError(f"sobol_samples must be between 0 and {MAX_SOBOL_SAMPLES}")
+
+    rng = np.random.default_rng(seed)
+    assumptions = assumptions or {}
+    priors, channels, arrays, max_conv, K = channel_model(priors, curves)
+    n_channels = len(channels)
+    # (channel, metric, bound), e.g. base[c, METRICS.index('CPM'), BOUNDS.index('mean')]
+    base = np.stack([np.stack(arrays[metric]) for metric in METRICS], axis=0).transpose(2, 0, 1)
+    per_channel = len(METRICS) * len(BOUNDS)
+    parameters = [(ch, metric, bound) for ch in channels for metric in METRICS for bound in BOUNDS]
+
+    # Draws in calculate_budget_allocation's order, shared by every scenario
+    z_funnel = funnel_source(n_channels, rng, variance_reduction, common_random_numbers).draw(n_simulations)
+    z_saturation = saturation_source(n_channels, rng, variance_reduction, common_random_numbers).draw(n_simulations)
+    # Expected saturation conversions are conversions_from_spend times this, per channel
+    noise_factor = np.maximum(1 + SATURATION_NOISE * z_saturation[:, 0], 0).mean(axis=0)
+
+    min_budgets = np.array([assumptions.get(ch, 0) * total_budget for ch in channels], dtype=float)
+    min_budgets = scale_minimums(min_budgets, total_budget)
+    initial_alloc = total_budget / n_channels
+
+    def outcomes(mean_convs):
+        """(allocation, total_conversions) for funnel estimates of shape (..., n_channels)"""
+        if strategy == 'water_filling':
+            allocation = np.broadcast_to(water_filling_allocation(max_conv, K, min_budgets, total_budget), mean_convs.shape)
+        else:
+            allocation = softmax_allocation(mean_convs, min_budgets, total_budget)
+        return allocation, (conversions_from_spend(allocation, max_conv, K) * noise_factor).sum(axis=-1)
+
+    def replace_channel(base_convs, channel_convs):
+        """base_convs (..., C) repeated per parameter, with each parameter's own channel replaced"""
+        convs = np.repeat(base_convs[None], len(parameters), axis=0)
+        for c in range(n_channels):
+            rows = slice(c * per_channel, (c + 1) * per_channel)
+            convs[rows, ..., c] = channel_convs[c]
+        return convs
+
+    # One at a time: the base run plus 2 scenarios per parameter, per channel
+    with stage_timer('sensitivity_one_at_a_time'):
+        # (direction, parameter of this channel, metric, bound) scale factors
+        oat_factors = np.ones((2, per_channel, len(METRICS), len(BOUNDS)))
+        flat = oat_factors.reshape(2, per_channel, per_channel)
+        flat[0, np.arange(per_channel), np.arange(per_channel)] = 1 - step
+        flat[1, np.arange(per_channel), np.arange(per_channel)] = 1 + step
+
+        base_convs = np.empty(n_channels)
+        oat_convs = np.empty((n_channels, 2, per_channel))
+        for c in range(n_channels):
+            scenarios = np.concatenate([base[c][None], parameter_scenarios(base[c], oat_factors)])
+            means = funnel_means(scenarios, z_funnel[:, :, c], initial_alloc)
+            base_convs[c], oat_convs[c] = means[0], means[1:].reshape(2, per_channel)
+        base_allocation, base_total = outcomes(base_convs)
+        low = outcomes(replace_channel(base_convs, oat_convs[:, 0]))
+        high = outcomes(replace_channel(base_convs, oat_convs[:, 1]))
+
+    result = {
+        'channels': channels,
+        'parameters': parameters,
+        'step': step,
+        'base': {'allocation': base_allocation, 'total_conversions': float(base_total)},
+        'one_at_a_time': {
+            'low': {'allocation': low[0], 'total_conversions': low[1]},
+            'high': {'allocation': high[0], 'total_conversions': high[1]},
+        },
+    }
+    if not sobol_samples:
+        return result
+
+    # Global: A and B sample matrices, and A with one parameter taken from B, per channel
+    with stage_timer('sensitivity_sobol'):
+        shape = (sobol_samples, n_channels, len(METRICS), len(BOUNDS))
+        A, B = rng.uniform(1 - step, 1 + step, (2, *shape))
+        convs_A, convs_B = np.empty((sobol_samples, n_channels)), np.empty((sobol_samples, n_channels))
+        convs_AB = np.empty((n_channels, per_channel, sobol_samples))
+        for c in range(n_channels):
+            AB = np.repeat(A[None, :, c], per_channel, axis=0).reshape(per_channel, sobol_samples, per_channel)
+            B_flat = B[:, c].reshape(sobol_samples, per_channel)
+            AB[np.arange(per_channel), :, np.arange(per_channel)] = B_flat.T
+            factors = np.concatenate([A[:, c], B[:, c], AB.reshape(-1, len(METRICS), len(BOUNDS))])
+            means = funnel_means(parameter_scenarios(base[c], factors), z_funnel[:, :, c], initial_alloc)
+            convs_A[:, c], convs_B[:, c] = means[:sobol_samples], means[sobol_samples:2 * sobol_samples]
+            convs_AB[c] = means[2 * sobol_samples:].reshape(per_channel, sobol_samples)
+
+        f_A, f_B, f_AB = (
+            np.concatenate([allocation, total[..., None]], axis=-1)
+            for allocation, total in (
+                outcomes(convs_A), outcomes(convs_B), outcomes(replace_channel(convs_A, convs_AB))
+            )
+        )
+        first, total = sobol_indices(f_A, f_B, f_AB)
+
+    result['sobol'] = {
+        'samples': sobol_samples,
+        'first_order': {'allocation': first[:, :-1], 'total_conversions': first[:, -1]},
+        'total_order': {'allocation': total[:, :-1], 'total_conversions': total[:, -1]},
+    }
+    return result
+
+def tornado(result, channel=None):
+    """
+    Tornado rows for total conversions (or a channel's allocation), sorted by swing:
+    [{'channel', 'metric', 'bound', 'low', 'high', 'swing'}, ...], skipping parameters
+    that do not move the output.
+    """
+    oat = result['one_at_a_time']
+    if channel is None:
+        low, high = oat['low']['total_conversions'], oat['high']['total_conversions']
+    else:
+        j = result['channels'].index(channel)
+        low, high = oat['low']['allocation'][:, j], oat['high']['allocation'][:, j]
+    swing = np.abs(high - low)
+    rows = [
+        {'channel': ch, 'metric': metric, 'bound': bound, 'low': float(low[i]), 'high': float(high[i]),
+         'swing': float(swing[i])}
+        for i, (ch, metric, bound) in enumerate(result['parameters']) if swing[i] > 0
+    ]
+    return sorted(rows, key=lambda row: -row['swing'])
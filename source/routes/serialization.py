@@ -0,0 +1,74 @@
+import json
+
+import numpy as np
+from flask import Response
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional: without it only JSON is offered
+    msgpack = None
+
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+# Older clients still send the unregistered name
+MSGPACK_ALIASES = (MSGPACK, 'application/x-msgpack')
+
+# confidence_intervals as {column: {row: value}} (what the UI reads) or
+# {'index': rows, column: [values]}
+LAYOUTS = ('nested', 'columnar')
+
+
+class NotAcceptable(ValueError):
+    pass
+
+
+def to_builtin(obj):
+    """default hook for NumPy values the encoders do not handle natively"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+def dumps_json(obj):
+    """Compact JSON bytes; NumPy arrays and scalars are encoded directly"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=to_builtin, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, default=to_builtin, separators=(',', ':')).encode()
+
+def dumps_msgpack(obj):
+    return msgpack.packb(obj, default=to_builtin, use_bin_type=True)
+
+def available_mimetypes():
+    return (JSON,) + (MSGPACK_ALIASES if msgpack is not None else ())
+
+def negotiate(request):
+    """
+    (mimetype, layout) for a request: the mimetype from the Accept header (JSON when
+    absent or */*), the layout from ?layout=. Raises NotAcceptable when neither JSON
+    nor an available binary format is accepted, ValueError for an unknown layout.
+    """
+    mimetype = request.accept_mimetypes.best_match(available_mimetypes()) if request.accept_mimetypes else JSON
+    if mimetype is None:
+        raise NotAcceptable(f"Supported response types: {', '.join(available_mimetypes())}")
+    layout = request.args.get('layout', 'nested')
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout '{layout}', expected one of {LAYOUTS}")
+    return mimetype, layout
+
+def dumps(obj, mimetype):
+    if mimetype in MSGPACK_ALIASES:
+        return dumps_msgpack(obj)
+    return dumps_json(obj)
+
+def encode_response(body, mimetype=JSON, status=200):
+    """Response with body encoded as mimetype"""
+    response = Response(dumps(body, mimetype), status=status, mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
@@ -0,0 +1,236 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+import time
+
+from flask import Blueprint, Response, current_app, jsonify, request, send_file
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip variants are built
+    brotli = None
+
+
+# Files at most this large are kept in memory; larger ones are sent with send_file,
+# which hands the open file to the server's wsgi.file_wrapper (sendfile where supported)
+MAX_MEMORY_SIZE = 256 * 1024
+# Below this compressing is not worth the extra header bytes
+MIN_COMPRESS_SIZE = 1024
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml', 'application/xml')
+
+SKIP_DIRS = {'__pycache__', 'node_modules', 'database'}
+SKIP_EXTENSIONS = ('.py', '.pyc', '.db', '.db-wal', '.db-shm', '.jsonl')
+
+# Build output under these prefixes has content-hashed file names
+IMMUTABLE_PREFIXES = ('static/', 'assets/')
+
+
+def get_correct_mime_type(filename):
+    """Get the correct MIME type for a file"""
+    if filename.endswith('.js') or filename.endswith('.mjs'):
+        return 'text/javascript'
+    elif filename.endswith('.css'):
+        return 'text/css'
+    elif filename.endswith('.json'):
+        return 'application/json'
+    elif filename.endswith('.html'):
+        return 'text/html'
+    elif filename.endswith('.png'):
+        return 'image/png'
+    elif filename.endswith('.jpg') or filename.endswith('.jpeg'):
+        return 'image/jpeg'
+    elif filename.endswith('.svg'):
+        return 'image/svg+xml'
+    elif filename.endswith('.ico'):
+        return 'image/x-icon'
+    else:
+        mime_type, _ = mimetypes.guess_type(filename)
+        return mime_type or 'application/octet-stream'
+
+
+class Asset:
+    """One file of the index: metadata, strong ETag and in-memory encodings"""
+
+    def __init__(self, path, relpath):
+        stat = os.stat(path)
+        self.path = path
+        self.relpath = relpath
+        self.mtime = stat.st_mtime
+        self.size = stat.st_size
+        self.mimetype = get_correct_mime_type(relpath)
+        if self.mimetype.startswith('text/'):
+            self.mimetype += '; charset=utf-8'
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.etag = hashlib.blake2b(data, digest_size=16).hexdigest()
+        self.identity = data if self.size <= MAX_MEMORY_SIZE else None
+        self.encodings = {}
+        if self.size >= MIN_COMPRESS_SIZE and self.mimetype.startswith(COMPRESSIBLE_TYPES):
+            variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                variants['br'] = brotli.compress(data, quality=11)
+            self.encodings = {name: body for name, body in variants.items() if len(body) < self.size}
+
+        if relpath.startswith(IMMUTABLE_PREFIXES):
+            self.cache_control = 'public, max-age=31536000, immutable'
+        else:
+            self.cache_control = 'no-cache'
+
+
+def accepted_encodings(header):
+    """Codings in an Accept-Encoding header with a non-zero q"""
+    accepted = set()
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class AssetIndex:
+    """
+    Every servable file under root, read once at startup.
+
+    Small files are held in memory with their gzip (and, if the brotli package is
+    installed, brotli) variants. Each file has a strong content-hash ETag, and the
+    conditional, Range and encoding-negotiation headers are answered without touching the
+    disk. Files larger than MAX_MEMORY_SIZE are streamed from disk with send_file (the
+    compressed variants of those stay in memory). With watch=True a daemon thread
+    re-scans root every interval seconds and rebuilds changed files, for dev mode.
+    """
+
+    def __init__(self, root, watch=False, interval=1.0):
+        self.root = os.path.abspath(root)
+        self.interval = interval
+        self.assets = {}
+        self._lock = threading.Lock()
+        self.rebuild()
+        if watch:
+            threading.Thread(target=self._watch, name='static-asset-watch', daemon=True).start()
+
+    def _scan(self):
+        """{relpath: (path, mtime, size)} of every servable file"""
+        found = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS and not d.startswith('.')]
+            for name in filenames:
+                if name.startswith('.') or name.endswith(SKIP_EXTENSIONS):
+                    continue
+                path = os.path.join(dirpath, name)
+                relpath = os.path.relpath(path, self.root).replace(os.sep, '/')
+                stat = os.stat(path)
+                found[relpath] = (path, stat.st_mtime, stat.st_size)
+        return found
+
+    def rebuild(self):
+        """Re-read new and changed files and drop deleted ones; returns the changed relpaths"""
+        found = self._scan()
+        with self._lock:
+            current = dict(self.assets)
+        changed = []
+        assets = {}
+        for relpath, (path, mtime, size) in found.items():
+            asset = current.get(relpath)
+            if asset is None or asset.mtime != mtime or asset.size != size:
+                try:
+                    asset = Asset(path, relpath)
+                except OSError:
+                    continue  # removed between the scan and the read
+                changed.append(relpath)
+            assets[relpath] = asset
+        changed.extend(set(current) - set(assets))
+        with self._lock:
+            self.assets = assets
+        return changed
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            self.rebuild()
+
+    def get(self, relpath):
+        return self.assets.get(relpath)
+
+    def __contains__(self, relpath):
+        return relpath in self.assets
+
+    def __len__(self):
+        return len(self.assets)
+
+    def response(self, asset, request):
+        """Response for asset honoring If-None-Match / If-Modified-Since, Range and Accept-Encoding"""
+        accepted = accepted_encodings(request.headers.get('Accept-Encoding'))
+        coding = next((c for c in ('br', 'gzip') if c in asset.encodings and c in accepted), None)
+        if 'Range' in request.headers:
+            coding = None  # byte ranges refer to the identity body
+
+        if coding:
+            response = Response(asset.encodings[coding], content_type=asset.mimetype)
+            response.headers['Content-Encoding'] = coding
+            etag = f'{asset.etag}-{coding}'
+        elif asset.identity is not None:
+            response = Response(asset.identity, content_type=asset.mimetype)
+            etag = asset.etag
+        else:
+            response = send_file(
+                asset.path, mimetype=asset.mimetype, etag=asset.etag,
+                last_modified=asset.mtime, conditional=True, max_age=None,
+            )
+            response.headers['Cache-Control'] = asset.cache_control
+            if asset.encodings:
+                response.vary.add('Accept-Encoding')
+            return response
+
+        response.set_etag(etag)
+        response.last_modified = asset.mtime
+        response.headers['Cache-Control'] = asset.cache_control
+        if asset.encodings:
+            response.vary.add('Accept-Encoding')
+        if coding:
+            return response.make_conditional(request)
+        return response.make_conditional(request, accept_ranges=True, complete_length=asset.size)
+
+
+# The React frontend, served from the AssetIndex in app.extensions['asset_index']
+frontend_bp = Blueprint('frontend', __name__)
+
+
+def serve_asset(relpath, not_found):
+    index = current_app.extensions['asset_index']
+    asset = index.get(relpath)
+    if asset is None:
+        return jsonify({"error": not_found}), 404
+    return index.response(asset, request)
+
+# Serve React static files with correct MIME types
+@frontend_bp.route('/static/<path:filename>')
+def serve_static(filename):
+    return serve_asset(f'static/{filename}', "Static file not found")
+
+# Handle Vite assets folder
+@frontend_bp.route('/assets/<path:filename>')
+def serve_assets(filename):
+    return serve_asset(f'assets/{filename}', "Asset not found")
+
+# Serve React app and handle client-side routing
+@frontend_bp.route('/', defaults={'path': ''})
+@frontend_bp.route('/<path:path>')
+def serve_react(path):
+    # If it's an API route, return 404
+    if path.startswith('api/'):
+        return jsonify({"error": "API endpoint not found"}), 404
+
+    # Known files are served from the index; all other routes get index.html (SPA fallback)
+    if path in current_app.extensions['asset_index']:
+        return serve_asset(path, "Static file not found")
+    return serve_asset('index.html', "Frontend not found. Make sure to build your React app first.")
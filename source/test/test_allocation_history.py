@@ -0,0 +1,133 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from flask import Flask
+from source.models.allocation_history import AllocationHistory, stable_hash
+from source.routes import budget
+from source.routes.budget import budget_bp
+from source.test.test_budget_api import fake_llm, temp_stores
+
+
+def make_run(company='Acme', goal='leads', budget=1000, seed=0):
+    return {
+        'company': company, 'goal': goal, 'budget': budget, 'priors_hash': 'p',
+        'inputs': {'company': company.lower(), 'budget': budget, 'options': {'seed': seed}},
+        'allocation': {'google': budget}, 'summary': {'index': ['google', 'total'], 'P10': [1, 1], 'mean': [2, 2], 'P90': [3, 3]},
+        'priors_ms': 1.0, 'simulation_ms': 2.0,
+    }
+
+
+class AllocationHistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.history = AllocationHistory(os.path.join(self.tmp.name, 'allocations.db'), batch_size=16)
+        self.addCleanup(self.history.close)
+
+    def test_batched_writes(self):
+        ids = [self.history.record(make_run(budget=i)) for i in range(100)]
+        self.assertTrue(self.history.flush(5))
+        self.assertEqual(len(self.history), 100)
+        self.assertEqual(self.history.stats['written'], 100)
+        self.assertLessEqual(self.history.stats['batches'], 100 // 16 + 2)
+        run = self.history.get(ids[7])
+        self.assertEqual((run['company'], run['budget'], run['allocation']), ('acme', 7, {'google': 7}))
+        self.assertEqual(run['inputs_hash'], stable_hash(make_run(budget=7)['inputs']))
+
+    def test_record_does_not_wait_for_commits(self):
+        gate = threading.Event()
+        with mock.patch.object(self.history, '_write', side_effect=lambda batch: gate.wait(5)):
+            started = time.perf_counter()
+            for i in range(50):
+                self.history.record(make_run(budget=i))
+            self.assertLess(time.perf_counter() - started, 0.5)
+            gate.set()
+            self.assertTrue(self.history.flush(5))
+
+    def test_full_queue_drops(self):
+        self.history.max_pending = 0
+        self.history.record(make_run())
+        self.assertEqual(self.history.stats['dropped'], 1)
+        self.history.flush(5)
+        self.assertEqual(len(self.history), 0)
+
+    def test_keyset_pagination(self):
+        for i in range(25):
+            self.history.record(make_run(company='Acme' if i % 2 else 'Other', budget=i))
+        self.history.flush(5)
+
+        seen, cursor = [], None
+        while True:
+            runs, cursor = self.history.page(company=' ACME ', limit=5, cursor=cursor)
+            seen.extend(run['budget'] for run in runs)
+            if cursor is None:
+                break
+        self.assertEqual(seen, list(range(23, 0, -2)))
+        self.assertEqual(len(self.history.page(goal='LEADS', limit=500)[0]), 25)
+        with self.assertRaises(ValueError):
+            self.history.page(cursor='not-a-cursor')
+
+    def test_find_reusable(self):
+        self.history.record(make_run(seed=0))
+        newest = self.history.record(make_run(seed=0))
+        self.history.flush(5)
+        inputs = make_run(seed=0)['inputs']
+        self.assertEqual(self.history.find_reusable(inputs, 'p')['id'], newest)
+        self.assertIsNone(self.history.find_reusable(inputs, 'other priors'))
+        self.assertIsNone(self.history.find_reusable(make_run(seed=1)['inputs'], 'p'))
+
+
+class AllocationHistoryApiTestCase(unittest.TestCase):
+    payload = {'company_name': 'TestCo', 'monthly_budget': 5000, 'primary_goal': 'leads', 'n_simulations': 1000, 'seed': 0}
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.register_blueprint(budget_bp, url_prefix='/api')
+        self.client = self.app.test_client()
+        temp_stores(self)
+        self.history = budget._allocation_history
+        patcher = mock.patch.object(budget, 'get_curves', lambda *args: {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.llm = mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=fake_llm).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_history_and_reuse(self):
+        first = self.client.post('/api/allocate', json=self.payload).get_json()
+        self.assertNotIn('reused', first)
+        self.history.flush(5)
+
+        reused = self.client.post('/api/allocate', json=dict(self.payload, reuse=True)).get_json()
+        self.assertTrue(reused.pop('reused'))
+        self.assertEqual(reused, first)
+        other = self.client.post('/api/allocate', json=dict(self.payload, seed=1, reuse=True)).get_json()
+        self.assertNotIn('reused', other)
+        self.assertEqual(self.llm.call_count, 1)
+        self.history.flush(5)
+
+        lookup = self.client.post('/api/allocations/lookup', json=self.payload)
+        self.assertEqual(lookup.get_json()['run_id'], first['run_id'])
+        self.assertEqual(self.client.post('/api/allocations/lookup', json=dict(self.payload, seed=2)).status_code, 404)
+        self.assertEqual(
+            self.client.post('/api/allocations/lookup', json=dict(self.payload, company_name='Uncached')).status_code, 404
+        )
+
+        run = self.client.get(f"/api/allocations/{first['run_id']}").get_json()
+        self.assertEqual(run['allocation'], first['allocation'])
+        self.assertEqual(run['confidence_intervals'], first['confidence_intervals'])
+        self.assertGreater(run['timing']['simulation_ms'], 0)
+        self.assertEqual(self.client.get('/api/allocations/unknown').status_code, 404)
+
+        page = self.client.get('/api/allocations?company=testco&limit=1').get_json()
+        self.assertEqual(page['runs'][0]['run_id'], other['run_id'])
+        page = self.client.get(f"/api/allocations?company=testco&limit=1&cursor={page['next_cursor']}").get_json()
+        self.assertEqual(page['runs'][0]['run_id'], first['run_id'])
+        self.assertIsNone(page['next_cursor'])
+        self.assertEqual(self.client.get('/api/allocations?cursor=bad').status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
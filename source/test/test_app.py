@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+import unittest
+from source.main import create_app
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class CreateAppTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.client = self.app.test_client()
+
+    def test_testing_config(self):
+        self.assertTrue(self.app.config['TESTING'])
+        self.assertEqual(self.app.config['SQLALCHEMY_DATABASE_URI'], 'sqlite://')
+        self.assertIn('asset_index', self.app.extensions)
+
+    def test_routes(self):
+        self.assertEqual(self.client.get('/api/health').status_code, 200)
+        self.assertEqual(self.client.get('/api/metrics').status_code, 200)
+        self.assertEqual(self.client.get('/api/unknown').status_code, 404)
+        # Source files next to the app are never served
+        self.assertNotEqual(self.client.get('/main.py').headers.get('Content-Type'), 'text/x-python')
+
+    def test_unknown_config(self):
+        with self.assertRaises(ValueError):
+            create_app('staging')
+
+    def test_startup_skips_heavy_imports(self):
+        code = (
+            "import sys, source.main; source.main.create_app('testing'); "
+            "print(','.join(m for m in ('pandas', 'matplotlib', 'json5', 'google.genai') if m in sys.modules))"
+        )
+        result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,25 @@
+import os
+import tempfile
+import threading
+import time
 import unittest
 import json
+from unittest import mock
 from flask import Flask
+from source.routes import budget, llm
 from source.routes.budget import budget_bp
+from source.models.allocation_history import AllocationHistory
+from source.models.curve_store import CurveStore
+from source.models.priors_cache import PriorsCache
+from source.routes.jobs import JobQueue
+from source.fixtures import PRIORS
 
 class BudgetApiTestCase(unittest.TestCase):
     def setUp(self):
         self.app = Flask(__name__)
         self.app.register_blueprint(budget_bp, url_prefix='/api')
         self.client = self.app.test_client()
+        temp_stores(self)
 
     def test_allocate_budget_success(self):
         payload = {
@@ -21,7 +33,8 @@ class BudgetApiTestCase(unittest.TestCase):
                 "linkedin_min": 20
             }
         }
-        response = self.client.post('/api/allocate', data=json.dumps(payload), content_type='application/json')
+        with mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=fake_llm):
+            response = self.client.post('/api/allocate', data=json.dumps(payload), content_type='application/json')
         self.assertEqual(response.status_code, 200)
         data = response.get_json()
         self.assertIn('allocation', data)
@@ -38,5 +51,371 @@ class BudgetApiTestCase(unittest.TestCase):
         data = response.get_json()
         self.assertIn('error', data)
 
+    def test_allocate_rejects_bad_n_simulations(self):
+        payload = {'company_name': 'TestCo', 'monthly_budget': 10000, 'primary_goal': 'leads'}
+        with mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=fake_llm) as llm:
+            for n_simulations in (0, -5, budget.MAX_SIMULATIONS + 1, 'many'):
+                with self.subTest(n_simulations=n_simulations):
+                    response = self.client.post('/api/allocate', json=dict(payload, n_simulations=n_simulations))
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn('n_simulations', response.get_json()['error'])
+        # Rejected before the priors lookup
+        llm.assert_not_called()
+
+    def test_allocate_rejects_bad_chunk_size(self):
+        payload = {'company_name': 'TestCo', 'monthly_budget': 10000, 'primary_goal': 'leads'}
+        with mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=fake_llm) as llm:
+            for chunk_size in (0, -5, 1, '100', 'big', budget.MAX_CHUNK_SIZE + 1):
+                with self.subTest(chunk_size=chunk_size):
+                    for endpoint in ('/api/allocate', '/api/allocate/stream'):
+                        response = self.client.post(endpoint, json=dict(payload, chunk_size=chunk_size))
+                        self.assertEqual(response.status_code, 400)
+                        self.assertIn('chunk_size', response.get_json()['error'])
+            response = self.client.post('/api/allocate', json=dict(payload, chunk_size=2048, tolerance=0.05))
+            self.assertEqual(response.status_code, 400)
+        llm.assert_not_called()
+
+    def test_unknown_strategy_fails_before_lookup(self):
+        payload = {'company_name': 'TestCo', 'monthly_budget': 10000, 'primary_goal': 'leads', 'strategy': 'bogus'}
+        with mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=fake_llm) as fetch, \
+                mock.patch.object(llm, 'stream_grounded_response') as stream:
+            for endpoint in ('/api/allocate', '/api/allocate/stream', '/api/allocate/sweep', '/api/allocate/sensitivity'):
+                with self.subTest(endpoint=endpoint):
+                    response = self.client.post(endpoint, json=dict(payload, budgets=[1000]))
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn('Unknown strategy', response.get_json()['error'])
+        fetch.assert_not_called()
+        stream.assert_not_called()
+
+    def test_bad_requests_keep_cached_priors(self):
+        payload = {'company_name': 'TestCo', 'monthly_budget': 10000, 'primary_goal': 'leads', 'n_simulations': 1000}
+        bad = (
+            {'strategy': 'bogus'}, {'chunk_size': 0}, {'seed': 'abc'}, {'variance_reduction': 'x'},
+            {'constraints': {'google_min': 'abc'}}, {'constraints': ['google_min']},
+        )
+        with mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=fake_llm) as fetch:
+            self.assertEqual(self.client.post('/api/allocate', json=payload).status_code, 200)
+            for fields in bad:
+                for endpoint in ('/api/allocate', '/api/allocate/stream'):
+                    with self.subTest(fields=fields, endpoint=endpoint):
+                        self.assertEqual(self.client.post(endpoint, json=dict(payload, **fields)).status_code, 400)
+            self.assertEqual(self.client.post('/api/allocate', json=payload).status_code, 200)
+        self.assertEqual(fetch.call_count, 1)
+
+    def test_malformed_priors_are_evicted(self):
+        payload = {'company_name': 'TestCo', 'monthly_budget': 10000, 'primary_goal': 'leads', 'n_simulations': 1000}
+        answers = [({'channel': {'myspace': {}}}, [], []), fake_llm('TestCo', 10000, 'leads')]
+        with mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=answers) as fetch:
+            response = self.client.post('/api/allocate', json=payload)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('myspace', response.get_json()['error'])
+            self.assertEqual(self.client.post('/api/allocate', json=payload).status_code, 200)
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_bad_seed_and_variance_reduction(self):
+        payload = {'company_name': 'TestCo', 'monthly_budget': 10000, 'primary_goal': 'leads', 'budgets': [1000]}
+        endpoints = (
+            '/api/allocate', '/api/allocate/batch', '/api/allocate/stream', '/api/allocate/sweep',
+            '/api/allocate/sensitivity', '/api/allocate/plan', '/api/allocate/portfolio',
+        )
+        with mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=fake_llm) as fetch:
+            for field, value in (('seed', 'abc'), ('seed', -1), ('seed', 1.5), ('variance_reduction', 'x')):
+                body = dict(payload, requests=[payload], total_budget=1000, accounts=[{}], **{field: value})
+                for endpoint in endpoints:
+                    with self.subTest(field=field, value=value, endpoint=endpoint):
+                        response = self.client.post(endpoint, json=body)
+                        self.assertEqual(response.status_code, 400)
+                        self.assertIn(field, response.get_json()['error'])
+        fetch.assert_not_called()
+
+def fake_llm(company_name, budget, goal):
+    if company_name == 'BrokenCo':
+        raise ValueError('LLM unavailable')
+    return {'channel': PRIORS, 'reasoning': f'{company_name} {goal}'}, ['https://a.example'], ['https://b.example']
+
+def temp_stores(test):
+    """Point the budget module's stores at a temp directory for one test; returns the directory"""
+    tmp = tempfile.TemporaryDirectory()
+    test.addCleanup(tmp.cleanup)
+    history = AllocationHistory(os.path.join(tmp.name, 'allocations.db'))
+    test.addCleanup(history.close)
+    stores = {
+        '_priors_cache': PriorsCache(path=os.path.join(tmp.name, 'priors_cache.db')),
+        '_curve_store': CurveStore(os.path.join(tmp.name, 'curves.db')),
+        '_allocation_history': history,
+    }
+    for name, store in stores.items():
+        patcher = mock.patch.object(budget, name, store)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    return tmp.name
+
+
+class BatchApiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.register_blueprint(budget_bp, url_prefix='/api')
+        self.client = self.app.test_client()
+        temp_stores(self)
+
+    def test_batch_streams_results_and_errors(self):
+        requests = [
+            {'company_name': 'TestCo', 'monthly_budget': 5000, 'primary_goal': 'generate_leads', 'constraints': {'google_min': 0.2}},
+            {'company_name': 'TestCo', 'monthly_budget': 8000, 'primary_goal': 'generate_leads'},
+            {'company_name': 'BrokenCo', 'monthly_budget': 5000, 'primary_goal': 'generate_leads'},
+            {'company_name': 'TestCo'},
+            {'company_name': 'OtherCo', 'monthly_budget': 3000, 'primary_goal': 'brand_awareness'},
+        ]
+        with mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=fake_llm) as llm:
+            response = self.client.post('/api/allocate/batch', json={'requests': requests, 'n_simulations': 2000, 'seed': 0})
+            lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        # One lookup per distinct (company, goal)
+        self.assertEqual(llm.call_count, 3)
+
+        by_index = {line['index']: line for line in lines}
+        self.assertEqual(sorted(by_index), [0, 1, 2, 3, 4])
+        self.assertIn('error', by_index[2])
+        self.assertIn('error', by_index[3])
+        for index, budget_ in ((0, 5000), (1, 8000), (4, 3000)):
+            result = by_index[index]['result']
+            self.assertAlmostEqual(sum(result['allocation'].values()), budget_)
+            self.assertIn('confidence_intervals', result)
+        self.assertEqual(by_index[4]['result']['explanation'], 'OtherCo brand_awareness')
+
+    def test_batch_item_errors_stay_per_item(self):
+        def curves(company_name, data):
+            if company_name == 'CurvelessCo':
+                raise RuntimeError('curve store unavailable')
+            return {}
+
+        requests = [
+            {'company_name': 'CurvelessCo', 'monthly_budget': 5000, 'primary_goal': 'generate_leads'},
+            7,
+            {'company_name': 'TestCo', 'monthly_budget': 5000, 'primary_goal': 'generate_leads'},
+        ]
+        with mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=fake_llm), \
+                mock.patch.object(budget, 'get_curves', side_effect=curves):
+            response = self.client.post('/api/allocate/batch', json={'requests': requests, 'n_simulations': 1000})
+            by_index = {line['index']: line for line in map(json.loads, response.get_data(as_text=True).splitlines())}
+        self.assertEqual(by_index[0]['error'], 'curve store unavailable')
+        self.assertIn('Expected an object', by_index[1]['error'])
+        self.assertIn('result', by_index[2])
+
+    def test_batch_rejects_non_list(self):
+        response = self.client.post('/api/allocate/batch', json={'requests': 'nope'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/allocate/batch', json={'requests': [], 'n_simulations': 0})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('n_simulations', response.get_json()['error'])
+
+
+class SweepApiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.register_blueprint(budget_bp, url_prefix='/api')
+        self.client = self.app.test_client()
+        temp_stores(self)
+
+    def test_sweep_over_budget_range(self):
+        payload = {
+            'company_name': 'TestCo', 'primary_goal': 'generate_leads',
+            'budget_range': {'start': 1000, 'stop': 20000, 'num': 40}, 'n_simulations': 2000, 'seed': 0,
+        }
+        with mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=fake_llm) as llm:
+            response = self.client.post('/api/allocate/sweep', json=payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(llm.call_count, 1)
+        data = response.get_json()
+        self.assertEqual(len(data['budgets']), 40)
+        self.assertEqual(set(data['allocation']), set(PRIORS))
+        self.assertEqual(len(data['conversions']['P90']['total']), 40)
+
+    def test_sweep_with_inline_priors(self):
+        response = self.client.post('/api/allocate/sweep', json={'priors': PRIORS, 'budgets': [1000, 2000]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()['allocation']['google']), 2)
+
+    def test_sweep_requires_budgets(self):
+        response = self.client.post('/api/allocate/sweep', json={'priors': PRIORS})
+        self.assertEqual(response.status_code, 400)
+
+    def test_sweep_grid_is_bounded(self):
+        for grid in ({'budget_range': {'start': 1, 'stop': 2, 'num': 10 ** 10}}, {'budgets': [1000] * 1001}):
+            with self.subTest(grid=list(grid)), mock.patch.object(budget.np, 'linspace') as linspace:
+                response = self.client.post('/api/allocate/sweep', json=dict(grid, priors=PRIORS))
+                self.assertEqual(response.status_code, 400)
+                self.assertRegex(response.get_json()['error'], '1,?000')
+                linspace.assert_not_called()
+
+    def test_total_draws_are_capped(self):
+        payloads = {
+            '/api/allocate/batch': {'requests': [{'company_name': 'TestCo', 'monthly_budget': 5000}] * 3},
+            '/api/allocate/sweep': {'budgets': [1000, 2000, 3000], 'priors': PRIORS},
+            '/api/allocate/sensitivity': {'monthly_budget': 5000, 'priors': PRIORS, 'sobol_samples': 0},
+            '/api/allocate/portfolio': {'total_budget': 5000, 'accounts': [{'id': 'a'}, {'id': 'b'}, {'id': 'c'}]},
+        }
+        with mock.patch.object(budget, 'MAX_REQUEST_DRAWS', 2000), \
+                mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=fake_llm) as fetch:
+            for endpoint, payload in payloads.items():
+                with self.subTest(endpoint=endpoint):
+                    response = self.client.post(endpoint, json=dict(payload, n_simulations=1000))
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn('over the limit of 2,000', response.get_json()['error'])
+        fetch.assert_not_called()
+
+
+class JobApiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.register_blueprint(budget_bp, url_prefix='/api')
+        self.client = self.app.test_client()
+        temp_stores(self)
+        patcher = mock.patch.object(budget, '_job_queue', JobQueue(max_workers=4, max_pending=8))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_submit_and_long_poll(self):
+        payload = {'company_name': 'TestCo', 'monthly_budget': 5000, 'primary_goal': 'generate_leads'}
+        with mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=fake_llm):
+            response = self.client.post('/api/allocate/jobs', json=payload)
+            self.assertEqual(response.status_code, 202)
+            job = response.get_json()
+            self.assertIn(job['status'], ('queued', 'running'))
+            polled = self.client.get(f"{job['status_url']}?wait=10").get_json()
+        self.assertEqual(polled['status'], 'done')
+        self.assertAlmostEqual(sum(polled['result']['allocation'].values()), 5000)
+        self.assertEqual(self.client.get('/api/allocate/jobs/unknown').status_code, 404)
+
+    def test_bad_wait_and_accept(self):
+        payload = {'company_name': 'TestCo', 'monthly_budget': 5000, 'primary_goal': 'generate_leads'}
+        with mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=fake_llm):
+            response = self.client.post('/api/allocate/jobs', json=payload, headers={'Accept': 'text/csv'})
+            self.assertEqual(response.status_code, 406)
+            job = self.client.post('/api/allocate/jobs', json=payload).get_json()
+            self.assertEqual(self.client.get(f"{job['status_url']}?wait=abc").status_code, 400)
+            for wait in ('-1', 'nan', 'inf'):
+                with self.subTest(wait=wait), mock.patch.object(budget, 'JOB_MAX_WAIT', 0.01):
+                    self.assertEqual(self.client.get(f"{job['status_url']}?wait={wait}").status_code, 200)
+
+    def test_failed_job_reports_error(self):
+        payload = {'company_name': 'BrokenCo', 'monthly_budget': 5000, 'primary_goal': 'generate_leads'}
+        with mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=fake_llm):
+            job = self.client.post('/api/allocate/jobs', json=payload).get_json()
+            polled = self.client.get(f"{job['status_url']}?wait=10").get_json()
+        self.assertEqual(polled['status'], 'error')
+        self.assertIn('LLM unavailable', polled['error'])
+
+    def test_identical_requests_share_one_llm_call(self):
+        def slow_llm(*args):
+            time.sleep(0.2)
+            return fake_llm(*args)
+
+        payload = {'company_name': 'TestCo', 'monthly_budget': 5000, 'primary_goal': 'generate_leads'}
+        with mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=slow_llm) as llm:
+            jobs = [self.client.post('/api/allocate/jobs', json=payload).get_json() for _ in range(4)]
+            results = [self.client.get(f"{job['status_url']}?wait=10").get_json() for job in jobs]
+        self.assertEqual(llm.call_count, 1)
+        self.assertTrue(all(r['status'] == 'done' for r in results))
+
+    def test_admission_control(self):
+        release = threading.Event()
+        budget._job_queue = JobQueue(max_workers=1, max_pending=1)
+        with mock.patch.object(budget, 'run_allocation', side_effect=lambda *args: release.wait(5)):
+            self.assertEqual(self.client.post('/api/allocate/jobs', json={}).status_code, 202)
+            response = self.client.post('/api/allocate/jobs', json={})
+            release.set()
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+
+
+def fake_stream(prompt_text):
+    answer = 'Here are the priors:\n```json\n' + json.dumps({'channel': PRIORS, 'reasoning': 'streamed'}) + '\n```\nThese estimates draw on published industry benchmarks [1].'
+    for start in range(0, len(answer), 40):
+        yield answer[start:start + 40], ['https://b.example'] if start == 0 else []
+
+
+def parse_sse(text):
+    events = []
+    for block in text.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines())
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+class StreamApiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.register_blueprint(budget_bp, url_prefix='/api')
+        self.client = self.app.test_client()
+        temp_stores(self)
+        self.payload = {'company_name': 'TestCo', 'monthly_budget': 5000, 'primary_goal': 'generate_leads', 'seed': 0}
+
+    def test_stream_events(self):
+        with mock.patch.object(llm, 'stream_grounded_response', side_effect=fake_stream):
+            response = self.client.post('/api/allocate/stream', json=self.payload)
+            events = parse_sse(response.get_data(as_text=True))
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        names = [name for name, _ in events]
+        # Priors are emitted as soon as the JSON block closes, before the LLM text ends
+        self.assertLess(names.index('priors'), len(names) - names[::-1].index('llm') - 1)
+        self.assertEqual(names.count('progress'), 20)
+        self.assertEqual(names[-1], 'result')
+
+        citations = dict(events)['citations']
+        self.assertEqual(citations['additional_info'], ['https://b.example'])
+        result = events[-1][1]
+        self.assertAlmostEqual(sum(result['allocation'].values()), 5000)
+        self.assertEqual(result['explanation'], 'streamed')
+        self.assertEqual(result['allocation'], events[-2][1]['allocation'])
+
+    def test_cached_priors_skip_llm(self):
+        with mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=fake_llm):
+            self.client.post('/api/allocate', json=self.payload)
+        with mock.patch.object(llm, 'stream_grounded_response') as stream:
+            events = parse_sse(self.client.post('/api/allocate/stream', json=self.payload).get_data(as_text=True))
+        stream.assert_not_called()
+        self.assertEqual(events[0][0], 'priors')
+        self.assertNotIn('llm', [name for name, _ in events])
+
+    def test_concurrent_streams_share_one_llm_call(self):
+        started = threading.Event()
+
+        def slow_stream(prompt_text):
+            started.set()
+            time.sleep(0.3)
+            yield from fake_stream(prompt_text)
+
+        results = [None] * 3
+
+        def post(i):
+            response = self.app.test_client().post('/api/allocate/stream', json=self.payload)
+            results[i] = parse_sse(response.get_data(as_text=True))
+
+        with mock.patch.object(llm, 'stream_grounded_response', side_effect=slow_stream) as stream:
+            threads = [threading.Thread(target=post, args=(0,))]
+            threads[0].start()
+            started.wait(5)
+            threads += [threading.Thread(target=post, args=(i,)) for i in (1, 2)]
+            for thread in threads[1:]:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(stream.call_count, 1)
+        names = [[name for name, _ in events] for events in results]
+        self.assertIn('llm', names[0])
+        for events in results:
+            self.assertEqual(events[-1][0], 'result')
+            self.assertEqual(events[-1][1]['allocation'], results[0][-1][1]['allocation'])
+
+    def test_unusable_priors_end_with_error(self):
+        def bad_stream(prompt_text):
+            yield '{"channel": {"myspace": {}}}', []
+        with mock.patch.object(llm, 'stream_grounded_response', side_effect=bad_stream):
+            events = parse_sse(self.client.post('/api/allocate/stream', json=self.payload).get_data(as_text=True))
+        self.assertEqual(events[-1][0], 'error')
+        self.assertEqual(len(budget._priors_cache), 0)
+
+
 if __name__ == '__main__':
     unittest.main()
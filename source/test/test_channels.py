@@ -0,0 +1,76 @@
+import unittest
+import numpy as np
+from source.bench.bench_channels import synthetic_registry
+from source.models.channels import ChannelRegistry, UnknownChannel, get_registry, set_registry
+from source.routes import llm
+from source.routes.optimization import calculate_budget_allocation, batch_budget_allocation
+from source.fixtures import PRIORS, ASSUMPTIONS
+from source.test.test_optimization import max_conv_dict, K_dict
+
+
+class ChannelRegistryTestCase(unittest.TestCase):
+    def test_default_registry_matches_original_model(self):
+        registry = get_registry()
+        self.assertEqual(sorted(registry.enabled), sorted(max_conv_dict))
+        max_conv, K = registry.curve_params(list(max_conv_dict))
+        np.testing.assert_array_equal(max_conv, list(max_conv_dict.values()))
+        np.testing.assert_array_equal(K, [K_dict[ch] for ch in max_conv_dict])
+
+    def test_aliases(self):
+        registry = get_registry()
+        self.assertEqual(registry.resolve('  Facebook '), 'meta')
+        self.assertEqual(registry.resolve('Google Ads'), 'google')
+        self.assertNotIn('myspace', registry)
+        with self.assertRaises(UnknownChannel):
+            registry.resolve('myspace')
+
+    def test_duplicate_names_rejected(self):
+        with self.assertRaises(ValueError):
+            ChannelRegistry([
+                {'name': 'a', 'max_conv': 1, 'K': 1},
+                {'name': 'b', 'aliases': ['A'], 'max_conv': 1, 'K': 1},
+            ])
+
+    def test_prompt_lists_enabled_channels(self):
+        registry = ChannelRegistry([
+            {'name': 'bing', 'label': 'Microsoft Ads', 'max_conv': 1, 'K': 1},
+            {'name': 'reddit', 'label': 'Reddit', 'max_conv': 1, 'K': 1},
+            {'name': 'x', 'label': 'X', 'enabled': False, 'max_conv': 1, 'K': 1},
+        ])
+        old = set_registry(registry)
+        self.addCleanup(set_registry, old)
+        prompt = llm.system_prompt()
+        self.assertIn('across Microsoft Ads and Reddit for a given company', prompt)
+        self.assertIn('"bing": {', prompt)
+        self.assertIn('"reddit": {', prompt)
+        self.assertNotIn('"x": {', prompt)
+
+
+class RegistryAllocationTestCase(unittest.TestCase):
+    def test_aliased_priors_and_defaults(self):
+        priors = {'Google Ads': PRIORS['google'], 'Facebook': {'CPM': PRIORS['meta']['CPM']}, 'tiktok': {}}
+        summary, allocation = calculate_budget_allocation(priors, 6000, {'meta': 0.3}, seed=0)
+        self.assertEqual(list(allocation), ['google', 'meta', 'tiktok'])
+        self.assertGreaterEqual(allocation['meta'], 1800)
+        self.assertEqual(summary.index, ['google', 'meta', 'tiktok', 'total'])
+
+    def test_unknown_channel(self):
+        with self.assertRaises(UnknownChannel):
+            calculate_budget_allocation({'myspace': PRIORS['google']}, 1000, seed=0)
+        results = batch_budget_allocation([PRIORS, {'myspace': PRIORS['google']}], [1000, 1000], n_simulations=500, seed=0)
+        self.assertIsInstance(results[1], UnknownChannel)
+        self.assertAlmostEqual(sum(results[0][1].values()), 1000)
+
+    def test_many_channels(self):
+        old = set_registry(synthetic_registry(64))
+        self.addCleanup(set_registry, old)
+        priors = {f'channel_{i}': {} for i in range(64)}
+        for strategy in ('softmax', 'water_filling'):
+            summary, allocation = calculate_budget_allocation(priors, 64000, n_simulations=500, seed=0, strategy=strategy)
+            self.assertEqual(len(allocation), 64)
+            self.assertAlmostEqual(sum(allocation.values()), 64000)
+            self.assertEqual(summary.values.shape, (65, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
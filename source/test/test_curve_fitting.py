@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from flask import Flask
+from source.bench.bench_curves import TRUE_CURVES, synthetic_csv
+from source.models.curve_store import CurveStore
+from source import curve_fitting
+from source.routes import budget
+from source.routes.budget import budget_bp
+from source.curve_fitting import SpendAggregator, fit_curves, ingest
+from source.test.test_budget_api import fake_llm, temp_stores
+
+
+class CurveFittingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.csv = os.path.join(self.tmp.name, 'spend.csv')
+        synthetic_csv(200_000, self.csv)
+
+    def test_recovers_known_curves(self):
+        fits = fit_curves(ingest(self.csv), period_days=1)
+        self.assertEqual(len(fits), 8 * len(TRUE_CURVES))
+        for fit in fits:
+            max_conv, K = TRUE_CURVES[fit['channel']]
+            self.assertTrue(fit['identified'])
+            self.assertAlmostEqual(fit['max_conv'], max_conv, delta=4 * fit['max_conv_se'] + 0.02 * max_conv)
+            self.assertAlmostEqual(fit['K'], K, delta=4 * fit['K_se'] + 0.02 * K)
+            self.assertGreater(fit['max_conv_se'], 0)
+
+    def test_chunking_does_not_change_the_aggregate(self):
+        whole, chunked = ingest(self.csv), ingest(self.csv, chunk_rows=7_000)
+        self.assertEqual(whole.groups, chunked.groups)
+        np.testing.assert_allclose(whole.stats, chunked.stats)
+        np.testing.assert_array_equal(whole.spend_max, chunked.spend_max)
+
+    def test_rows_and_names(self):
+        aggregator = SpendAggregator()
+        aggregator.update(
+            'Acme', np.array(['Facebook', 'meta', 'Google Ads', 'newchannel', 'meta']),
+            [10, 20, 30, np.nan, -1], [1, 2, 3, 4, 5],
+        )
+        self.assertEqual(set(aggregator.groups), {('acme', 'meta'), ('acme', 'google')})
+        self.assertEqual((aggregator.n_rows, aggregator.n_skipped), (3, 2))
+
+    def test_linear_data_is_not_identified(self):
+        rng = np.random.default_rng(1)
+        spend = rng.uniform(10, 100, 50_000)
+        aggregator = SpendAggregator()
+        aggregator.update('Acme', np.full(len(spend), 'google'), spend, 0.05 * spend * (1 + 0.1 * rng.standard_normal(len(spend))))
+        self.assertFalse(fit_curves(aggregator)[0]['identified'])
+
+    def test_company_column_required(self):
+        path = os.path.join(self.tmp.name, 'single.csv')
+        with open(path, 'w') as f:
+            f.write('date,channel,spend,conversions\n2024-01-01,google,100,5\n')
+        with self.assertRaises(ValueError):
+            ingest(path)
+        self.assertEqual(set(ingest(path, company='Acme').groups), {('acme', 'google')})
+
+    def test_cli_stores_fits(self):
+        store_path = os.path.join(self.tmp.name, 'curves.db')
+        with mock.patch.dict(os.environ, {'CURVE_STORE_PATH': store_path}), mock.patch('builtins.print'):
+            curve_fitting.main([self.csv])
+        stored = CurveStore(store_path).get('Company 3')
+        self.assertEqual([fit['channel'] for fit in stored], sorted(TRUE_CURVES))
+        self.assertEqual(stored[0]['period_days'], 30)
+
+
+class CurveStoreApiTestCase(unittest.TestCase):
+    payload = {'company_name': 'TestCo', 'monthly_budget': 5000, 'primary_goal': 'generate_leads', 'seed': 0, 'strategy': 'water_filling'}
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.register_blueprint(budget_bp, url_prefix='/api')
+        self.client = self.app.test_client()
+        temp_stores(self)
+        self.store = budget._curve_store
+        fit = {
+            'max_conv_se': 1.0, 'K_se': 10.0, 'r2': 0.9, 'n_rows': 1000, 'spend_min': 10,
+            'spend_max': 500, 'period_days': 30,
+        }
+        self.store.save([
+            dict(fit, company='  testco ', channel='tiktok', max_conv=5000, K=500, identified=True),
+            dict(fit, company='TestCo', channel='meta', max_conv=1, K=1, identified=False),
+        ])
+
+    def test_store(self):
+        self.assertEqual(self.store.curves('TESTCO'), {'tiktok': (5000, 500)})
+        self.assertEqual(len(self.store.get('testco')), 2)
+        self.assertEqual(self.store.curves('other'), {})
+
+    def test_allocation_uses_fitted_curves(self):
+        with mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=fake_llm):
+            fitted = self.client.post('/api/allocate', json=self.payload).get_json()
+            default = self.client.post('/api/allocate', json=dict(self.payload, use_fitted_curves=False)).get_json()
+        self.assertEqual(fitted['fitted_curves'], ['tiktok'])
+        self.assertNotIn('fitted_curves', default)
+        self.assertGreater(fitted['allocation']['tiktok'], default['allocation']['tiktok'])
+
+        response = self.client.get('/api/curves/TestCo').get_json()
+        self.assertEqual([curve['channel'] for curve in response['curves']], ['meta', 'tiktok'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import time
+import unittest
+from unittest import mock
+from flask import Flask
+from source.routes import budget, instrumentation
+from source.routes.budget import budget_bp
+from source.routes.instrumentation import Counter, Histogram, SlowRequestProfiler, REGISTRY
+from source.test.test_budget_api import fake_llm, temp_stores
+
+
+class MetricsTestCase(unittest.TestCase):
+    def test_histogram_render(self):
+        hist = Histogram('test_seconds', 'Test histogram', ['stage'], buckets=(0.1, 1))
+        self.addCleanup(REGISTRY.remove, hist)
+        for value in (0.05, 0.1, 0.5, 3):
+            hist.observe(value, stage='a')
+        lines = hist.render()
+        self.assertIn('# TYPE test_seconds histogram', lines)
+        self.assertIn('test_seconds_bucket{stage="a",le="0.1"} 2', lines)
+        self.assertIn('test_seconds_bucket{stage="a",le="1"} 3', lines)
+        self.assertIn('test_seconds_bucket{stage="a",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_count{stage="a"} 4', lines)
+        self.assertEqual(hist.count(stage='a'), 4)
+
+    def test_counter(self):
+        counter = Counter('test_total', 'Test counter', ['result'])
+        self.addCleanup(REGISTRY.remove, counter)
+        counter.inc(result='hit')
+        counter.inc(2, result='hit')
+        self.assertEqual(counter.value(result='hit'), 3)
+        self.assertIn('test_total{result="hit"} 3', counter.render())
+
+
+class MetricsApiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.register_blueprint(budget_bp, url_prefix='/api')
+        self.client = self.app.test_client()
+        self.tmp = temp_stores(self)
+
+    def test_allocation_stages_are_recorded(self):
+        before = {
+            stage: instrumentation.STAGE_SECONDS.count(stage=stage)
+            for stage in (
+                'llm_fetch', 'funnel_simulation', 'saturation_simulation', 'summary', 'summary_layout', 'serialization',
+            )
+        }
+        hits = instrumentation.PRIORS_CACHE.value(result='hit')
+        payload = {'company_name': 'TestCo', 'monthly_budget': 5000, 'primary_goal': 'generate_leads'}
+        with mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=fake_llm):
+            for _ in range(2):
+                self.assertEqual(self.client.post('/api/allocate', json=payload).status_code, 200)
+
+        self.assertEqual(instrumentation.STAGE_SECONDS.count(stage='llm_fetch'), before['llm_fetch'] + 1)
+        # One sample per request in every stage after the lookup
+        for stage in ('funnel_simulation', 'saturation_simulation', 'summary', 'summary_layout', 'serialization'):
+            self.assertEqual(instrumentation.STAGE_SECONDS.count(stage=stage), before[stage] + 2)
+        self.assertEqual(instrumentation.PRIORS_CACHE.value(result='hit'), hits + 1)
+
+        response = self.client.get('/api/metrics')
+        self.assertEqual(response.status_code, 200)
+        text = response.get_data(as_text=True)
+        self.assertIn('allocation_stage_seconds_bucket{stage="llm_fetch",le="+Inf"}', text)
+        self.assertIn('http_request_duration_seconds_count{endpoint="budget.allocate_budget"}', text)
+
+    def test_slow_request_profiler(self):
+        profiler = SlowRequestProfiler(threshold=0, directory=os.path.join(self.tmp, 'profiles'), interval=0.001)
+        with mock.patch.object(budget, '_slow_request_profiler', profiler):
+            def slow_llm(*args):
+                time.sleep(0.05)
+                return fake_llm(*args)
+            payload = {'company_name': 'SlowCo', 'monthly_budget': 5000, 'primary_goal': 'generate_leads'}
+            with mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=slow_llm):
+                self.client.post('/api/allocate', json=payload)
+
+        profiles = os.listdir(profiler.directory)
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].endswith('budget.allocate_budget.folded'))
+        with open(os.path.join(profiler.directory, profiles[0])) as f:
+            self.assertIn('slow_llm', f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,240 @@
+import os
+import subprocess
+import sys
+import threading
+import unittest
+import numpy as np
+from source.routes.optimization import (
+    calculate_budget_allocation, conversions_from_spend, sample_param,
+    water_filling_allocation, budget_sweep, iter_budget_allocation
+)
+from source.routes.parallel import shard_sizes
+from source.routes.quantiles import QuantileSketch
+from source.fixtures import PRIORS, ASSUMPTIONS
+
+# Curve parameters of the original hardcoded model, as in the default channel registry
+max_conv_dict = {'google': 600, 'linkedin': 200, 'meta': 150, 'tiktok': 100}
+K_dict = {'google': 2000, 'linkedin': 1000, 'meta': 800, 'tiktok': 500}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def loop_reference(priors, total_budget, assumptions, n_simulations):
+    """The original scalar-loop implementation, kept to check the vectorized engine against."""
+    channels = list(priors.keys())
+    mean_convs = []
+    for ch in channels:
+        budget = total_budget / len(channels)
+        conv_list = []
+        for _ in range(n_simulations):
+            cpm = sample_param(priors[ch]['CPM'])
+            ctr = sample_param(priors[ch]['CTR'])
+            cvr = sample_param(priors[ch]['CVR'])
+            conv_list.append(budget / cpm * 1000 * ctr * cvr)
+        mean_convs.append(np.mean(conv_list))
+    mean_convs = np.array(mean_convs)
+    min_budgets = {ch: frac * total_budget for ch, frac in assumptions.items()}
+    remaining = total_budget - sum(min_budgets.values())
+    w = np.exp(mean_convs - mean_convs.max())
+    w = w / w.sum()
+    alloc = {ch: min_budgets[ch] + remaining * wi for ch, wi in zip(channels, w)}
+    totals = []
+    for _ in range(n_simulations):
+        total = 0
+        for ch, b in alloc.items():
+            c = conversions_from_spend(b, max_conv_dict[ch], K_dict[ch])
+            total += max(0, c + np.random.normal(0, 0.05 * c))
+        totals.append(total)
+    return alloc, np.mean(totals), np.percentile(totals, 10), np.percentile(totals, 90)
+
+
+class OptimizationTestCase(unittest.TestCase):
+    def test_summary_shape(self):
+        summary, allocation = calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, seed=0)
+        self.assertEqual(list(summary.index), list(PRIORS) + ['total'])
+        self.assertEqual(list(summary.columns), ['P10', 'mean', 'P90'])
+        self.assertEqual(set(allocation), set(PRIORS))
+        self.assertAlmostEqual(sum(allocation.values()), 10000)
+
+    def test_seed_is_reproducible(self):
+        first, _ = calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, seed=42)
+        second, _ = calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, seed=42)
+        np.testing.assert_array_equal(first.values, second.values)
+
+    def test_matches_loop_reference(self):
+        np.random.seed(0)
+        alloc, mean, p10, p90 = loop_reference(PRIORS, 10000, ASSUMPTIONS, 2000)
+        summary, allocation = calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, n_simulations=20000, seed=0)
+        for ch in PRIORS:
+            self.assertAlmostEqual(allocation[ch], alloc[ch], delta=10000 * 0.02)
+        self.assertAlmostEqual(summary.loc['total', 'mean'], mean, delta=mean * 0.02)
+        self.assertAlmostEqual(summary.loc['total', 'P10'], p10, delta=mean * 0.02)
+        self.assertAlmostEqual(summary.loc['total', 'P90'], p90, delta=mean * 0.02)
+
+    def test_missing_assumptions(self):
+        _, allocation = calculate_budget_allocation(PRIORS, 5000, seed=1)
+        self.assertAlmostEqual(sum(allocation.values()), 5000)
+
+    def test_chunked_matches_in_memory(self):
+        exact, alloc = calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, n_simulations=200000, seed=3)
+        chunked, chunked_alloc = calculate_budget_allocation(
+            PRIORS, 10000, ASSUMPTIONS, n_simulations=200000, seed=3, chunk_size=30000
+        )
+        self.assertEqual(list(chunked.index), list(exact.index))
+        np.testing.assert_allclose(chunked.values, exact.values, rtol=0.01)
+        error = chunked.attrs['estimator_error']
+        self.assertEqual(error['n_simulations'], 200000)
+        self.assertLess(error['quantile_rank_error'], 0.01)
+
+    def test_parallel_is_reproducible(self):
+        kwargs = dict(n_simulations=120000, seed=7, chunk_size=20000, n_workers=2)
+        first, alloc = calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, **kwargs)
+        second, _ = calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, **kwargs)
+        np.testing.assert_array_equal(first.values, second.values)
+        exact, _ = calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, n_simulations=120000, seed=7)
+        np.testing.assert_allclose(first.values, exact.values, rtol=0.01)
+        self.assertEqual(first.attrs['estimator_error']['n_simulations'], 120000)
+
+    def test_parallel_more_workers_than_simulations(self):
+        self.assertEqual(shard_sizes(3, 4), [1, 1, 1])
+        with self.assertRaises(ValueError):
+            shard_sizes(0, 2)
+        summary, alloc = calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, seed=1, n_simulations=3, n_workers=4)
+        self.assertTrue(np.isfinite(list(alloc.values())).all())
+        self.assertAlmostEqual(sum(alloc.values()), 10000)
+        self.assertTrue(np.isfinite(summary.values).all())
+
+    def test_parallel_pools_of_different_sizes_coexist(self):
+        # A request with another worker count must not shut down a pool in use
+        errors = []
+
+        def run(n_workers):
+            try:
+                for _ in range(3):
+                    calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, n_simulations=20000, seed=1, n_workers=n_workers)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(n,)) for n in (2, 3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_parallel_shared_memory_is_not_leaked(self):
+        code = (
+            "from source.routes.optimization import calculate_budget_allocation\n"
+            "from source.fixtures import PRIORS, ASSUMPTIONS\n"
+            "calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, seed=1, n_simulations=200000, n_workers=2)\n"
+        )
+        result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+        self.assertNotIn('leaked', result.stderr)
+        self.assertNotIn('No such file', result.stderr)
+
+    def test_adaptive_reports_draws_used(self):
+        loose, _ = calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, n_simulations=2 ** 20, seed=5, tolerance=0.05)
+        tight, _ = calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, n_simulations=2 ** 20, seed=5, tolerance=0.002)
+        loose_error, tight_error = loose.attrs['estimator_error'], tight.attrs['estimator_error']
+        self.assertTrue(loose_error['converged'])
+        self.assertLess(loose_error['n_simulations'], tight_error['n_simulations'])
+        self.assertLessEqual(tight_error['n_simulations'], 2 ** 20)
+        self.assertEqual(set(tight_error['ci_half_width']), set(PRIORS) | {'total'})
+
+    def test_variance_reduction_options(self):
+        exact, _ = calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, n_simulations=200000, seed=9)
+        for method in ('antithetic', 'sobol'):
+            summary, _ = calculate_budget_allocation(
+                PRIORS, 10000, ASSUMPTIONS, n_simulations=2 ** 18, seed=9, tolerance=0.005, variance_reduction=method
+            )
+            np.testing.assert_allclose(summary['mean'], exact['mean'], rtol=0.01)
+        summary, _ = calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, seed=9, common_random_numbers=True)
+        np.testing.assert_allclose(summary['mean'], exact['mean'], rtol=0.02)
+        with self.assertRaises(ValueError):
+            calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, variance_reduction='lhs')
+
+    def test_water_filling_beats_softmax(self):
+        assumptions = {'google': 0.1, 'meta': 0.05}
+        softmax, softmax_alloc = calculate_budget_allocation(PRIORS, 10000, assumptions, seed=2)
+        optimal, optimal_alloc = calculate_budget_allocation(PRIORS, 10000, assumptions, seed=2, strategy='water_filling')
+        self.assertAlmostEqual(sum(optimal_alloc.values()), 10000)
+        self.assertGreaterEqual(optimal_alloc['google'], 1000)
+        self.assertGreater(optimal.loc['total', 'mean'], softmax.loc['total', 'mean'])
+        with self.assertRaises(ValueError):
+            calculate_budget_allocation(PRIORS, 10000, assumptions, strategy='greedy')
+
+    def test_budget_sweep_matches_single_calls(self):
+        budgets = np.linspace(2000, 20000, 7)
+        sweep = budget_sweep(PRIORS, budgets, ASSUMPTIONS, n_simulations=50000, seed=4)
+        self.assertEqual(sweep['allocation'].shape, (7, 4))
+        np.testing.assert_allclose(sweep['allocation'].sum(axis=1), budgets)
+        # Shared draws: expected total conversions rise monotonically with budget
+        self.assertTrue(np.all(np.diff(sweep['mean'][:, -1]) > 0))
+        for i in (0, 6):
+            summary, allocation = calculate_budget_allocation(
+                PRIORS, budgets[i], ASSUMPTIONS, n_simulations=50000, seed=4, strategy='water_filling'
+            )
+            np.testing.assert_allclose(sweep['allocation'][i], list(allocation.values()))
+            np.testing.assert_allclose(sweep['mean'][i], summary['mean'], rtol=0.01)
+        softmax = budget_sweep(PRIORS, budgets, ASSUMPTIONS, n_simulations=5000, seed=4, strategy='softmax')
+        np.testing.assert_allclose(softmax['allocation'].sum(axis=1), budgets)
+
+    def test_progressive_matches_chunked(self):
+        steps = list(iter_budget_allocation(PRIORS, 10000, ASSUMPTIONS, n_simulations=5000, seed=6, chunk_size=1000))
+        self.assertEqual([stage for stage, *_ in steps], ['funnel'] * 5 + ['saturation'] * 5)
+        self.assertEqual([done for _, done, _, _ in steps], [1000, 2000, 3000, 4000, 5000] * 2)
+        summary, allocation = calculate_budget_allocation(
+            PRIORS, 10000, ASSUMPTIONS, n_simulations=5000, seed=6, chunk_size=1000
+        )
+        _, _, last_summary, last_allocation = steps[-1]
+        self.assertEqual(last_allocation, allocation)
+        np.testing.assert_allclose(last_summary.values, summary.values)
+
+
+class WaterFillingTestCase(unittest.TestCase):
+    def test_equal_marginal_returns(self):
+        max_conv, K = np.array([600., 200., 150., 100.]), np.array([2000., 1000., 800., 500.])
+        x = water_filling_allocation(max_conv, K, np.array([0., 0., 0., 900.]), 6000)
+        self.assertAlmostEqual(x.sum(), 6000)
+        marginal = max_conv * K / (x + K) ** 2
+        free = x > np.array([0., 0., 0., 900.]) + 1e-9
+        np.testing.assert_allclose(marginal[free], marginal[free][0])
+        self.assertTrue(np.all(marginal[~free] <= marginal[free][0] + 1e-12))
+
+    def test_batched_and_infeasible_minimums(self):
+        max_conv, K = np.array([600., 200.]), np.array([2000., 1000.])
+        mins = np.array([[0., 0.], [3000., 3000.]])
+        x = water_filling_allocation(max_conv, K, mins, np.array([5000., 3000.]))
+        np.testing.assert_allclose(x.sum(axis=-1), [5000., 3000.])
+        np.testing.assert_allclose(x[1], [1500., 1500.])
+        np.testing.assert_allclose(x[0], water_filling_allocation(max_conv, K, mins[0], 5000.))
+
+
+class QuantileSketchTestCase(unittest.TestCase):
+    def test_rank_error_within_bound(self):
+        rng = np.random.default_rng(0)
+        data = rng.lognormal(size=(500000, 2))
+        sketch = QuantileSketch(2, k=1024, rng=rng)
+        for block in np.array_split(data, 37):
+            sketch.update(block)
+        eps = sketch.relative_rank_error()
+        estimates = sketch.quantile([0.1, 0.5, 0.9])
+        for col in range(2):
+            ranks = np.searchsorted(np.sort(data[:, col]), estimates[:, col]) / len(data)
+            np.testing.assert_array_less(np.abs(ranks - [0.1, 0.5, 0.9]), eps + 1e-3)
+        np.testing.assert_allclose(sketch.mean(), data.mean(axis=0))
+        self.assertLess(sum(len(level) for level in sketch.levels), 1024 * 20)
+
+    def test_merge(self):
+        rng = np.random.default_rng(1)
+        data = rng.normal(size=(100000, 1))
+        left, right = QuantileSketch(1, k=512, rng=rng), QuantileSketch(1, k=512, rng=rng)
+        left.update(data[:60000])
+        right.update(data[60000:])
+        merged = left.merge(right)
+        self.assertEqual(merged.count, 100000)
+        self.assertAlmostEqual(merged.quantile(0.5)[0, 0], np.median(data), delta=0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+from source.bench.bench_parser import load_corpus
+from source.routes.budget import extract_citation_number
+from source.routes.llm import extract_json_loose, extract_sources_only
+from source.routes.parsing import LLMOutputParser, parse_llm_output, parse_block
+
+
+class ParserTestCase(unittest.TestCase):
+    def setUp(self):
+        self.corpus = load_corpus()
+
+    def test_corpus_parses(self):
+        for case in self.corpus:
+            with self.subTest(case['name']):
+                parsed = parse_llm_output(case['text'])
+                self.assertEqual(set(parsed.priors['channel']), {'google', 'meta', 'tiktok', 'linkedin'})
+                self.assertIn('reasoning', parsed.priors)
+                self.assertEqual(sorted(parsed.sources), [1, 2, 3, 4, 5])
+
+    def test_streamed_matches_one_shot(self):
+        for case in self.corpus:
+            text = case['text']
+            expected = parse_llm_output(text)
+            for size in (1, 7, 64):
+                with self.subTest(case['name'], chunk=size):
+                    parser = LLMOutputParser()
+                    for start in range(0, len(text), size):
+                        parser.feed(text[start:start + size])
+                    self.assertEqual(parser.close(), expected)
+
+    def test_priors_returned_once_block_closes(self):
+        parser = LLMOutputParser()
+        self.assertIsNone(parser.feed('Allocation for {company_name}:\n{"channel": {"google": '))
+        self.assertEqual(parser.feed('{}}, "reasoning": "x {y} [1]"}\n'), {'channel': {'google': {}}, 'reasoning': 'x {y} [1]'})
+        self.assertIsNone(parser.feed('Sources {ignored}\n[1] https://a.example/report.\n'))
+        parsed = parser.close()
+        self.assertEqual(parsed.sources, {1: 'https://a.example/report'})
+        self.assertEqual(parsed.citation_numbers, [1])
+
+    def test_source_entry_split_across_chunks(self):
+        parser = LLMOutputParser()
+        for chunk in ('{"a": 1}\n[2] ', 'https://b.exa', 'mple\n'):
+            parser.feed(chunk)
+        parsed = parser.close()
+        self.assertEqual(parsed.sources, {2: 'https://b.example'})
+        self.assertEqual(parsed.citation_numbers, [])
+
+    def test_parse_block_fallbacks(self):
+        self.assertEqual(parse_block("{'a': 1, 'b': [1, 2,],}"), {'a': 1, 'b': [1, 2]})
+        self.assertEqual(parse_block("{a: 1 /* comment */}"), {'a': 1})
+        with self.assertRaises(ValueError):
+            parse_block('[1, 2]')
+
+    def test_legacy_helpers(self):
+        text = 'Google converts best [1][3].\n{"channel": {}}\nSee https://a.example and [x].'
+        self.assertEqual(extract_json_loose(text), {'channel': {}})
+        self.assertEqual(extract_sources_only(text), ['https://a.example'])
+        self.assertEqual(extract_citation_number(text), [1, 3])
+        with self.assertRaises(ValueError):
+            extract_json_loose('no json here')
+
+
+if __name__ == '__main__':
+    unittest.main()
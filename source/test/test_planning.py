@@ -0,0 +1,146 @@
+import unittest
+import numpy as np
+from flask import Flask
+from source.models.channels import ChannelRegistry, get_registry
+from source.routes.budget import budget_bp
+from source.routes.optimization import calculate_budget_allocation, water_filling_allocation
+from source.routes.planning import adstock, marginal_returns, plan_budget_allocation, project_spend, solve_plan
+from source.test.test_budget_api import temp_stores
+from source.fixtures import PRIORS, ASSUMPTIONS
+
+
+def random_plan(n_months, n_channels, seed=0):
+    rng = np.random.default_rng(seed)
+    max_conv, K, decay = rng.uniform(50, 600, n_channels), rng.uniform(300, 2000, n_channels), rng.uniform(0, 0.8, n_channels)
+    budgets = rng.uniform(5000, 40000, n_months)
+    return max_conv, K, decay, budgets[:, None] * np.full(n_channels, 0.02), budgets
+
+
+class SolvePlanTestCase(unittest.TestCase):
+    def test_adstock(self):
+        effective = adstock([[100.0], [0.0], [50.0]], np.array([0.5]), carryover=40.0)
+        np.testing.assert_allclose(effective.ravel(), [120, 60, 80])
+
+    def test_project_spend(self):
+        target, weights = np.array([[5.0, 1.0, -2.0]]), np.array([[1.0, 2.0, 1.0]])
+        spend = project_spend(target, weights, np.zeros((1, 3)), np.array([4.0]))
+        # nu = 4 / 3 frees the first two entries; the third stays at its minimum
+        np.testing.assert_allclose(spend, [[11 / 3, 1 / 3, 0]])
+        spend = project_spend(target, weights, np.ones((1, 3)), np.array([3.0]))
+        np.testing.assert_allclose(spend, [[1, 1, 1]])
+
+    def test_without_adstock_matches_water_filling(self):
+        max_conv, K, _, min_budgets, budgets = random_plan(6, 5)
+        spend, effective, report = solve_plan(max_conv, K, np.zeros(5), min_budgets, budgets)
+        np.testing.assert_allclose(spend, water_filling_allocation(max_conv, K, min_budgets, budgets), rtol=1e-9)
+        np.testing.assert_array_equal(spend, effective)
+        self.assertTrue(report['converged'])
+
+    def test_kkt_conditions(self):
+        max_conv, K, decay, min_budgets, budgets = random_plan(12, 20)
+        spend, effective, report = solve_plan(max_conv, K, decay, min_budgets, budgets)
+        self.assertTrue(report['converged'])
+        np.testing.assert_allclose(spend.sum(axis=1), budgets)
+        self.assertTrue(np.all(spend >= min_budgets - 1e-9))
+
+        # Every month's free channels share one marginal return; channels at their minimum have less
+        gradient, _ = marginal_returns(effective, decay, max_conv, K)
+        free = spend > min_budgets + 1e-6
+        self.assertTrue(free.any(axis=1).all())
+        for t in range(12):
+            price = gradient[t, free[t]].max()
+            np.testing.assert_allclose(gradient[t, free[t]], price, rtol=1e-5)
+            self.assertTrue(np.all(gradient[t, ~free[t]] <= price * (1 + 1e-5)))
+
+    def test_flexible_moves_budget_between_months(self):
+        max_conv, K, decay, min_budgets, budgets = random_plan(12, 8)
+        fixed, fixed_effective, _ = solve_plan(max_conv, K, decay, min_budgets, budgets)
+        spend, effective, report = solve_plan(max_conv, K, decay, min_budgets, budgets, flexible=True)
+        self.assertTrue(report['converged'])
+        self.assertAlmostEqual(spend.sum(), budgets.sum(), delta=1e-6)
+        self.assertGreater(np.abs(spend.sum(axis=1) - budgets).max(), 1)
+        value = lambda effective: (max_conv * effective / (effective + K)).sum()
+        self.assertGreater(value(effective), value(fixed_effective))
+
+        # With only the total fixed, every free month and channel shares one marginal return
+        gradient, _ = marginal_returns(effective, decay, max_conv, K)
+        free = spend > min_budgets + 1e-6
+        np.testing.assert_allclose(gradient[free], gradient[free].max(), rtol=1e-5)
+
+
+class PlanBudgetAllocationTestCase(unittest.TestCase):
+    def test_plan(self):
+        plan = plan_budget_allocation(PRIORS, [10000] * 12, ASSUMPTIONS, n_simulations=1000, seed=0)
+        self.assertEqual(plan['channels'], list(PRIORS))
+        np.testing.assert_allclose(plan['decay'], get_registry().adstock[get_registry().indices(list(PRIORS))])
+        self.assertEqual(plan['allocation'].shape, (12, 4))
+        self.assertEqual(plan['mean'].shape, (12, 5))
+        self.assertTrue(np.all(plan['P10'] <= plan['mean']) and np.all(plan['mean'] <= plan['P90']))
+        np.testing.assert_allclose(plan['mean'][:, -1], plan['mean'][:, :-1].sum(axis=1))
+        self.assertAlmostEqual(plan['horizon'].loc['total', 'mean'], plan['expected_conversions'], delta=0.01 * plan['expected_conversions'])
+        self.assertGreaterEqual(plan['expected_conversions'], plan['myopic_conversions'])
+        # Carryover builds up, so later months convert more on the same budget
+        self.assertGreater(plan['mean'][-1, -1], plan['mean'][0, -1])
+
+    def test_without_adstock_matches_allocation(self):
+        decay = {ch: 0.0 for ch in PRIORS}
+        plan = plan_budget_allocation(PRIORS, [10000, 10000], ASSUMPTIONS, adstock_decay=decay, n_simulations=100, seed=0)
+        _, allocation = calculate_budget_allocation(PRIORS, 10000, ASSUMPTIONS, n_simulations=100, seed=0, strategy='water_filling')
+        np.testing.assert_allclose(plan['allocation'][0], list(allocation.values()), rtol=1e-9)
+        self.assertAlmostEqual(plan['expected_conversions'], plan['myopic_conversions'])
+
+    def test_carryover_and_validation(self):
+        cold = plan_budget_allocation(PRIORS, [10000] * 3, n_simulations=100, seed=0)
+        warm = plan_budget_allocation(PRIORS, [10000] * 3, carryover={'Facebook': 5000}, n_simulations=100, seed=0)
+        meta = warm['channels'].index('meta')
+        self.assertLess(warm['allocation'][0, meta], cold['allocation'][0, meta])
+        self.assertAlmostEqual(warm['effective_spend'][0, meta], warm['allocation'][0, meta] + 5000 * warm['decay'][meta])
+        # Overrides of channels outside the plan or the registry are ignored
+        ignored = plan_budget_allocation(
+            PRIORS, [10000] * 3, adstock_decay={'snapchat': 0.3}, carryover={'snapchat': 500}, n_simulations=100, seed=0
+        )
+        np.testing.assert_array_equal(ignored['allocation'], cold['allocation'])
+        with self.assertRaises(ValueError):
+            plan_budget_allocation(PRIORS, [10000], adstock_decay={'meta': 1.0})
+        with self.assertRaises(ValueError):
+            plan_budget_allocation(PRIORS, [])
+        with self.assertRaises(ValueError):
+            ChannelRegistry([{'name': 'a', 'max_conv': 1, 'K': 1, 'adstock': -0.1}])
+
+
+class PlanApiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.register_blueprint(budget_bp, url_prefix='/api')
+        self.client = self.app.test_client()
+        temp_stores(self)
+
+    def test_inline_priors(self):
+        payload = {
+            'monthly_budget': 10000, 'horizon': 6, 'seed': 0, 'n_simulations': 500, 'use_fitted_curves': False,
+            'priors': {'channel': PRIORS, 'reasoning': 'inline'}, 'adstock': {'google': 0.6},
+            'constraints': {f'{ch}_min': fraction for ch, fraction in ASSUMPTIONS.items()},
+        }
+        response = self.client.post('/api/allocate/plan', json=payload)
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['budgets'], [10000] * 6)
+        self.assertEqual(data['adstock']['google'], 0.6)
+        self.assertEqual(len(data['allocation']['meta']), 6)
+        self.assertAlmostEqual(sum(data['allocation'][ch][3] for ch in data['channels']), 10000)
+        self.assertEqual(len(data['conversions']['P90']['total']), 6)
+        self.assertEqual(set(data['horizon']), {'P10', 'mean', 'P90'})
+        self.assertEqual(data['explanation'], 'inline')
+
+        payload.update(monthly_budgets=[5000, 20000], flexible=True)
+        data = self.client.post('/api/allocate/plan', json=payload).get_json()
+        self.assertEqual(len(data['marginal_return']), 2)
+        self.assertTrue(data['solver']['converged'])
+
+    def test_bad_decay(self):
+        payload = {'monthly_budget': 1000, 'priors': PRIORS, 'adstock': {'google': 2}, 'use_fitted_curves': False}
+        self.assertEqual(self.client.post('/api/allocate/plan', json=payload).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
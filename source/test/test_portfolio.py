@@ -0,0 +1,135 @@
+import unittest
+import numpy as np
+from flask import Flask
+from source.routes import budget
+from source.routes.budget import budget_bp
+from source.routes.optimization import water_filling_allocation
+from source.routes.portfolio import portfolio_allocation, portfolio_model, solve_portfolio
+from source.test.test_budget_api import temp_stores
+
+
+def random_portfolio(n_accounts, n_channels=4, seed=0):
+    rng = np.random.default_rng(seed)
+    shape = (n_accounts, n_channels)
+    return rng.uniform(50, 600, shape), rng.uniform(300, 3000, shape), rng.uniform(0, 300, shape)
+
+
+class SolvePortfolioTestCase(unittest.TestCase):
+    def test_without_floors_matches_water_filling(self):
+        # With slack floors the portfolio is one big water filling over every account channel
+        max_conv, K, min_budgets = random_portfolio(50)
+        allocation, price, bound = solve_portfolio(max_conv, K, min_budgets, np.zeros(50), 200_000)
+        expected = water_filling_allocation(max_conv.ravel(), K.ravel(), min_budgets.ravel(), 200_000)
+        np.testing.assert_allclose(allocation.ravel(), expected, rtol=1e-9)
+        self.assertFalse(bound.any())
+        np.testing.assert_allclose(price, price[0])
+
+    def test_kkt_conditions_with_floors(self):
+        max_conv, K, min_budgets = random_portfolio(200)
+        floors = np.where(np.arange(200) % 4 == 0, 6000.0, 0.0)
+        allocation, price, bound = solve_portfolio(max_conv, K, min_budgets, floors, 400_000)
+
+        self.assertAlmostEqual(allocation.sum(), 400_000, delta=1e-6)
+        self.assertTrue(np.all(allocation >= min_budgets - 1e-9))
+        self.assertTrue(np.all(allocation.sum(axis=1) >= floors - 1e-6))
+        self.assertTrue(bound.any())
+        np.testing.assert_allclose(allocation[bound].sum(axis=1), floors[bound])
+
+        # Free channels earn their account's price; bound accounts earn less than the portfolio price
+        marginal = max_conv * K / (allocation + K) ** 2
+        free = allocation > min_budgets + 1e-6
+        np.testing.assert_allclose(marginal[free], np.broadcast_to(price[:, None], marginal.shape)[free], rtol=1e-7)
+        self.assertTrue(np.all(marginal[~free] <= price[np.nonzero(~free)[0]] * (1 + 1e-9)))
+        self.assertTrue(np.all(price[bound] < price[~bound].max()))
+
+    def test_infeasible_floors(self):
+        max_conv, K, min_budgets = random_portfolio(3)
+        with self.assertRaises(ValueError):
+            solve_portfolio(max_conv, K, min_budgets, [1000, 1000, 1000], 2000)
+        allocation, _, bound = solve_portfolio(max_conv, K, min_budgets, [1000, 1000, 1000], 3000)
+        np.testing.assert_allclose(allocation.sum(axis=1), 1000)
+        self.assertTrue(bound.all())
+
+
+class PortfolioAllocationTestCase(unittest.TestCase):
+    def test_mixed_channel_sets_and_fitted_curves(self):
+        channels, present, max_conv, K, fractions = portfolio_model(
+            [['Facebook', 'google'], None], [{'meta': 0.5, 'linkedin': 0.2}, None], [None, {'tiktok': (10, 20)}]
+        )
+        self.assertEqual(channels, ['google', 'meta', 'tiktok', 'linkedin'])
+        np.testing.assert_array_equal(present, [[True, True, False, False], [True, True, True, True]])
+        self.assertEqual(fractions[0].tolist(), [0, 0.5, 0, 0])
+        self.assertEqual((max_conv[0, 2], max_conv[1, 2], K[1, 2]), (0, 10, 20))
+
+    def test_portfolio_summary(self):
+        n = 300
+        channels_list = [['google', 'meta'] if i % 2 else None for i in range(n)]
+        floors = np.full(n, 1000.0)
+        result = portfolio_allocation(
+            channels_list, 500_000, floors, [{'google': 0.4}] * n, n_simulations=400, seed=0
+        )
+        allocation = result['allocation']
+        self.assertAlmostEqual(allocation.sum(), 500_000, delta=1e-6)
+        self.assertTrue(np.all(allocation[1::2, 2:] == 0))
+        self.assertTrue(np.all(allocation[:, 0] >= 400 - 1e-9))
+        np.testing.assert_allclose(result['account_spend'], allocation.sum(axis=1))
+
+        mean = result['mean']
+        self.assertTrue(np.all((result['P10'] < mean) & (mean < result['P90'])))
+        np.testing.assert_allclose(result['conversions'].sum(axis=1), mean)
+        portfolio = result['portfolio']
+        self.assertAlmostEqual(portfolio['mean'], mean.sum())
+        self.assertLess(portfolio['P10'], portfolio['mean'])
+        self.assertEqual(portfolio_allocation(channels_list, 500_000, floors, n_simulations=400, seed=0)['portfolio'],
+                         portfolio_allocation(channels_list, 500_000, floors, n_simulations=400, seed=0)['portfolio'])
+
+    def test_rejects_sobol(self):
+        with self.assertRaises(ValueError):
+            portfolio_allocation([None], 1000, variance_reduction='sobol')
+
+
+class PortfolioApiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.register_blueprint(budget_bp, url_prefix='/api')
+        self.client = self.app.test_client()
+        temp_stores(self)
+        budget._curve_store.save([{
+            'company': 'Acme', 'channel': 'tiktok', 'max_conv': 5000, 'K': 500, 'max_conv_se': 1.0, 'K_se': 1.0,
+            'r2': 0.9, 'n_rows': 100, 'spend_min': 1, 'spend_max': 100, 'period_days': 30, 'identified': True,
+        }])
+
+    def test_portfolio(self):
+        payload = {
+            'total_budget': 30000,
+            'seed': 0,
+            'n_simulations': 200,
+            'accounts': [
+                {'id': 'a', 'company_name': 'acme'},
+                {'id': 'b', 'company_name': 'Other', 'floor': 12000, 'channels': ['google', 'meta'],
+                 'constraints': {'meta_min': 0.5}},
+            ],
+        }
+        response = self.client.post('/api/allocate/portfolio', json=payload)
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['accounts'], ['a', 'b'])
+        self.assertEqual(data['fitted_curves'], 1)
+        self.assertEqual(data['present']['tiktok'], [True, False])
+        self.assertAlmostEqual(sum(data['account_spend']), 30000)
+        self.assertAlmostEqual(data['account_spend'][1], 12000)
+        self.assertGreaterEqual(data['allocation']['meta'][1], 6000)
+        self.assertEqual(data['floor_bound'], [False, True])
+
+        payload['accounts'][1]['floor'] = 40000
+        response = self.client.post('/api/allocate/portfolio', json=payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('floors', response.get_json()['error'])
+
+    def test_requires_accounts(self):
+        response = self.client.post('/api/allocate/portfolio', json={'total_budget': 1000})
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
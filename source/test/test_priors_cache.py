@@ -0,0 +1,93 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from source.models.priors_cache import PriorsCache, KeyNormalizer
+from source.routes import budget
+from source import prewarm
+from source.test.test_budget_api import temp_stores
+
+
+class PriorsCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'priors_cache.db')
+
+    def test_l1_then_l2_hits(self):
+        cache = PriorsCache(path=self.path)
+        self.assertIsNone(cache.get(('TestCo', 5000.0, 'generate_leads')))
+        cache.set(('TestCo', 5000.0, 'generate_leads'), [{'channel': {}}, [], []])
+        self.assertEqual(cache.get(('TestCo', 5000.0, 'generate_leads')), [{'channel': {}}, [], []])
+        self.assertEqual(cache.stats['l1_hits'], 1)
+        self.assertEqual(cache.stats['misses'], 1)
+
+        # A second instance stands in for another worker process sharing the file
+        other = PriorsCache(path=self.path)
+        self.assertEqual(other.get(('TestCo', 5000.0, 'generate_leads')), [{'channel': {}}, [], []])
+        self.assertEqual(other.stats['l2_hits'], 1)
+        other.get(('TestCo', 5000.0, 'generate_leads'))
+        self.assertEqual(other.stats['l1_hits'], 1)
+
+    def test_ttl_expiry(self):
+        cache = PriorsCache(path=self.path, ttl=0.05)
+        cache.set(('a',), 1)
+        self.assertEqual(cache.get(('a',)), 1)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get(('a',)))
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_eviction(self):
+        cache = PriorsCache(path=self.path, max_entries=2, l1_size=1)
+        cache.set(('a',), 1)
+        time.sleep(0.01)
+        cache.set(('b',), 2)
+        time.sleep(0.01)
+        cache.get(('a',))  # 'a' is now more recent than 'b'
+        time.sleep(0.01)
+        cache.set(('c',), 3)
+        fresh = PriorsCache(path=self.path)
+        self.assertEqual(fresh.get(('a',)), 1)
+        self.assertIsNone(fresh.get(('b',)))
+        self.assertEqual(fresh.get(('c',)), 3)
+        self.assertEqual(cache.stats['evictions'], 1)
+
+    def test_delete(self):
+        cache = PriorsCache(path=self.path)
+        cache.set(('a',), 1)
+        cache.delete(('a',))
+        self.assertIsNone(cache.get(('a',)))
+        self.assertIsNone(PriorsCache(path=self.path).get(('a',)))
+
+
+class KeyNormalizerTestCase(unittest.TestCase):
+    def test_folds_names_and_buckets_budgets(self):
+        normalize = KeyNormalizer()
+        self.assertEqual(normalize('  Acme   Corp ', 5001.0, 'Generate_Leads'), ('acme corp', 5000.0, 'generate_leads'))
+        self.assertEqual(normalize('ACME corp', 5000, 'generate_leads'), normalize('acme corp', 9999.99, 'generate_leads'))
+        self.assertNotEqual(normalize('acme', 4999, 'generate_leads'), normalize('acme', 5000, 'generate_leads'))
+        self.assertEqual(normalize('acme', 100, 'x')[1], 0.0)
+
+    def test_exact_budgets_without_edges(self):
+        normalize = KeyNormalizer(budget_edges=(), fold_names=False)
+        self.assertEqual(normalize('Acme', 5001, 'g'), ('Acme', 5001.0, 'g'))
+
+
+class PrewarmTestCase(unittest.TestCase):
+    def setUp(self):
+        temp_stores(self)
+
+    def test_prewarm_fills_all_goals_once(self):
+        fake = mock.Mock(return_value=({'channel': {}}, [], []))
+        with mock.patch.object(budget, 'callLLMForBudgetAllocation', fake):
+            warmed, skipped, failed = prewarm.prewarm(['Acme', 'acme ', 'Globex'], [5000, 5500], rate=0)
+            self.assertEqual((warmed, skipped, failed), (8, 0, 0))
+            self.assertEqual(prewarm.prewarm(['Acme'], [5000], rate=0), (0, 4, 0))
+            # A request in the same bucket is now served from cache
+            budget.get_priors('ACME', 7500.0, 'brand_awareness')
+        self.assertEqual(fake.call_count, 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
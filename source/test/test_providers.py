@@ -0,0 +1,131 @@
+import json
+import os
+import tempfile
+import unittest
+from flask import Flask
+from source.routes import budget, providers
+from source.routes.budget import budget_bp
+from source.routes.llm import get_grounded_response_citations
+from source.routes.providers import (
+    LLMProvider, LLMResponse, LLMError, CircuitBreaker, CircuitOpen, Backend, ReplayBackend, RecordingBackend
+)
+from source.test.test_budget_api import temp_stores
+from source.fixtures import PRIORS
+
+
+ANSWER = json.dumps({'channel': PRIORS, 'reasoning': 'recorded'}) + '\nSee https://a.example'
+
+
+class FlakyBackend(Backend):
+    """Fails the first `failures` calls, then answers with `text`"""
+
+    def __init__(self, failures, text=ANSWER):
+        self.failures = failures
+        self.text = text
+        self.calls = 0
+
+    def generate(self, prompt_text, timeout):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError('reset by peer')
+        return LLMResponse(self.text, ['https://b.example'])
+
+
+class ProviderTestCase(unittest.TestCase):
+    def make_provider(self, backend, **kwargs):
+        # No real sleeping between attempts
+        kwargs.setdefault('backoff_base', 0)
+        return LLMProvider(backend, **kwargs)
+
+    def test_retries_then_succeeds(self):
+        backend = FlakyBackend(failures=2)
+        response = self.make_provider(backend, max_retries=3).generate('prompt')
+        self.assertEqual(backend.calls, 3)
+        self.assertEqual(response.text, ANSWER)
+
+    def test_exhausted_retries_raise(self):
+        backend = FlakyBackend(failures=5)
+        with self.assertRaises(LLMError):
+            self.make_provider(backend, max_retries=3).generate('prompt')
+        self.assertEqual(backend.calls, 3)
+
+    def test_backoff_is_jittered_and_capped(self):
+        provider = LLMProvider(FlakyBackend(0), backoff_base=0.5, backoff_max=4)
+        delays = [provider.backoff(attempt) for attempt in range(10) for _ in range(20)]
+        self.assertTrue(all(0 <= d <= 4 for d in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test_parse_errors_are_retried_without_tripping_breaker(self):
+        backend = FlakyBackend(failures=0, text='not json')
+        provider = self.make_provider(backend, breaker=CircuitBreaker(failure_threshold=1))
+        with self.assertRaises(LLMError):
+            provider.generate('prompt', parse=lambda r: json.loads(r.text))
+        self.assertEqual(backend.calls, 3)
+        self.assertEqual(provider.breaker.state, 'closed')
+
+    def test_circuit_breaker_opens_and_recovers(self):
+        backend = FlakyBackend(failures=2)
+        provider = self.make_provider(backend, max_retries=1, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+        for _ in range(2):
+            with self.assertRaises(LLMError):
+                provider.generate('prompt')
+        with self.assertRaises(CircuitOpen):
+            provider.generate('prompt')
+        self.assertEqual(backend.calls, 2)
+
+        # After reset_timeout one trial call goes through and closes the circuit
+        provider.breaker._opened_at -= 60
+        self.assertEqual(provider.generate('prompt').text, ANSWER)
+        self.assertEqual(provider.breaker.state, 'closed')
+
+    def test_grounded_response_raises_instead_of_short_tuple(self):
+        old = providers.set_provider(self.make_provider(FlakyBackend(failures=10)))
+        self.addCleanup(providers.set_provider, old)
+        with self.assertRaises(LLMError):
+            get_grounded_response_citations('prompt')
+
+
+class ReplayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'replay.jsonl')
+        recorder = RecordingBackend(FlakyBackend(failures=0), self.path)
+        recorder.generate('recorded prompt', timeout=1)
+
+    def test_replay_serves_recorded_response(self):
+        backend = ReplayBackend(self.path, strict=True)
+        self.assertEqual(backend.generate('recorded prompt', timeout=1), LLMResponse(ANSWER, ['https://b.example']))
+        with self.assertRaises(KeyError):
+            backend.generate('other prompt', timeout=1)
+        # Non-strict replay answers any prompt
+        self.assertEqual(ReplayBackend(self.path).generate('other prompt', timeout=1).text, ANSWER)
+
+    def test_replay_stream_chunks(self):
+        chunks = list(ReplayBackend(self.path, chunk_chars=16).stream('recorded prompt', timeout=1))
+        self.assertEqual(''.join(text for text, _ in chunks), ANSWER)
+        self.assertEqual(chunks[0][1], ['https://b.example'])
+
+    def test_allocate_offline(self):
+        old = providers.set_provider(LLMProvider(ReplayBackend(self.path)))
+        self.addCleanup(providers.set_provider, old)
+        temp_stores(self)
+        app = Flask(__name__)
+        app.register_blueprint(budget_bp, url_prefix='/api')
+
+        payload = {'company_name': 'AnyCo', 'monthly_budget': 5000, 'primary_goal': 'generate_leads'}
+        response = app.test_client().post('/api/allocate', json=payload)
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['explanation'], 'recorded')
+        self.assertEqual(data['citations'], ['https://a.example'])
+
+        # Short goal names are accepted; unknown goals are not
+        payload['primary_goal'] = 'leads'
+        self.assertEqual(app.test_client().post('/api/allocate', json=payload).status_code, 200)
+        payload['primary_goal'] = 'world_domination'
+        self.assertEqual(app.test_client().post('/api/allocate', json=payload).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import copy
+import unittest
+import numpy as np
+from flask import Flask
+from source.routes.budget import budget_bp
+from source.routes.optimization import calculate_budget_allocation
+from source.routes.sensitivity import sensitivity_analysis, tornado
+from source.test.test_budget_api import temp_stores
+from source.fixtures import PRIORS, ASSUMPTIONS
+
+
+# Small enough that the softmax split is not saturated, so the priors matter
+BUDGET = 100
+
+
+class SensitivityTestCase(unittest.TestCase):
+    def test_base_matches_allocation(self):
+        result = sensitivity_analysis(PRIORS, BUDGET, ASSUMPTIONS, n_simulations=2000, seed=0, sobol_samples=0)
+        summary, allocation = calculate_budget_allocation(PRIORS, BUDGET, ASSUMPTIONS, n_simulations=2000, seed=0)
+        np.testing.assert_allclose(result['base']['allocation'], list(allocation.values()), rtol=1e-12)
+        self.assertAlmostEqual(result['base']['total_conversions'], summary.loc['total', 'mean'])
+        self.assertNotIn('sobol', result)
+
+    def test_one_at_a_time_matches_rerun(self):
+        result = sensitivity_analysis(PRIORS, BUDGET, ASSUMPTIONS, n_simulations=2000, seed=0, step=0.1, sobol_samples=0)
+        i = result['parameters'].index(('meta', 'CPM', 'mean'))
+        for direction, factor in (('low', 0.9), ('high', 1.1)):
+            priors = copy.deepcopy(PRIORS)
+            priors['meta']['CPM']['mean'] *= factor
+            summary, allocation = calculate_budget_allocation(priors, BUDGET, ASSUMPTIONS, n_simulations=2000, seed=0)
+            outputs = result['one_at_a_time'][direction]
+            np.testing.assert_allclose(outputs['allocation'][i], list(allocation.values()), rtol=1e-9)
+            self.assertAlmostEqual(outputs['total_conversions'][i], summary.loc['total', 'mean'])
+
+        rows = tornado(result)
+        self.assertEqual([row['swing'] for row in rows], sorted((row['swing'] for row in rows), reverse=True))
+        self.assertEqual((rows[0]['channel'], rows[0]['bound']), ('google', 'mean'))
+        self.assertEqual(len(tornado(result, channel='meta')), len(rows))
+
+    def test_sobol_indices(self):
+        result = sensitivity_analysis(PRIORS, BUDGET, ASSUMPTIONS, n_simulations=1000, seed=0, sobol_samples=256)
+        first, total = (result['sobol'][order]['total_conversions'] for order in ('first_order', 'total_order'))
+        top = {result['parameters'][i] for i in np.argsort(-total)[:3]}
+        self.assertEqual(top, {('google', metric, 'mean') for metric in ('CPM', 'CTR', 'CVR')})
+        self.assertAlmostEqual(total.sum(), 1, delta=0.2)
+        self.assertAlmostEqual(first.sum(), 1, delta=0.3)
+        self.assertEqual(result['sobol']['first_order']['allocation'].shape, (36, 4))
+
+    def test_water_filling_ignores_priors(self):
+        result = sensitivity_analysis(PRIORS, BUDGET, ASSUMPTIONS, n_simulations=500, seed=0,
+                                      strategy='water_filling', sobol_samples=16)
+        self.assertEqual(tornado(result), [])
+        self.assertFalse(result['sobol']['total_order']['allocation'].any())
+
+
+class SensitivityApiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.register_blueprint(budget_bp, url_prefix='/api')
+        self.client = self.app.test_client()
+        temp_stores(self)
+
+    def test_inline_priors(self):
+        payload = {
+            'company_name': 'TestCo', 'monthly_budget': BUDGET, 'primary_goal': 'leads', 'seed': 0,
+            'n_simulations': 1000, 'sobol_samples': 32, 'use_fitted_curves': False,
+            'priors': {'channel': PRIORS, 'reasoning': 'inline'},
+            'constraints': {f'{ch}_min': fraction for ch, fraction in ASSUMPTIONS.items()},
+        }
+        response = self.client.post('/api/allocate/sensitivity', json=payload)
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(len(data['parameters']), 36)
+        self.assertEqual(len(data['one_at_a_time']['high']['allocation']['meta']), 36)
+        self.assertEqual(data['tornado'][0]['bound'], 'mean')
+        self.assertEqual(set(data['sobol']), {'samples', 'first_order', 'total_order'})
+        self.assertEqual(data['explanation'], 'inline')
+
+        payload['sobol_samples'] = 0
+        self.assertNotIn('sobol', self.client.post('/api/allocate/sensitivity', json=payload).get_json())
+
+    def test_bad_step(self):
+        payload = {'monthly_budget': BUDGET, 'priors': PRIORS, 'step': 2, 'use_fitted_curves': False}
+        response = self.client.post('/api/allocate/sensitivity', json=payload)
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import json
+import unittest
+from unittest import mock
+import numpy as np
+from flask import Flask
+from source.routes import budget, serialization
+from source.routes.budget import budget_bp
+from source.routes.optimization import Summary
+from source.routes.serialization import dumps_json
+from source.test.test_budget_api import fake_llm, temp_stores
+
+
+class SummaryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.summary = Summary([1.0, 2.0, 3.0], np.array([1.5, 2.5, 4.0]), [2.0, 3.0, 5.0], ['google', 'meta', 'total'])
+
+    def test_access(self):
+        self.assertEqual(self.summary.loc['meta', 'P90'], 3.0)
+        np.testing.assert_array_equal(self.summary['mean'], [1.5, 2.5, 4.0])
+        self.assertEqual(self.summary.values.shape, (3, 3))
+
+    def test_layouts(self):
+        nested = self.summary.to_dict()
+        self.assertEqual(nested['P10'], {'google': 1.0, 'meta': 2.0, 'total': 3.0})
+        self.assertEqual(json.loads(dumps_json(nested)), nested)
+
+        columnar = json.loads(dumps_json(self.summary.to_dict('columnar')))
+        self.assertEqual(columnar, {
+            'index': ['google', 'meta', 'total'], 'P10': [1.0, 2.0, 3.0], 'mean': [1.5, 2.5, 4.0], 'P90': [2.0, 3.0, 5.0],
+        })
+        with self.assertRaises(ValueError):
+            self.summary.to_dict('rows')
+
+    def test_dumps_numpy_without_orjson(self):
+        body = {'a': np.arange(3.0), 'b': np.float64(0.5), 'c': np.int64(2), 'd': np.ones((2, 2)).T}
+        with mock.patch.object(serialization, 'orjson', None):
+            self.assertEqual(json.loads(dumps_json(body)), {'a': [0.0, 1.0, 2.0], 'b': 0.5, 'c': 2, 'd': [[1.0, 1.0], [1.0, 1.0]]})
+
+
+class NegotiationApiTestCase(unittest.TestCase):
+    payload = {'company_name': 'TestCo', 'monthly_budget': 5000, 'primary_goal': 'generate_leads', 'n_simulations': 2000, 'seed': 0}
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.register_blueprint(budget_bp, url_prefix='/api')
+        self.client = self.app.test_client()
+        temp_stores(self)
+        patcher = mock.patch.object(budget, 'callLLMForBudgetAllocation', side_effect=fake_llm)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_json_confidence_intervals_are_objects(self):
+        response = self.client.post('/api/allocate', json=self.payload)
+        self.assertEqual(response.mimetype, 'application/json')
+        intervals = response.get_json()['confidence_intervals']
+        self.assertEqual(set(intervals), {'P10', 'mean', 'P90'})
+        self.assertEqual(set(intervals['P10']), set(response.get_json()['allocation']) | {'total'})
+
+    def test_columnar_layout(self):
+        nested = self.client.post('/api/allocate', json=self.payload).get_json()
+        columnar = self.client.post('/api/allocate?layout=columnar', json=self.payload).get_json()
+        intervals = columnar['confidence_intervals']
+        for stat in ('P10', 'mean', 'P90'):
+            self.assertEqual(dict(zip(intervals['index'], intervals[stat])), nested['confidence_intervals'][stat])
+        self.assertEqual(self.client.post('/api/allocate?layout=rows', json=self.payload).status_code, 400)
+
+    def test_not_acceptable(self):
+        response = self.client.post('/api/allocate', json=self.payload, headers={'Accept': 'text/csv'})
+        self.assertEqual(response.status_code, 406)
+
+    @unittest.skipIf(serialization.msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        expected = self.client.post('/api/allocate', json=self.payload).get_json()
+        response = self.client.post('/api/allocate', json=self.payload, headers={'Accept': 'application/msgpack'})
+        self.assertEqual(response.mimetype, 'application/msgpack')
+        unpacked = serialization.msgpack.unpackb(response.data)
+        # Every run gets its own history id
+        self.assertNotEqual(unpacked.pop('run_id'), expected.pop('run_id'))
+        self.assertEqual(unpacked, expected)
+
+    @unittest.skipIf(serialization.msgpack is None, 'msgpack is not installed')
+    def test_batch_msgpack_stream(self):
+        requests = [dict(self.payload, monthly_budget=b) for b in (3000, 6000)] + [{'company_name': 'TestCo'}]
+        response = self.client.post(
+            '/api/allocate/batch?layout=columnar', json={'requests': requests, 'n_simulations': 1000},
+            headers={'Accept': 'application/x-msgpack'},
+        )
+        unpacker = serialization.msgpack.Unpacker()
+        unpacker.feed(response.data)
+        items = {item['index']: item for item in unpacker}
+        self.assertEqual(sorted(items), [0, 1, 2])
+        self.assertIn('error', items[2])
+        self.assertEqual(items[1]['result']['confidence_intervals']['index'][-1], 'total')
+
+    @unittest.skipIf(serialization.msgpack is None, 'msgpack is not installed')
+    def test_sweep_msgpack(self):
+        payload = {'priors': fake_llm('TestCo', 0, '')[0], 'budgets': [1000, 2000], 'n_simulations': 500, 'seed': 0}
+        expected = self.client.post('/api/allocate/sweep', json=payload).get_json()
+        response = self.client.post('/api/allocate/sweep', json=payload, headers={'Accept': 'application/msgpack'})
+        self.assertEqual(serialization.msgpack.unpackb(response.data), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
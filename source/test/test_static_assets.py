@@ -0,0 +1,90 @@
+import gzip
+import os
+import tempfile
+import unittest
+from flask import Flask, request
+from source.routes import static_assets
+from source.routes.static_assets import AssetIndex, accepted_encodings
+
+
+class AssetIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = self.tmp.name
+        self.js = b'export const answer = 42;\n' * 200
+        self.big = os.urandom(static_assets.MAX_MEMORY_SIZE + 1)
+        self.write('index.html', b'<html><body>app</body></html>')
+        self.write('assets/index-abc123.js', self.js)
+        self.write('assets/video.bin', self.big)
+        self.write('secret.py', b'SECRET = 1')
+
+        self.index = AssetIndex(self.root)
+        self.app = Flask(__name__, static_folder=None)
+
+        @self.app.route('/', defaults={'path': ''})
+        @self.app.route('/<path:path>')
+        def serve(path):
+            asset = self.index.get(path) or self.index.get('index.html')
+            return self.index.response(asset, request)
+
+        self.client = self.app.test_client()
+
+    def write(self, relpath, data):
+        path = os.path.join(self.root, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def test_index_skips_source_files(self):
+        self.assertIn('assets/index-abc123.js', self.index)
+        self.assertNotIn('secret.py', self.index)
+
+    def test_gzip_variant_and_304(self):
+        response = self.client.get('/assets/index-abc123.js', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.data), self.js)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+
+        etag = response.headers['ETag']
+        again = self.client.get('/assets/index-abc123.js', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.data, b'')
+
+    def test_identity_when_gzip_refused(self):
+        response = self.client.get('/assets/index-abc123.js', headers={'Accept-Encoding': 'gzip;q=0'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.data, self.js)
+
+    def test_range_request(self):
+        response = self.client.get('/assets/index-abc123.js', headers={'Range': 'bytes=0-5', 'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, self.js[:6])
+
+    def test_large_file_streamed_from_disk(self):
+        response = self.client.get('/assets/video.bin')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(self.index.get('assets/video.bin').identity)
+        self.assertEqual(response.data, self.big)
+        self.assertEqual(self.client.get('/assets/video.bin', headers={'If-None-Match': response.headers['ETag']}).status_code, 304)
+        response.close()
+
+    def test_spa_fallback_and_rebuild(self):
+        response = self.client.get('/dashboard/settings')
+        self.assertEqual(response.data, b'<html><body>app</body></html>')
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+
+        self.write('index.html', b'<html><body>v2</body></html>')
+        os.utime(os.path.join(self.root, 'index.html'), (1, 1))
+        self.assertEqual(self.index.rebuild(), ['index.html'])
+        self.assertEqual(self.client.get('/').data, b'<html><body>v2</body></html>')
+
+    def test_accepted_encodings(self):
+        self.assertEqual(accepted_encodings('gzip, br;q=0, deflate;q=0.5'), {'gzip', 'deflate'})
+        self.assertEqual(accepted_encodings(None), set())
+
+
+if __name__ == '__main__':
+    unittest.main()